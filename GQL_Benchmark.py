@@ -0,0 +1,971 @@
+import os
+import re
+import io
+import csv
+import sys
+import gzip
+import json
+import time
+import base64
+import hashlib
+from email.parser import BytesParser
+import random
+import string
+import argparse
+import tempfile
+import contextlib
+import statistics
+import threading
+import functools
+import multiprocessing
+from collections import Counter
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, SimpleHTTPRequestHandler, ThreadingHTTPServer
+from GQL_Data_Loader import (
+	GraphQLTransport, ETLDataGetter, iter_sheet_rows, operation_name, BATCH_MUTATIONS, UPLOAD_CONCURRENCY,
+	TRANSFORM_WORKERS, PURGE_BATCH_SIZE, PURGE_CONCURRENCY, IMAGE_CONCURRENCY, NAME_COL, SKU_COL, PRICE_COL, DESCRIPTION_COL,
+	WEIGHT_COL, CATEGORY_COL, IMAGE_COL, SEO_TITLE_COL, SEO_DESC_COL
+)
+
+# Benchmarks for GQL_Data_Loader against a local stub GraphQL server, so
+# loader performance can be measured without a live Saleor instance.
+# Usage: python GQL_Benchmark.py transport --requests 1000
+#        python GQL_Benchmark.py descriptions --sheet products.xlsx
+#        python GQL_Benchmark.py import --rows 5000 --depth 3 --latency 0.005
+#        python GQL_Benchmark.py images --rows 1000 --images 200
+#        python GQL_Benchmark.py suite --output bench.json
+
+BENCH_QUERY = """
+	query get_product($id: ID!) {
+		product(id: $id) {
+			id
+			name
+		}
+	}
+"""
+
+
+# Shape of the descriptions in our supplier sheets, used when no sheet is given
+SAMPLE_DESCRIPTION = """<div><h2>{name}</h2>
+<ul>
+<li><b>Part Number:</b> {sku}</li>
+<li>Fits {year} and newer models</li>
+<li>Remanufactured to OEM specifications</li>
+<li>Includes gaskets &amp; hardware</li>
+</ul>
+<h2 style="font-size: 32px;">Don't Like the Price?</h2>
+<input type="button" class="btn btn-primary" onclick="location.href='http://sandiegoengineparts.com/p/submit-your-price';" value="Submit Your Bid">
+</div>"""
+
+
+class StubGraphQLHandler(BaseHTTPRequestHandler):
+	# HTTP/1.1 so clients that send keep-alive get to reuse the connection
+	protocol_version = "HTTP/1.1"
+	# headers and body are written separately, avoid Nagle stalls on reused sockets
+	disable_nagle_algorithm = True
+
+	def do_POST(self):
+		length = int(self.headers.get("Content-Length", 0))
+		body = self.rfile.read(length)
+		if self.headers.get("Content-Encoding") == "gzip":
+			body = gzip.decompress(body)
+
+		if self.server.latency:
+			time.sleep(self.server.latency)
+
+		if self.server.inject_error():
+			self.send_response(503)
+			self.send_header("Content-Length", "0")
+			self.end_headers()
+			return
+
+		content_type = self.headers.get("Content-Type", "")
+		if content_type.startswith("multipart/form-data"):
+			request = self.server.parse_multipart(body, content_type)
+		else:
+			request = json.loads(body)
+		payload = json.dumps(self.server.resolve(request)).encode("utf-8")
+
+		self.send_response(200)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(payload)))
+		self.end_headers()
+		self.wfile.write(payload)
+
+	def log_message(self, format, *args):
+		# keep benchmark output readable
+		pass
+
+
+class StubGraphQLServer(ThreadingHTTPServer):
+	"""StubGraphQLServer.
+	In-process GraphQL endpoint answering every request with a canned product.
+	Parameters
+	----------
+	port : int
+		port to listen on, 0 picks a free one.
+	latency : float
+		seconds of artificial server latency added to every response.
+	error_rate : float
+		fraction of requests answered with HTTP 503 instead.
+	seed : int
+		seed of the error injection.
+	"""
+
+	daemon_threads = True
+
+	def __init__(self, port = 0, latency = 0.0, error_rate = 0.0, seed = 0):
+		super().__init__(("127.0.0.1", port), StubGraphQLHandler)
+		self.latency = latency
+		self.error_rate = error_rate
+		self.random = random.Random(seed)
+		self.random_lock = threading.Lock()
+		self.thread = None
+
+	@property
+	def endpoint_url(self):
+		return "http://127.0.0.1:{0}/graphql/".format(self.server_address[1])
+
+	def resolve(self, request):
+		variables = request.get("variables") or {}
+		return {
+			"data": {
+				"product": {
+					"id": variables.get("id", "UHJvZHVjdDox"),
+					"name": "Stub Product"
+				}
+			}
+		}
+
+	def parse_multipart(self, body, content_type):
+		# graphQL multipart request: the operations, with each mapped file's bytes put at its variable
+		message = BytesParser().parsebytes(b"Content-Type: " + content_type.encode("latin-1") + b"\r\n\r\n" + body)
+		parts = {part.get_param("name", header = "content-disposition"): part for part in message.get_payload()}
+		request = json.loads(parts["operations"].get_payload(decode = True))
+		for key, paths in json.loads(parts["map"].get_payload(decode = True)).items():
+			for path in paths:
+				request["variables"][path.split(".", 1)[1]] = {
+					"filename": parts[key].get_filename(),
+					"content_type": parts[key].get_content_type(),
+					"content": parts[key].get_payload(decode = True)
+				}
+		return request
+
+	def inject_error(self):
+		if not self.error_rate:
+			return False
+		with self.random_lock:
+			return self.random.random() < self.error_rate
+
+	def start(self):
+		self.thread = threading.Thread(target = self.serve_forever, daemon = True)
+		self.thread.start()
+		return self.endpoint_url
+
+	def stop(self):
+		self.shutdown()
+		self.server_close()
+
+
+class ImageFileHandler(SimpleHTTPRequestHandler):
+	protocol_version = "HTTP/1.1"
+
+	def log_request(self, code = "-", size = "-"):
+		# count the statuses served (200, 304...) instead of logging every request
+		with self.server.lock:
+			self.server.statuses[int(code) if str(code).isdigit() else code] += 1
+
+	def log_message(self, format, *args):
+		pass
+
+
+class ImageFileServer(ThreadingHTTPServer):
+	"""ImageFileServer.
+	Local HTTP file server the image stage downloads from. Files are served
+	with their Last-Modified date and If-Modified-Since requests are answered
+	with 304 when the file did not change, as image CDNs do.
+	Parameters
+	----------
+	directory : str
+		directory whose files are served.
+	port : int
+		port to listen on, 0 picks a free one.
+	"""
+
+	daemon_threads = True
+
+	def __init__(self, directory, port = 0):
+		super().__init__(("127.0.0.1", port), functools.partial(ImageFileHandler, directory = directory))
+		self.lock = threading.Lock()
+		# HTTP status -> responses sent
+		self.statuses = Counter()
+		self.thread = None
+
+	@property
+	def base_url(self):
+		return "http://127.0.0.1:{0}/".format(self.server_address[1])
+
+	def start(self):
+		self.thread = threading.Thread(target = self.serve_forever, daemon = True)
+		self.thread.start()
+		return self.base_url
+
+	def stop(self):
+		self.shutdown()
+		self.server_close()
+
+
+def write_images(directory, count = 97, size = 64 * 1024, seed = 0):
+	# Write count random image files 0.jpg, 1.jpg... of size bytes, as referenced by generate_workbook
+	rng = random.Random(seed)
+	os.makedirs(directory, exist_ok = True)
+	for index in range(count):
+		with open(os.path.join(directory, "{0}.jpg".format(index)), "wb") as image_file:
+			image_file.write(rng.randbytes(size))
+	return directory
+
+
+class MockSaleorServer(StubGraphQLServer):
+	"""MockSaleorServer.
+	In-process stand-in for the Saleor graphQL API. Products and categories
+	are kept in memory and the operations GQL_Data_Loader sends are answered
+	as Saleor would: productCreate (rejecting duplicate SKUs), productUpdate,
+	productTypeCreate, categoryCreate, the categories and products
+	connections (with category subtree, product type and search filters),
+	productImageCreate multipart uploads and productBulkDelete, one by one
+	or as aliased batches.
+	Parameters
+	----------
+	port : int
+		port to listen on, 0 picks a free one.
+	latency : float
+		seconds of artificial server latency added to every response.
+	error_rate : float
+		fraction of requests answered with HTTP 503 instead.
+	seed : int
+		seed of the error injection.
+	"""
+
+	def __init__(self, port = 0, latency = 0.0, error_rate = 0.0, seed = 0):
+		super().__init__(port, latency, error_rate, seed)
+		self.lock = threading.Lock()
+		# id -> product, sku -> product id, id -> category, id -> product image, id -> product type name
+		self.products = {}
+		self.skus = {}
+		self.categories = {}
+		self.images = {}
+		self.product_types = {}
+		self.next_id = 0
+		# requests answered per operation name
+		self.operations = Counter()
+
+	@property
+	def request_count(self):
+		return sum(self.operations.values())
+
+	def new_id(self, type_name):
+		self.next_id += 1
+		return base64.b64encode("{0}:{1}".format(type_name, self.next_id).encode("ascii")).decode("ascii")
+
+	def resolve(self, request):
+		query = request.get("query")
+		variables = request.get("variables") or {}
+		operation = operation_name(query)
+
+		with self.lock:
+			self.operations[operation] += 1
+			if query is None:
+				return {"errors": [{"message": "PersistedQueryNotSupported"}]}
+			if operation.startswith("batch"):
+				return {"data": self.resolve_batch(query, variables)}
+			if operation.startswith("get_product"):
+				return {"data": {"product": self.product_node(self.products.get(variables.get("id")))}}
+			if operation == "createProductType":
+				product_type_id = self.new_id("ProductType")
+				self.product_types[product_type_id] = variables["input"].get("name")
+				return {"data": {"productTypeCreate": {"productType": {"id": product_type_id}, "productErrors": []}}}
+			if operation == "productTypes":
+				return {"data": {"productTypes": self.connection([
+					{"id": product_type_id, "name": name} for product_type_id, name in self.product_types.items()
+					if variables["search"].lower() in (name or "").lower()
+				], variables)}}
+			if operation == "productImages":
+				product = self.products.get(variables["id"])
+				return {"data": {"product": None if product is None else {"id": product["id"], "images": [
+					{"id": image_id, "url": "http://media.example.com/products/" + image["filename"]}
+					for image_id, image in self.images.items() if image["product"] == product["id"]
+				]}}}
+			if operation == "productType":
+				return {"data": {"productType": {"id": variables["id"]} if variables["id"] in self.product_types else None}}
+			if operation == "createProduct":
+				return {"data": {"productCreate": self.product_create(variables["input"])}}
+			if operation == "productUpdate":
+				return {"data": {"productUpdate": self.product_update(variables["id"], variables["input"])}}
+			if operation == "createCategory":
+				return {"data": {"categoryCreate": self.category_create(variables["input"], variables.get("parent"))}}
+			if operation == "ProductImageCreate":
+				return {"data": {"productImageCreate": self.product_image_create(variables)}}
+			if operation == "productBulkDelete":
+				return {"data": {"productBulkDelete": self.product_bulk_delete(variables["ids"])}}
+			if operation == "products":
+				return {"data": {"products": self.products_connection(variables)}}
+			if operation == "categories":
+				return {"data": {"categories": self.categories_connection(variables)}}
+
+		return {"errors": [{"message": "Unknown operation " + operation}]}
+
+	def resolve_batch(self, query, variables):
+		mutations = {
+			"productCreate": lambda arguments: self.product_create(arguments["input"]),
+			"productUpdate": lambda arguments: self.product_update(arguments["id"], arguments["input"]),
+			"categoryCreate": lambda arguments: self.category_create(arguments["input"], arguments.get("parent"))
+		}
+		data = {}
+		for alias, index, mutation in re.findall(r"(m(\d+)): (\w+)\(", query):
+			arguments = {
+				name: variables.get("{0}_{1}".format(name, index))
+				for name, graphql_type in BATCH_MUTATIONS[mutation]["arguments"]
+			}
+			data[alias] = mutations[mutation](arguments)
+		return data
+
+	def product_create(self, product_input):
+		sku = product_input.get("sku")
+		if sku in self.skus:
+			return {"product": None, "productErrors": [
+				{"field": "sku", "message": "Product with this Sku already exists.", "code": "UNIQUE"}]}
+		product = self.store_product(self.new_id("Product"), product_input)
+		self.skus[sku] = product["id"]
+		return {"product": {"id": product["id"]}, "productErrors": []}
+
+	def product_update(self, product_id, product_input):
+		product = self.products.get(product_id)
+		if product is None:
+			return {"product": None, "productErrors": [
+				{"field": "id", "message": "Couldn't resolve to a node: " + str(product_id), "code": "NOT_FOUND"}]}
+		self.store_product(product_id, product_input, product)
+		return {"product": {"id": product_id, "name": product["name"]}, "productErrors": []}
+
+	def store_product(self, product_id, product_input, product = None):
+		product = product if product is not None else {"id": product_id, "sku": product_input.get("sku")}
+		for field in ("name", "descriptionJson", "chargeTaxes", "isPublished", "category", "basePrice", "weight", "productType"):
+			if field in product_input:
+				product[field] = product_input[field]
+		if "seo" in product_input:
+			product["seo"] = dict(product_input["seo"] or {})
+		product["updatedAt"] = datetime.now(timezone.utc).isoformat()
+		self.products[product_id] = product
+		return product
+
+	def category_create(self, category_input, parent_id = None):
+		category_id = self.new_id("Category")
+		self.categories[category_id] = {"id": category_id, "name": category_input["name"], "parent": parent_id}
+		return {"category": {"id": category_id}, "productErrors": []}
+
+	def product_image_create(self, variables):
+		if variables.get("product") not in self.products:
+			return {"image": None, "productErrors": [
+				{"field": "product", "message": "Couldn't resolve to a node: " + str(variables.get("product"))}]}
+		image = variables["image"]
+		image_id = self.new_id("ProductImage")
+		self.images[image_id] = {
+			"product": variables["product"],
+			"filename": image["filename"],
+			"content_type": image["content_type"],
+			"sha256": hashlib.sha256(image["content"]).hexdigest(),
+			"size": len(image["content"])
+		}
+		return {"image": {"id": image_id}, "productErrors": []}
+
+	def product_bulk_delete(self, ids):
+		count = 0
+		for product_id in ids:
+			product = self.products.pop(product_id, None)
+			if product is not None:
+				self.skus.pop(product.get("sku"), None)
+				count += 1
+		return {"count": count}
+
+	def product_node(self, product):
+		if product is None:
+			return None
+		category = self.categories.get(product.get("category"))
+		weight = product.get("weight")
+		seo = product.get("seo") or {}
+		return {
+			"id": product["id"],
+			"name": product.get("name"),
+			"slug": "product-" + product["id"],
+			"seoTitle": seo.get("title"),
+			"seoDescription": seo.get("description"),
+			"descriptionJson": product.get("descriptionJson"),
+			"isPublished": product.get("isPublished", True),
+			"chargeTaxes": product.get("chargeTaxes", True),
+			"updatedAt": product.get("updatedAt"),
+			"productType": {"id": product.get("productType")},
+			"category": {"id": category["id"], "name": category["name"]} if category else None,
+			"basePrice": {"amount": product.get("basePrice"), "currency": "USD"},
+			"weight": {"unit": weight.get("unit", "LB").lower(), "value": weight.get("value")} if isinstance(weight, dict) else None,
+			"variants": [{"id": "variant-" + product["id"], "sku": product.get("sku")}]
+		}
+
+	def category_node(self, category):
+		return {
+			"id": category["id"],
+			"name": category["name"],
+			"parent": {"id": category["parent"]} if category["parent"] else None,
+			"children": {"edges": [
+				{"node": {"id": child["id"], "name": child["name"]}}
+				for child in self.categories.values() if child["parent"] == category["id"]
+			]}
+		}
+
+	def subtree(self, category_ids):
+		# Ids of the categories and all their descendants, Saleor filters products by subtree
+		selected = set(category_ids)
+		added = True
+		while added:
+			added = False
+			for category in self.categories.values():
+				if category["parent"] in selected and category["id"] not in selected:
+					selected.add(category["id"])
+					added = True
+		return selected
+
+	def connection(self, nodes, variables):
+		first = variables.get("first") or 100
+		offset = int(variables.get("after") or 0)
+		page = nodes[offset:offset + first]
+		return {
+			"totalCount": len(nodes),
+			"pageInfo": {"hasNextPage": offset + first < len(nodes), "endCursor": str(offset + len(page))},
+			"edges": [{"node": node} for node in page]
+		}
+
+	def products_connection(self, variables):
+		product_filter = variables.get("filter") or {}
+		products = list(self.products.values())
+		if variables.get("search") is not None:
+			product_filter = dict(product_filter, search = variables["search"])
+		if product_filter.get("categories"):
+			categories = self.subtree(product_filter["categories"])
+			products = [product for product in products if product.get("category") in categories]
+		if product_filter.get("productTypes"):
+			product_types = set(product_filter["productTypes"])
+			products = [product for product in products if product.get("productType") in product_types]
+		if product_filter.get("search"):
+			search = product_filter["search"].lower()
+			products = [
+				product for product in products
+				if search in (product.get("name") or "").lower() or search in (product.get("sku") or "").lower()
+			]
+		if variables.get("sortBy"):
+			# only DATE (updatedAt) ordering is needed by the loader
+			products.sort(key = lambda product: product.get("updatedAt") or "",
+				reverse = variables["sortBy"].get("direction") == "DESC")
+		connection = self.connection(products, variables)
+		connection["edges"] = [{"node": self.product_node(edge["node"])} for edge in connection["edges"]]
+		return connection
+
+	def categories_connection(self, variables):
+		categories = list(self.categories.values())
+		if variables.get("search") is not None:
+			categories = [category for category in categories if variables["search"].lower() in category["name"].lower()]
+		connection = self.connection(categories, variables)
+		connection["edges"] = [{"node": self.category_node(edge["node"])} for edge in connection["edges"]]
+		return connection
+
+	def seed_categories(self, depth, fanout):
+		# Add a full category tree, returns the ids of its leaves
+		with self.lock:
+			level = [None]
+			for level_index in range(depth):
+				level = [
+					self.category_create({"name": "Level {0} {1}".format(level_index, index)}, parent_id)["category"]["id"]
+					for parent_id in level for index in range(fanout)
+				]
+			return level
+
+	def seed_products(self, count, category_ids):
+		# Add count products spread over category_ids
+		with self.lock:
+			for index in range(count):
+				self.product_create({
+					"name": "Seeded Part {0}".format(index),
+					"sku": "SEED-{0:07d}".format(index),
+					"basePrice": 10.0,
+					"category": category_ids[index % len(category_ids)] if category_ids else None
+				})
+
+
+def generate_workbook(path, rows = 1000, category_depth = 3, category_fanout = 5, seed = 0,
+		image_base_url = "http://images.example.com/", images = 97):
+	"""generate_workbook.
+	Writes a synthetic supplier sheet in the column layout GQL_Data_Loader
+	reads, as csv or, for an .xlsx path, a streamed openpyxl workbook.
+	Parameters
+	----------
+	path : str
+		.csv or .xlsx file to write.
+	rows : int
+		number of product rows.
+	category_depth : int
+		number of "/" separated names in each category path.
+	category_fanout : int
+		number of distinct names at each level of the category tree.
+	seed : int
+		seed of the random category paths, prices and weights.
+	image_base_url : str
+		url the image files are under, see write_images.
+	images : int
+		number of distinct images, rows share them in turn.
+	Returns
+	-------
+	path : str
+		the file written.
+	"""
+
+	rng = random.Random(seed)
+	width = max(NAME_COL, SKU_COL, PRICE_COL, DESCRIPTION_COL, WEIGHT_COL, CATEGORY_COL, IMAGE_COL, SEO_TITLE_COL, SEO_DESC_COL) + 1
+
+	def iter_rows():
+		header = ["Column {0}".format(col) for col in range(width)]
+		yield header
+		for index in range(rows):
+			row = [""] * width
+			row[NAME_COL] = "Synthetic Part {0}".format(index)
+			row[SKU_COL] = "BENCH-{0:07d}".format(index)
+			row[PRICE_COL] = round(rng.uniform(5, 500), 2)
+			row[DESCRIPTION_COL] = SAMPLE_DESCRIPTION.format(name = row[NAME_COL], sku = row[SKU_COL], year = 1990 + index % 30)
+			row[WEIGHT_COL] = round(rng.uniform(0.1, 80), 1)
+			row[CATEGORY_COL] = "/".join(
+				"Level {0} {1}".format(level, rng.randrange(category_fanout)) for level in range(category_depth))
+			row[IMAGE_COL] = "{0}{1}.jpg".format(image_base_url, index % images)
+			row[SEO_TITLE_COL] = row[NAME_COL]
+			row[SEO_DESC_COL] = "Buy {0} online".format(row[NAME_COL])
+			yield row
+
+	if os.path.splitext(path)[1].lower() == ".xlsx":
+		import openpyxl
+		workbook = openpyxl.Workbook(write_only = True)
+		sheet = workbook.create_sheet()
+		for row in iter_rows():
+			sheet.append(row)
+		workbook.save(path)
+	else:
+		with open(path, "w", newline = "", encoding = "utf-8") as csv_file:
+			csv.writer(csv_file).writerows(iter_rows())
+
+	return path
+
+
+def peak_rss_mb(children = False):
+	# Peak resident set size in MB of this process, or of its largest finished child (row parsing workers)
+	import resource
+	peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+	return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_loader(task, endpoint_url, options):
+	# Run one loader operation in a fresh process, returns the seconds it took, what it returned and the peak RSS of the process and of its workers
+	getter = ETLDataGetter("bench", endpoint_url)
+	start = time.perf_counter()
+	# the loader prints progress for every row, keep it out of the measurement output
+	with contextlib.redirect_stdout(io.StringIO()) if options.pop("quiet", True) else contextlib.nullcontext():
+		if task == "import":
+			result = getter.product_excel_import_all(checkpoint_path = None, retry_path = None, **options)
+			result = {key: value for key, value in result.items() if key != "failures"}
+		elif task == "categories":
+			result = len(getter.query_all_categories())
+		elif task == "purge":
+			result = getter.purge_products(**options)
+	elapsed = time.perf_counter() - start
+	return elapsed, result, peak_rss_mb(), peak_rss_mb(children = True)
+
+
+def run_isolated(server, name, task, rows, options):
+	# Measure a run_loader task against server and print one line of results
+	requests_before = server.request_count
+	context = multiprocessing.get_context("spawn")
+	with ProcessPoolExecutor(max_workers = 1, mp_context = context) as executor:
+		elapsed, result, peak, worker_peak = executor.submit(run_loader, task, server.endpoint_url, options).result()
+	requests = server.request_count - requests_before
+
+	summary = {
+		"name": name,
+		"rows": rows,
+		"seconds": elapsed,
+		"rows_per_second": rows / elapsed if elapsed else 0.0,
+		"requests": requests,
+		"requests_per_row": requests / rows if rows else 0.0,
+		"peak_rss_mb": peak,
+		"worker_peak_rss_mb": worker_peak,
+		"result": result
+	}
+	print("{name:<22} {rows:>8} rows {seconds:8.2f} s {rows_per_second:10.1f} rows/s "
+		"{requests_per_row:7.3f} req/row {peak_rss_mb:8.1f} MB peak {worker_peak_rss_mb:8.1f} MB worker peak".format(**summary))
+	return summary
+
+
+def bench_import(rows = 2000, category_depth = 3, category_fanout = 5, latency = 0.0, error_rate = 0.0,
+		concurrency = UPLOAD_CONCURRENCY, batch_size = None, workers = TRANSFORM_WORKERS, sheet_format = "csv"):
+	"""bench_import.
+	Imports a synthetic workbook into an empty MockSaleorServer, then imports
+	it again so every row is an update.
+	Parameters
+	----------
+	rows : int
+		number of product rows of the workbook.
+	category_depth : int
+		depth of the category paths.
+	category_fanout : int
+		distinct category names per level.
+	latency : float
+		seconds of server latency per request.
+	error_rate : float
+		fraction of requests answered with HTTP 503.
+	concurrency : int
+		create/update requests in flight.
+	batch_size : int, optional
+		send products as batched mutations of this size.
+	workers : int
+		row parsing processes.
+	sheet_format : str
+		"csv" or "xlsx".
+	Returns
+	-------
+	results : list
+		summary of the create and of the update run.
+	"""
+
+	server = MockSaleorServer(latency = latency, error_rate = error_rate)
+	server.start()
+	options = {"concurrency": concurrency, "batch_size": batch_size, "transform_workers": workers}
+	try:
+		with tempfile.TemporaryDirectory() as directory:
+			path = generate_workbook(os.path.join(directory, "bench." + sheet_format), rows, category_depth, category_fanout)
+			return [
+				run_isolated(server, "import (create)", "import", rows, dict(options, path = path)),
+				run_isolated(server, "import (update)", "import", rows, dict(options, path = path))
+			]
+	finally:
+		server.stop()
+
+
+def bench_images(rows = 500, images = 97, image_size = 64 * 1024, latency = 0.0, error_rate = 0.0,
+		concurrency = UPLOAD_CONCURRENCY, image_concurrency = IMAGE_CONCURRENCY, workers = 1):
+	"""bench_images.
+	Imports a synthetic workbook with its image column pointing at an
+	ImageFileServer, then imports it again: the second run should only send
+	conditional requests (304) and skip every upload.
+	Parameters
+	----------
+	rows : int
+		number of product rows of the workbook.
+	images : int
+		number of distinct image files, shared by the rows in turn.
+	image_size : int
+		bytes of each image file.
+	latency : float
+		seconds of graphQL server latency per request.
+	error_rate : float
+		fraction of graphQL requests answered with HTTP 503.
+	concurrency : int
+		create/update requests in flight.
+	image_concurrency : int
+		images downloaded or uploaded at once.
+	workers : int
+		row parsing processes.
+	Returns
+	-------
+	results : list
+		summary of the first and of the second run, with the statuses the
+		file server sent and the images the mock server received.
+	"""
+
+	server = MockSaleorServer(latency = latency, error_rate = error_rate)
+	server.start()
+	try:
+		with tempfile.TemporaryDirectory() as directory:
+			file_server = ImageFileServer(write_images(os.path.join(directory, "images"), images, image_size))
+			file_server.start()
+			try:
+				path = generate_workbook(os.path.join(directory, "bench.csv"), rows,
+					image_base_url = file_server.base_url, images = images)
+				options = {
+					"path": path, "concurrency": concurrency, "transform_workers": workers, "images": True,
+					"image_concurrency": image_concurrency, "image_cache_dir": os.path.join(directory, "cache")
+				}
+				results = []
+				for name in ("images (first run)", "images (cached)"):
+					statuses_before = Counter(file_server.statuses)
+					summary = run_isolated(server, name, "import", rows, dict(options))
+					summary["file_server"] = {str(status): count for status, count in (file_server.statuses - statuses_before).items()}
+					summary["images_uploaded"] = len(server.images)
+					print("{0:<22} file server {1}, {2} images on the server".format(
+						"", summary["file_server"], summary["images_uploaded"]))
+					results.append(summary)
+				return results
+			finally:
+				file_server.stop()
+	finally:
+		server.stop()
+
+
+def bench_categories(category_depth = 3, category_fanout = 10, latency = 0.0, error_rate = 0.0):
+	"""bench_categories.
+	Loads a full category tree of category_fanout ** level categories per
+	level with query_all_categories.
+	Returns
+	-------
+	results : list
+		summary of the run, rows being categories.
+	"""
+
+	server = MockSaleorServer(latency = latency, error_rate = error_rate)
+	server.seed_categories(category_depth, category_fanout)
+	server.start()
+	try:
+		return [run_isolated(server, "query_all_categories", "categories", len(server.categories), {})]
+	finally:
+		server.stop()
+
+
+def bench_purge(rows = 2000, latency = 0.0, error_rate = 0.0, batch_size = PURGE_BATCH_SIZE, concurrency = PURGE_CONCURRENCY):
+	"""bench_purge.
+	Deletes rows seeded products with purge_products.
+	Returns
+	-------
+	results : list
+		summary of the run, rows being products.
+	"""
+
+	server = MockSaleorServer(latency = latency, error_rate = error_rate)
+	server.seed_products(rows, server.seed_categories(2, 5))
+	server.start()
+	try:
+		return [run_isolated(server, "purge_products", "purge", rows, {"batch_size": batch_size, "concurrency": concurrency})]
+	finally:
+		server.stop()
+
+
+def time_requests(send, num_requests):
+	# Return the latency of each call in milliseconds
+	latencies = []
+	for i in range(num_requests):
+		start = time.perf_counter()
+		send({"id": str(i)})
+		latencies.append((time.perf_counter() - start) * 1000)
+	return latencies
+
+
+def summarize(name, latencies):
+	latencies = sorted(latencies)
+	summary = {
+		"name": name,
+		"requests": len(latencies),
+		"mean_ms": statistics.mean(latencies),
+		"p50_ms": latencies[len(latencies) // 2],
+		"p95_ms": latencies[int(len(latencies) * 0.95) - 1]
+	}
+	print("{name:<28} {requests:>6} req   mean {mean_ms:7.3f} ms   p50 {p50_ms:7.3f} ms   p95 {p95_ms:7.3f} ms".format(**summary))
+	return summary
+
+
+def bench_transport(num_requests = 500, latency = 0.0):
+	"""bench_transport.
+	Parameters
+	----------
+	num_requests : int
+		number of sequential requests sent by each client.
+	latency : float
+		seconds of artificial server latency.
+	Returns
+	-------
+	results : list
+		latency summary for the per-request connection and the pooled transport.
+	"""
+
+	from saleor_gql_loader.utils import graphql_request
+
+	server = StubGraphQLServer(latency = latency)
+	endpoint_url = server.start()
+	headers = {"Authorization": "Bearer bench"}
+
+	try:
+		results = [summarize("graphql_request (no pool)", time_requests(
+			lambda variables: graphql_request(BENCH_QUERY, variables, headers, endpoint_url),
+			num_requests
+		))]
+
+		with GraphQLTransport(endpoint_url) as transport:
+			results.append(summarize("GraphQLTransport (pooled)", time_requests(
+				lambda variables: transport.execute(BENCH_QUERY, variables, headers),
+				num_requests
+			)))
+	finally:
+		server.stop()
+
+	print("Pooled transport speedup: {0:.2f}x".format(results[0]["mean_ms"] / results[1]["mean_ms"]))
+	return results
+
+
+def legacy_get_description(input_html, sku = None):
+	# get_description as it was before DescriptionConverter, kept as the baseline
+	replace_dictionary = {
+		"<li>": "",
+		"</li>": "",
+		"<b>": "",
+		"</b>": "",
+		"<h2>": "",
+		"</h2>": "",
+		"<div>": "",
+		"</div>": "",
+		"<ul>": "",
+		"</ul>": "",
+		"<input type=\"button\" class=\"btn btn-primary\" onclick=\"location.href=\'http://sandiegoengineparts.com/p/submit-your-price\';\" value=\"Submit Your Bid\">": "",
+		"<h2 style=\"font-size: 32px;\">Don't Like the Price?": "",
+	}
+	for old, new in replace_dictionary.items():
+		input_html = input_html.replace(old, new)
+
+	final_string = {
+		"blocks": [],
+		"entityMap": {}
+	}
+	for line in input_html.split("\n"):
+		if not line.strip():
+			continue
+		final_string["blocks"].append({
+			"key": ''.join(random.SystemRandom().choice(string.ascii_lowercase + string.digits) for _ in range(6)),
+			"data": {},
+			"text": line.strip(),
+			"type": "unstyled",
+			"depth": 0,
+			"entityRanges": [],
+			"inlineStyleRanges": []
+		})
+	return json.dumps(final_string, indent=4)
+
+
+def load_description_corpus(sheet = None, size = 5000):
+	# Descriptions from the description column of a sheet, or generated samples
+	if sheet is not None:
+		return [
+			str(row[DESCRIPTION_COL]) for row_number, row in iter_sheet_rows(sheet)
+			if len(row) > DESCRIPTION_COL and row[DESCRIPTION_COL]
+		]
+	return [
+		SAMPLE_DESCRIPTION.format(name = "Engine Part {0}".format(i), sku = "SKU{0}".format(i), year = 1990 + i % 30)
+		for i in range(size)
+	]
+
+
+def bench_descriptions(sheet = None, repeat = 3):
+	"""bench_descriptions.
+	Parameters
+	----------
+	sheet : str, optional
+		.xls, .xlsx or .csv file whose description column is the corpus.
+	repeat : int
+		number of passes over the corpus, the fastest one is reported.
+	Returns
+	-------
+	results : dict
+		microseconds per description for the legacy and current converter.
+	"""
+
+	corpus = load_description_corpus(sheet)
+	getter = ETLDataGetter("bench")
+	results = {}
+
+	for name, convert in (("legacy get_description", legacy_get_description), ("get_description", getter.get_description)):
+		best = None
+		for _ in range(repeat):
+			start = time.perf_counter()
+			for index, description in enumerate(corpus):
+				convert(description, "SKU{0}".format(index))
+			elapsed = time.perf_counter() - start
+			best = elapsed if best is None else min(best, elapsed)
+		results[name] = best / len(corpus) * 1000000
+		print("{0:<24} {1:>6} descriptions   {2:8.2f} us/description".format(name, len(corpus), results[name]))
+
+	print("Description conversion speedup: {0:.2f}x".format(
+		results["legacy get_description"] / results["get_description"]))
+	return results
+
+
+def main(argv = None):
+	parser = argparse.ArgumentParser(description = "GQL_Data_Loader benchmarks")
+	parser.add_argument("--output", help = "also write the results as JSON to this file")
+	subparsers = parser.add_subparsers(dest = "benchmark", required = True)
+
+	server_parser = argparse.ArgumentParser(add_help = False)
+	server_parser.add_argument("--latency", type = float, default = 0.0, help = "seconds of server latency per request")
+	server_parser.add_argument("--error-rate", type = float, default = 0.0, help = "fraction of requests failing with HTTP 503")
+
+	import_parser = subparsers.add_parser("import", parents = [server_parser], help = "product_excel_import_all on a synthetic workbook")
+	import_parser.add_argument("--rows", type = int, default = 2000)
+	import_parser.add_argument("--depth", type = int, default = 3, help = "category path depth")
+	import_parser.add_argument("--fanout", type = int, default = 5, help = "category names per level")
+	import_parser.add_argument("--concurrency", type = int, default = UPLOAD_CONCURRENCY)
+	import_parser.add_argument("--batch-size", type = int)
+	import_parser.add_argument("--workers", type = int, default = TRANSFORM_WORKERS)
+	import_parser.add_argument("--format", choices = ["csv", "xlsx"], default = "csv")
+
+	images_parser = subparsers.add_parser("images", parents = [server_parser], help = "import with the image stage against a local file server")
+	images_parser.add_argument("--rows", type = int, default = 500)
+	images_parser.add_argument("--images", type = int, default = 97, help = "distinct image files")
+	images_parser.add_argument("--image-size", type = int, default = 64 * 1024, help = "bytes per image file")
+	images_parser.add_argument("--concurrency", type = int, default = UPLOAD_CONCURRENCY)
+	images_parser.add_argument("--image-concurrency", type = int, default = IMAGE_CONCURRENCY)
+
+	categories_parser = subparsers.add_parser("categories", parents = [server_parser], help = "query_all_categories on a full tree")
+	categories_parser.add_argument("--depth", type = int, default = 3)
+	categories_parser.add_argument("--fanout", type = int, default = 10)
+
+	purge_parser = subparsers.add_parser("purge", parents = [server_parser], help = "purge_products on seeded products")
+	purge_parser.add_argument("--rows", type = int, default = 2000)
+	purge_parser.add_argument("--batch-size", type = int, default = PURGE_BATCH_SIZE)
+	purge_parser.add_argument("--concurrency", type = int, default = PURGE_CONCURRENCY)
+
+	subparsers.add_parser("suite", parents = [server_parser], help = "import, images, categories and purge with their defaults")
+
+	transport_parser = subparsers.add_parser("transport", help = "per-request latency of the HTTP transport")
+	transport_parser.add_argument("--requests", type = int, default = 500)
+	transport_parser.add_argument("--latency", type = float, default = 0.0)
+
+	descriptions_parser = subparsers.add_parser("descriptions", help = "description HTML to Draft.js conversion")
+	descriptions_parser.add_argument("--sheet", help = "sheet whose description column is the corpus")
+	descriptions_parser.add_argument("--repeat", type = int, default = 3)
+
+	args = parser.parse_args(argv)
+
+	if args.benchmark == "transport":
+		results = bench_transport(args.requests, args.latency)
+	elif args.benchmark == "descriptions":
+		results = bench_descriptions(args.sheet, args.repeat)
+	elif args.benchmark == "import":
+		results = bench_import(args.rows, args.depth, args.fanout, args.latency, args.error_rate,
+			args.concurrency, args.batch_size, args.workers, args.format)
+	elif args.benchmark == "images":
+		results = bench_images(args.rows, args.images, args.image_size, args.latency, args.error_rate,
+			args.concurrency, args.image_concurrency)
+	elif args.benchmark == "categories":
+		results = bench_categories(args.depth, args.fanout, args.latency, args.error_rate)
+	elif args.benchmark == "purge":
+		results = bench_purge(args.rows, args.latency, args.error_rate, args.batch_size, args.concurrency)
+	elif args.benchmark == "suite":
+		results = (bench_import(latency = args.latency, error_rate = args.error_rate)
+			+ bench_images(latency = args.latency, error_rate = args.error_rate)
+			+ bench_categories(latency = args.latency, error_rate = args.error_rate)
+			+ bench_purge(latency = args.latency, error_rate = args.error_rate))
+
+	if args.output:
+		with open(args.output, "w") as output_file:
+			json.dump(results, output_file, indent = 4)
+
+
+if __name__ == "__main__":
+	main()
@@ -1,24 +1,78 @@
-import xlrd
 import os
+import sys
 import time
 import string
 import random
+import re
+import csv
+import html
 import json
+import gzip
+import hashlib
+import math
+import tempfile
+import mimetypes
+import argparse
+import functools
+import contextlib
+import threading
+import queue
 from io import StringIO
-from xlrd import open_workbook, cellname
-from saleor_gql_loader import ETLDataLoader
-from saleor_gql_loader.utils import graphql_request, graphql_multipart_request, override_dict, handle_errors, get_payload
-from decouple import Config, RepositoryEnv
+from urllib.parse import urlsplit
+from itertools import islice
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
 
+# Heavy dependencies (requests, aiohttp, xlrd, openpyxl, decouple, saleor_gql_loader) and asyncio are
+# imported where they are used, so importing this module stays cheap for
+# worker processes and tools that only need part of it.
 
-DOTENV_FILE = '/home/eric/sdep-ecommerce/.env'
+# Configuration is read from this .env file the first time it is needed,
+# GQL_LOADER_DOTENV overrides the location
+DOTENV_FILE = os.environ.get('GQL_LOADER_DOTENV', '/home/eric/sdep-ecommerce/.env')
 # DOTENV_FILE = '/home/fytron/sdep-ecommerce/saleor/.env'
-env_config = Config(RepositoryEnv(DOTENV_FILE))
-ETL_SECRET_ID = env_config('ETL_SECRET_ID')
+GQL_DEFAULT_ENDPOINT = "http://localhost:8000/graphql/"
+# Keys read from the .env file and their defaults, None when the key is required
+CONFIG_DEFAULTS = {
+	"ETL_SECRET_ID": None,
+	"GRAPHQL_ENDPOINT": GQL_DEFAULT_ENDPOINT,
+	# Setup Excel
+	"EXCEL_FILE_LOCATION": '',
+	"EXCEL_FILE_NAME": ''
+}
+EXCEL_CONFIG_KEYS = ("EXCEL_FILE_LOCATION", "EXCEL_FILE_NAME")
 
-# Setup Excel
-EXCEL_FILE_LOCATION = env_config('EXCEL_FILE_LOCATION')
-EXCEL_FILE_NAME = env_config('EXCEL_FILE_NAME')
+
+@functools.lru_cache(maxsize = None)
+def load_config(dotenv_file = None, keys = tuple(CONFIG_DEFAULTS)):
+	"""load_config.
+	Parameters
+	----------
+	dotenv_file : str, optional
+		.env file to read, DOTENV_FILE by default.
+	keys : tuple, optional
+		keys of CONFIG_DEFAULTS to read, all of them by default. A required
+		key missing from the file raises, so only ask for the keys needed.
+	Returns
+	-------
+	config : dict
+		the value of each key.
+	"""
+
+	from decouple import Config, RepositoryEnv
+
+	env_config = Config(RepositoryEnv(dotenv_file or DOTENV_FILE))
+	return {
+		key: env_config(key) if CONFIG_DEFAULTS[key] is None else env_config(key, default = CONFIG_DEFAULTS[key])
+		for key in keys
+	}
+
+
+def __getattr__(name):
+	# ETL_SECRET_ID, EXCEL_FILE_LOCATION... are still readable as module attributes, loaded on first access
+	if name in ("ETL_SECRET_ID", "EXCEL_FILE_LOCATION", "EXCEL_FILE_NAME"):
+		return load_config(keys = (name,))[name]
+	raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
 
 # Setup Excel Cols
 # This method excepts the following data types for products
@@ -33,350 +87,4232 @@ IMAGE_COL = 12
 SEO_TITLE_COL = 13
 SEO_DESC_COL = 14
 
-class ETLDataGetter(ETLDataLoader):
-	def get_product(self, product_id):
-		"""get_product.
-		Parameters
-		----------
-		product_id : str
-			product id required to query the product.
+# Maximum number of create/update requests in flight at once during upload
+UPLOAD_CONCURRENCY = 8
+# Uploads queued per worker ahead of the one being waited on, bounds how far
+# sheet parsing can run ahead of the upload stage
+UPLOAD_QUEUE_DEPTH = 2
+
+# Setup descriptions
+# Boilerplate removed from description HTML together with its text (regular expressions)
+DESCRIPTION_BOILERPLATE = [
+	r"<h2[^>]*>\s*Don't Like the Price\?",
+]
+# Tags that start a new Draft.js block when opened or closed
+DESCRIPTION_BLOCK_TAGS = ["p", "div", "li", "ul", "ol", "h1", "h2", "h3", "h4", "h5", "h6", "tr", "table", "br"]
+# How Draft.js block keys are made:
+# "deterministic" derives them from the row SKU and line index so descriptions are identical across runs,
+# "fast" draws them from a non cryptographic generator, "secure" from the OS entropy source
+BLOCK_KEY_MODE = "deterministic"
+BLOCK_KEY_ALPHABET = string.ascii_lowercase + string.digits
+BLOCK_KEY_LENGTH = 6
+
+# Setup row transformation
+# Worker processes parsing sheet rows (cells, descriptions, SEO), 1 parses in the main process
+TRANSFORM_WORKERS = os.cpu_count() or 1
+# Rows handed to a worker process at once
+TRANSFORM_CHUNK_ROWS = 200
+
+# Number of uploaded rows between two import checkpoints
+IMPORT_CHUNK_SIZE = 500
+# Local state file an interrupted import resumes from, None disables checkpoints
+CHECKPOINT_FILE = '.gql_import_checkpoint.json'
+# Rows that failed on the last import, imported again with --retry-failed
+RETRY_FILE = '.gql_import_retry.json'
+# Local store of the row hashes sent by the last run, used by delta imports
+HASH_STORE_FILE = '.gql_import_hashes.json'
+
+# Setup catalog cache
+# SQLite file an import starts from when caching is enabled, see CatalogCache
+CATALOG_CACHE_FILE = '.gql_catalog_cache.sqlite3'
+# ProductOrderField sorting products by their updatedAt ("LAST_MODIFIED_AT" on Saleor 3)
+CACHE_UPDATED_SORT_FIELD = "DATE"
+
+CATALOG_CACHE_SCHEMA = """
+	CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+	CREATE TABLE IF NOT EXISTS categories (id TEXT PRIMARY KEY, name TEXT NOT NULL, parent_id TEXT);
+	CREATE TABLE IF NOT EXISTS products (id TEXT PRIMARY KEY, updated_at TEXT);
+	CREATE TABLE IF NOT EXISTS skus (sku TEXT PRIMARY KEY, product_id TEXT NOT NULL);
+	CREATE INDEX IF NOT EXISTS skus_product_id ON skus (product_id);
+	CREATE TABLE IF NOT EXISTS product_types (name TEXT PRIMARY KEY, id TEXT NOT NULL);
+	CREATE TABLE IF NOT EXISTS row_hashes (sku TEXT PRIMARY KEY, hash TEXT NOT NULL);
+"""
+
+CACHE_PRODUCTS_QUERY = """
+	query products($first: Int!, $after: String, $sortBy: ProductOrder) {
+		products(first: $first, after: $after, sortBy: $sortBy) {
+			totalCount
+			pageInfo {
+				hasNextPage
+				endCursor
+			}
+			edges {
+				node {
+					id
+					updatedAt
+					variants {
+						sku
+					}
+				}
+			}
+		}
+	}
+"""
+
+# Number of aliased mutations sent per GraphQL document in batch mode
+MUTATION_BATCH_SIZE = 25
+
+# Mutations that can be batched as aliased fields of a single document
+# arguments are (name, graphQL type) pairs, selection is the payload returned per alias
+BATCH_MUTATIONS = {
+	"productCreate": {
+		"arguments": [("input", "ProductCreateInput!")],
+		"selection": "product { id }"
+	},
+	"productUpdate": {
+		"arguments": [("id", "ID!"), ("input", "ProductInput!")],
+		"selection": "product { id name }"
+	},
+	"categoryCreate": {
+		"arguments": [("input", "CategoryInput!"), ("parent", "ID")],
+		"selection": "category { id }"
+	}
+}
+
+# Page size used when walking connections with pageInfo/after cursors
+PAGE_SIZE = 100
+
+# graphQL documents sent by CatalogRequests
+PRODUCT_TYPE_CREATE_MUTATION = """
+	mutation createProductType($input: ProductTypeInput!) {
+		productTypeCreate(input: $input) {
+			productType {
+				id
+			}
+			productErrors {
+				field
+				message
+				code
+			}
+		}
+	}
+"""
+
+PRODUCT_CREATE_MUTATION = """
+	mutation createProduct($input: ProductCreateInput!) {
+		productCreate(input: $input) {
+			product {
+				id
+			}
+			productErrors {
+				field
+				message
+				code
+			}
+		}
+	}
+"""
+
+PRODUCT_UPDATE_MUTATION = """
+	mutation productUpdate($id: ID!, $input: ProductInput!) {
+		productUpdate(id: $id, input: $input) {
+			product {
+				id
+				name
+			}
+			productErrors {
+				field
+				message
+				code
+			}
+		}
+	}
+"""
+
+CATEGORY_CREATE_MUTATION = """
+	mutation createCategory($input: CategoryInput!, $parent: ID) {
+		categoryCreate(input: $input, parent: $parent) {
+			category {
+				id
+			}
+			productErrors {
+				field
+				message
+				code
+			}
+		}
+	}
+"""
+
+PRODUCT_BULK_DELETE_MUTATION = """
+	mutation productBulkDelete($ids: [ID]!) {
+		productBulkDelete(ids: $ids) {
+			count
+		}
+	}
+"""
+
+SKU_SEARCH_QUERY = """
+	query products($search: String!) {
+		products(first: 100, filter: {search: $search}) {
+			edges {
+				node {
+					id
+					variants {
+						sku
+					}
+				}
+			}
+		}
+	}
+"""
+
+SKU_INDEX_QUERY = """
+	query products($first: Int!, $after: String) {
+		products(first: $first, after: $after) {
+			pageInfo {
+				hasNextPage
+				endCursor
+			}
+			edges {
+				node {
+					id
+					variants {
+						sku
+					}
+				}
+			}
+		}
+	}
+"""
+
+PRODUCT_IDS_QUERY = """
+	query products($first: Int!, $after: String, $filter: ProductFilterInput) {
+		products(first: $first, after: $after, filter: $filter) {
+			pageInfo {
+				hasNextPage
+				endCursor
+			}
+			edges {
+				node {
+					id
+					variants {
+						sku
+					}
+				}
+			}
+		}
+	}
+"""
+
+PRODUCT_TYPE_SEARCH_QUERY = """
+	query productTypes($search: String!) {
+		productTypes(first: 100, filter: {search: $search}) {
+			edges {
+				node {
+					id
+					name
+				}
+			}
+		}
+	}
+"""
+CATEGORY_SEARCH_QUERY = """
+	query categories($search: String!) {
+		categories(first: 100, filter: {search: $search}) {
+			edges {
+				node {
+					id
+					name
+					parent {
+						id
+					}
+				}
+			}
+		}
+	}
+"""
+PRODUCT_IMAGES_QUERY = """
+	query productImages($id: ID!) {
+		product(id: $id) {
+			id
+			images {
+				id
+				url
+			}
+		}
+	}
+"""
+CATEGORIES_QUERY = """
+	query categories($first: Int!, $after: String) {
+		categories(first: $first, after: $after) {
+			pageInfo {
+				hasNextPage
+				endCursor
+			}
+			edges {
+				node {
+					id
+					name
+					parent {
+						id
+					}
+				}
+			}
+		}
+	}
+"""
+
+# Setup get_product selection profiles
+# Send a hash of prepared queries instead of their text (automatic persisted queries),
+# only useful when the server supports them, falls back to the full text otherwise
+PERSISTED_QUERIES = False
+
+PRODUCT_FRAGMENTS = """
+	fragment TaxedMoneyFields on TaxedMoney {
+		currency
+		gross {
+			amount
+			localized
+		}
+		net {
+			amount
+			localized
+		}
+		tax {
+			amount
+			localized
+		}
+	}
+
+	fragment TaxedMoneyRangeFields on TaxedMoneyRange {
+		start {
+			...TaxedMoneyFields
+		}
+		stop {
+			...TaxedMoneyFields
+		}
+	}
+
+	fragment ProductPricingFields on ProductPricingInfo {
+		onSale
+		discount {
+			...TaxedMoneyFields
+		}
+		discountLocalCurrency {
+			...TaxedMoneyFields
+		}
+		priceRange {
+			...TaxedMoneyRangeFields
+		}
+		priceRangeUndiscounted {
+			...TaxedMoneyRangeFields
+		}
+		priceRangeLocalCurrency {
+			...TaxedMoneyRangeFields
+		}
+	}
+
+	fragment ProductVariantFields on ProductVariant {
+		id
+		sku
+		name
+		stockQuantity
+		isAvailable
+		pricing {
+			discountLocalCurrency {
+				...TaxedMoneyFields
+			}
+			price {
+				currency
+				gross {
+					amount
+					localized
+				}
+			}
+			priceUndiscounted {
+				currency
+				gross {
+					amount
+					localized
+				}
+			}
+			priceLocalCurrency {
+				currency
+				gross {
+					amount
+					localized
+				}
+			}
+		}
+		attributes {
+			attribute {
+				id
+				name
+			}
+			values {
+				id
+				name
+				value: name
+			}
+		}
+	}
+
+"""
+
+# Fields selected by get_product for each profile, with the fragments they use
+PRODUCT_PROFILES = {
+	"minimal": ("", """
+			id
+			name
+			slug
+			variants {
+				id
+				sku
+			}
+		"""),
+	"sync": ("", """
+			id
+			name
+			slug
+			seoTitle
+			seoDescription
+			descriptionJson
+			isPublished
+			chargeTaxes
+			updatedAt
+			productType {
+				id
+			}
+			category {
+				id
+			}
+			basePrice {
+				amount
+			}
+			weight {
+				unit
+				value
+			}
+			variants {
+				id
+				sku
+			}
+		"""),
+	"full": (PRODUCT_FRAGMENTS, """
+			id
+			seoTitle
+			seoDescription
+			name
+			description
+			descriptionJson
+			publicationDate
+			isPublished
+			productType {
+				id
+				name
+			}
+			slug
+			category {
+				id
+				name
+			}
+			updatedAt
+			chargeTaxes
+			weight {
+				unit
+				value
+			}
+			thumbnail {
+				url
+				alt
+			}
+			pricing {
+				...ProductPricingFields
+			}
+			isAvailable
+			basePrice {
+				currency
+				amount
+			}
+			taxType {
+				description
+				taxCode
+			}
+			variants {
+				...ProductVariantFields
+			}
+			images {
+				id
+				url
+			}
+		""")
+}
+
+# Products connection paged by load_catalog_snapshot, with the fields of the sync profile
+SNAPSHOT_QUERY = """
+	query products($first: Int!, $after: String, $filter: ProductFilterInput) {
+		products(first: $first, after: $after, filter: $filter) {
+			pageInfo {
+				hasNextPage
+				endCursor
+			}
+			edges {
+				node {""" + PRODUCT_PROFILES["sync"][1] + """}
+			}
+		}
+	}
+"""
+
+# ProductInput fields compared by dry runs, in the order they are reported
+DIFF_FIELDS = ("name", "descriptionJson", "chargeTaxes", "isPublished", "category", "basePrice", "weight", "seo")
+# Unit of the sheet's weight column, also assumed for weights given without a unit
+WEIGHT_DEFAULT_UNIT = "LB"
+# Grams per WeightUnitsEnum unit, weights are compared in grams
+WEIGHT_UNIT_GRAMS = {"g": 1.0, "kg": 1000.0, "lb": 453.59237, "oz": 28.349523125, "tonne": 1000000.0}
+# Grams two weights may differ by and still be the same, the server rounds the weights it converts
+WEIGHT_TOLERANCE_GRAMS = 0.5
+
+# Setup product images
+# Images downloaded and uploaded at once, and rows queued for the image stage
+IMAGE_CONCURRENCY = 8
+IMAGE_QUEUE_DEPTH = 2
+# Bytes read at a time while streaming a download to disk
+IMAGE_CHUNK_SIZE = 64 * 1024
+IMAGE_DOWNLOAD_TIMEOUT = (10, 60)
+# Directory of downloaded images, stored by content hash, and their index
+IMAGE_CACHE_DIR = '.gql_image_cache'
+
+# Product ids deleted per productBulkDelete request, and requests in flight while purging
+PURGE_BATCH_SIZE = 100
+PURGE_CONCURRENCY = 4
+
+# Setup catalog export
+# Cursor chains paged side by side while exporting, one per top level category
+EXPORT_CONCURRENCY = 4
+# Pages fetched ahead of the writer, bounds the memory used by an export
+EXPORT_QUEUE_DEPTH = 8
+# Rows buffered per Parquet row group
+EXPORT_PARQUET_ROW_GROUP = 10000
+# Columns of an exported product, in CSV and Parquet order
+EXPORT_FIELDS = [
+	"id", "name", "slug", "skus", "category_id", "category", "price", "currency", "weight", "weight_unit",
+	"seo_title", "seo_description", "is_published", "updated_at", "description_json"
+]
+
+EXPORT_QUERY = """
+	query products($first: Int!, $after: String, $filter: ProductFilterInput) {
+		products(first: $first, after: $after, filter: $filter) {
+			pageInfo {
+				hasNextPage
+				endCursor
+			}
+			edges {
+				node {
+					id
+					name
+					slug
+					seoTitle
+					seoDescription
+					descriptionJson
+					isPublished
+					updatedAt
+					category {
+						id
+						name
+					}
+					basePrice {
+						amount
+						currency
+					}
+					weight {
+						unit
+						value
+					}
+					variants {
+						sku
+					}
+				}
+			}
+		}
+	}
+"""
+
+EXPORT_COUNT_QUERY = """
+	query products($filter: ProductFilterInput) {
+		products(first: 1, filter: $filter) {
+			totalCount
+		}
+	}
+"""
+
+# Setup HTTP transport
+# Pool size should be at least the upload concurrency so no worker waits on a socket
+HTTP_POOL_SIZE = 16
+HTTP_CONNECT_TIMEOUT = 10
+HTTP_READ_TIMEOUT = 90
+# gzip request bodies, only enable if the server accepts Content-Encoding: gzip
+HTTP_COMPRESS_REQUESTS = False
+
+# Setup request scheduling
+# Requests per second allowed to the API (token bucket), None for no limit
+SCHEDULER_RATE = None
+SCHEDULER_BURST = 20
+# Bounds of the adaptive window of requests in flight, it grows by one per
+# window of fast successes and halves on throttling, server errors or slow responses
+SCHEDULER_MIN_CONCURRENCY = 1
+# operations asking for more requests in flight raise it and the pool, see ETLDataGetter.reserve_concurrency
+SCHEDULER_MAX_CONCURRENCY = HTTP_POOL_SIZE
+# Responses slower than this many seconds count as congestion
+SCHEDULER_LATENCY_TARGET = 2.0
+# Retries of transient errors (timeouts, connection errors, 429, 5xx) with jittered exponential backoff
+SCHEDULER_MAX_RETRIES = 5
+SCHEDULER_BACKOFF_BASE = 0.5
+SCHEDULER_BACKOFF_MAX = 30.0
+
+# HTTP statuses worth retrying
+TRANSIENT_STATUS_CODES = (408, 425, 429, 500, 502, 503, 504)
+# Mutations that create an object: after a read timeout the object may exist,
+# so it is looked up before the mutation is sent again
+CREATE_MUTATIONS = ("productTypeCreate", "productCreate", "categoryCreate", "productImageCreate")
+
+# Setup asyncio client, see AsyncETLDataGetter
+# Requests in flight at once on the event loop, shared by every coroutine of a client
+ASYNC_CONCURRENCY = 64
+# Connections the aiohttp session keeps open to the endpoint
+ASYNC_POOL_SIZE = ASYNC_CONCURRENCY
+
+# Setup instrumentation
+# Upper bounds in seconds of the stage and request latency histogram buckets
+METRICS_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Prefix of the Prometheus metric names
+METRICS_PREFIX = "gql_loader"
+
+
+class TransientRequestError(Exception):
+	"""TransientRequestError.
+	A request failed in a way that may succeed when retried: timeout,
+	connection error, throttling (429) or server error (5xx).
+	"""
+
+	def __init__(self, message, retry_after = None, maybe_applied = False):
+		super().__init__(message)
+		self.retry_after = retry_after
+		# the request was sent and the server may have applied it (read timeout, gateway timeout)
+		self.maybe_applied = maybe_applied
+
+
+class RequestOutcomeUnknown(Exception):
+	"""RequestOutcomeUnknown.
+	A create mutation was sent but no response came back, the object may
+	or may not exist. The caller looks it up before sending it again, see
+	CatalogRequests.send_create_steps.
+	"""
+
+
+class GraphQLError(Exception):
+	"""GraphQLError.
+	The server rejected the request, retrying it will not help.
+	"""
+
+
+class ProductMutationError(Exception):
+	"""ProductMutationError.
+	A mutation returned productErrors, kept on errors as field/message/code dicts.
+	"""
+
+	def __init__(self, errors):
+		super().__init__("\n".join("{0} : {1}".format(error.get("field"), error.get("message")) for error in errors))
+		self.errors = errors
+
+	def is_duplicate_sku(self):
+		# productCreate reports an existing SKU as a UNIQUE error on the sku field
+		return any(error.get("field") == "sku" and error.get("code") == "UNIQUE" for error in self.errors)
+
+	def is_not_found(self):
+		# productUpdate reports an id that no longer exists as a NOT_FOUND error
+		return any(error.get("code") == "NOT_FOUND" for error in self.errors)
+
+
+def handle_product_errors(errors):
+	# Raise ProductMutationError when a mutation returned productErrors
+	if errors:
+		raise ProductMutationError(errors)
+
+
+@functools.lru_cache(maxsize = 256)
+def operation_name(query):
+	# Name of the first operation defined in a graphQL document, "anonymous" when it has none
+	match = re.search(r"\b(?:query|mutation)\s+(\w+)", query or "")
+	return match.group(1) if match else "anonymous"
+
+
+@functools.lru_cache(maxsize = 256)
+def creates_objects(query):
+	# Whether a graphQL document runs one of the CREATE_MUTATIONS, sending it twice could create the object twice
+	return re.search(r"\b(?:{0})\s*\(".format("|".join(CREATE_MUTATIONS)), query or "") is not None
+
+
+class Histogram:
+	"""Histogram.
+	Counts of observed values per bucket, with their sum and maximum.
+	Parameters
+	----------
+	buckets : tuple
+		sorted upper bounds of the buckets, values above the last one are
+		only counted in the total.
+	"""
+
+	__slots__ = ("buckets", "counts", "count", "sum", "max")
+
+	def __init__(self, buckets = METRICS_BUCKETS):
+		self.buckets = buckets
+		self.counts = [0] * len(buckets)
+		self.count = 0
+		self.sum = 0.0
+		self.max = 0.0
+
+	def observe(self, value):
+		for index, bound in enumerate(self.buckets):
+			if value <= bound:
+				self.counts[index] += 1
+				break
+		self.count += 1
+		self.sum += value
+		self.max = max(self.max, value)
+
+	def merge(self, other):
+		for index, count in enumerate(other.counts):
+			self.counts[index] += count
+		self.count += other.count
+		self.sum += other.sum
+		self.max = max(self.max, other.max)
+
+	def quantile(self, q):
+		# Estimate of the q quantile, interpolated inside the bucket holding it like Prometheus' histogram_quantile
+		rank = q * self.count
+		seen = 0
+		lower = 0.0
+		for bound, count in zip(self.buckets, self.counts):
+			if count and seen + count >= rank:
+				return min(lower + (bound - lower) * (rank - seen) / count, self.max)
+			seen += count
+			lower = bound
+		return self.max
+
+	def as_dict(self):
+		return {
+			"count": self.count,
+			"sum": self.sum,
+			"mean": self.sum / self.count if self.count else 0.0,
+			"p50": self.quantile(0.5),
+			"p95": self.quantile(0.95),
+			"p99": self.quantile(0.99),
+			"max": self.max
+		}
+
+
+class Metrics:
+	"""Metrics.
+	Thread safe collector of pipeline stage latencies, requests by graphQL
+	operation, bytes sent and received and retries. Comparing the stage
+	times with the request times and the process CPU time tells whether a
+	slow run is CPU-bound or network-bound.
+	Stages recorded by the loader: sheet_read, row_transform (which includes
+	description_conversion), category_resolve, create_update, sku_lookup and
+	catalog_load. Rows transformed in worker processes are merged back.
+	"""
+
+	def __init__(self, buckets = METRICS_BUCKETS):
+		self.buckets = buckets
+		self.lock = threading.Lock()
+		self.reset()
+
+	def reset(self):
+		with self.lock:
+			self.stages = {}
+			self.requests = {}
+			self.errors = {}
+			self.bytes_sent = 0
+			self.bytes_received = 0
+			self.retries = 0
+			self.started = time.perf_counter()
+			self.cpu_started = time.process_time()
+
+	def observe(self, stage, seconds):
+		with self.lock:
+			histogram = self.stages.get(stage)
+			if histogram is None:
+				histogram = self.stages[stage] = Histogram(self.buckets)
+			histogram.observe(seconds)
+
+	@contextlib.contextmanager
+	def stage(self, name):
+		# Time the body of a with block as one observation of a stage
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.observe(name, time.perf_counter() - start)
+
+	def timed(self, stage, iterable):
+		# Iterate over iterable, timing how long each item takes to produce
+		iterator = iter(iterable)
+		while True:
+			start = time.perf_counter()
+			try:
+				item = next(iterator)
+			except StopIteration:
+				return
+			self.observe(stage, time.perf_counter() - start)
+			yield item
+
+	def merge_stages(self, stages):
+		# Add stage histograms recorded by another process
+		with self.lock:
+			for name, other in stages.items():
+				histogram = self.stages.get(name)
+				if histogram is None:
+					histogram = self.stages[name] = Histogram(self.buckets)
+				histogram.merge(other)
+
+	def record_request(self, operation, seconds, sent, received, failed = False):
+		with self.lock:
+			histogram = self.requests.get(operation)
+			if histogram is None:
+				histogram = self.requests[operation] = Histogram(self.buckets)
+			histogram.observe(seconds)
+			self.bytes_sent += sent
+			self.bytes_received += received
+			if failed:
+				self.errors[operation] = self.errors.get(operation, 0) + 1
+
+	def record_retry(self):
+		with self.lock:
+			self.retries += 1
+
+	def summary(self):
+		"""summary.
+		Returns
+		-------
+		summary : dict
+			wall clock and CPU seconds since the last reset, latency
+			statistics in seconds per stage and per operation (with its
+			error count), bytes sent and received and retries.
+		"""
+
+		with self.lock:
+			requests = {}
+			for operation, histogram in sorted(self.requests.items()):
+				requests[operation] = dict(histogram.as_dict(), errors = self.errors.get(operation, 0))
+			return {
+				"wall_seconds": time.perf_counter() - self.started,
+				"cpu_seconds": time.process_time() - self.cpu_started,
+				"stages": {name: histogram.as_dict() for name, histogram in sorted(self.stages.items())},
+				"requests": requests,
+				"request_count": sum(histogram.count for histogram in self.requests.values()),
+				"bytes_sent": self.bytes_sent,
+				"bytes_received": self.bytes_received,
+				"retries": self.retries
+			}
+
+	def prometheus(self, prefix = METRICS_PREFIX):
+		"""prometheus.
+		Returns
+		-------
+		text : str
+			the metrics in the Prometheus text exposition format.
+		"""
+
+		lines = []
+
+		def histogram_lines(name, label, histograms):
+			lines.append("# TYPE {0}_{1} histogram".format(prefix, name))
+			for value, histogram in sorted(histograms.items()):
+				cumulative = 0
+				for bound, count in zip(histogram.buckets, histogram.counts):
+					cumulative += count
+					lines.append('{0}_{1}_bucket{{{2}="{3}",le="{4}"}} {5}'.format(prefix, name, label, value, bound, cumulative))
+				lines.append('{0}_{1}_bucket{{{2}="{3}",le="+Inf"}} {4}'.format(prefix, name, label, value, histogram.count))
+				lines.append('{0}_{1}_sum{{{2}="{3}"}} {4}'.format(prefix, name, label, value, histogram.sum))
+				lines.append('{0}_{1}_count{{{2}="{3}"}} {4}'.format(prefix, name, label, value, histogram.count))
+
+		with self.lock:
+			histogram_lines("stage_seconds", "stage", self.stages)
+			histogram_lines("request_seconds", "operation", self.requests)
+			lines.append("# TYPE {0}_request_errors_total counter".format(prefix))
+			for operation, count in sorted(self.errors.items()):
+				lines.append('{0}_request_errors_total{{operation="{1}"}} {2}'.format(prefix, operation, count))
+			for name, value in (("bytes_sent_total", self.bytes_sent), ("bytes_received_total", self.bytes_received),
+					("retries_total", self.retries)):
+				lines.append("# TYPE {0}_{1} counter".format(prefix, name))
+				lines.append("{0}_{1} {2}".format(prefix, name, value))
+
+		return "\n".join(lines) + "\n"
+
+	def write(self, path):
+		# Write the JSON summary, or the Prometheus text when path ends with .prom
+		if path.endswith(".prom"):
+			with open(path, "w") as metrics_file:
+				metrics_file.write(self.prometheus())
+		else:
+			write_json_atomic(path, self.summary())
+
+
+# Metrics the loader records to unless given another Metrics
+METRICS = Metrics()
+
+
+def parse_graphql_response(status_code, headers, content, endpoint_url):
+	"""parse_graphql_response.
+	Parameters
+	----------
+	status_code : int
+		HTTP status of the response.
+	headers : mapping
+		response headers.
+	content : bytes
+		response body, already decompressed.
+	endpoint_url : str
+		endpoint the request was sent to, for error messages.
+	Returns
+	-------
+	response : dict
+		the parsed JSON graphQL response.
+	Raises
+	------
+	TransientRequestError
+		on retryable HTTP statuses, with the Retry-After seconds.
+	GraphQLError
+		when the status is otherwise not 200 or the body is not JSON.
+	"""
+
+	if status_code in TRANSIENT_STATUS_CODES:
+		retry_after = headers.get("Retry-After")
+		raise TransientRequestError(
+			"HTTP {0} from {1}".format(status_code, endpoint_url),
+			float(retry_after) if retry_after and retry_after.isdigit() else None,
+			maybe_applied = status_code == 504)
+
+	try:
+		parsed_response = json.loads(content)
+	except ValueError:
+		raise GraphQLError("HTTP {0}: response is not JSON".format(status_code))
+
+	if status_code != 200:
+		error = (parsed_response.get("errors") or [{}])[0]
+		raise GraphQLError("{0}\n extensions: {1}".format(
+			error.get("message"), error.get("extensions")))
+	return parsed_response
+
+
+class GraphQLTransport:
+	"""GraphQLTransport.
+	Sends GraphQL documents over a persistent requests.Session, so every call
+	reuses a pooled keep-alive connection instead of paying for TCP/TLS setup.
+	Any object with the same execute and execute_multipart methods can be
+	passed to ETLDataGetter as its transport.
+	Parameters
+	----------
+	endpoint_url : str
+		the graphQL endpoint url to query to.
+	pool_size : int
+		maximum number of connections kept open to the endpoint.
+	connect_timeout : float
+		seconds to wait for a connection to be established.
+	read_timeout : float
+		seconds to wait for the server to send a response.
+	compress_requests : bool
+		gzip request bodies and send them with Content-Encoding: gzip.
+	metrics : Metrics, optional
+		records every request, METRICS by default.
+	"""
+
+	def __init__(self, endpoint_url = GQL_DEFAULT_ENDPOINT, pool_size = HTTP_POOL_SIZE,
+			connect_timeout = HTTP_CONNECT_TIMEOUT, read_timeout = HTTP_READ_TIMEOUT,
+			compress_requests = HTTP_COMPRESS_REQUESTS, metrics = None):
+		self.endpoint_url = endpoint_url
+		self.metrics = metrics if metrics is not None else METRICS
+		self.timeout = (connect_timeout, read_timeout)
+		self.pool_size = pool_size
+		self.compress_requests = compress_requests
+		# cleared the first time the server rejects a persisted query request
+		self.persisted_queries_supported = True
+
+		import requests
+
+		self.session = requests.Session()
+		self.mount_adapter(pool_size)
+		self.session.headers.update({
+			"Connection": "keep-alive",
+			"Accept-Encoding": "gzip, deflate"
+		})
+
+	def mount_adapter(self, pool_size):
+		from requests.adapters import HTTPAdapter
+
+		# block instead of opening throwaway connections when the pool is exhausted
+		adapter = HTTPAdapter(pool_connections = 1, pool_maxsize = pool_size, pool_block = True)
+		self.session.mount("http://", adapter)
+		self.session.mount("https://", adapter)
+
+	def reserve(self, pool_size):
+		# Grow the connection pool to at least pool_size connections, connections already open are dropped
+		if pool_size > self.pool_size:
+			self.pool_size = pool_size
+			self.mount_adapter(pool_size)
+
+	def execute(self, query, variables = None, headers = None):
+		"""execute.
+		Parameters
+		----------
+		query : str
+			graphQL document to send.
+		variables : dict
+			variables of the document.
+		headers : dict
+			extra headers for this request (authorization).
+		Returns
+		-------
+		response : dict
+			the parsed JSON graphQL response.
+		Raises
+		------
+		TransientRequestError
+			on timeouts, connection errors and retryable HTTP statuses.
+		GraphQLError
+			when the response status code is otherwise not 200.
+		"""
+
+		return self.post_json({
+			"query": query,
+			"variables": variables or {}
+		}, headers)
+
+	def execute_persisted(self, prepared, variables = None, headers = None):
+		"""execute_persisted.
+		Sends only the sha256 hash of a prepared query (automatic persisted
+		queries). When the server does not know the hash yet the full text is
+		sent once to register it. When it does not support persisted queries
+		at all, the full text is sent from then on.
+		Parameters
+		----------
+		prepared : PreparedQuery
+			query document and its hash.
+		variables : dict
+			variables of the document.
+		headers : dict
+			extra headers for this request (authorization).
+		Returns
+		-------
+		response : dict
+			the parsed JSON graphQL response.
+		"""
+
+		if not self.persisted_queries_supported:
+			return self.execute(prepared.query, variables, headers)
+
+		payload = {
+			"variables": variables or {},
+			"extensions": {
+				"persistedQuery": {
+					"version": 1,
+					"sha256Hash": prepared.sha256
+				}
+			}
+		}
+
+		try:
+			response = self.post_json(payload, headers, operation_name(prepared.query))
+		except GraphQLError:
+			# servers without persisted query support reject a request with no query
+			self.persisted_queries_supported = False
+			return self.execute(prepared.query, variables, headers)
+
+		messages = [error.get("message", "") for error in response.get("errors") or []]
+		if "PersistedQueryNotFound" in messages:
+			payload["query"] = prepared.query
+			return self.post_json(payload, headers, operation_name(prepared.query))
+		if "PersistedQueryNotSupported" in messages or (messages and response.get("data") is None):
+			self.persisted_queries_supported = False
+			return self.execute(prepared.query, variables, headers)
+
+		return response
+
+	def post_json(self, payload, headers = None, operation = None):
+		body = json.dumps(payload).encode("utf-8")
+
+		request_headers = {"Content-Type": "application/json"}
+		if self.compress_requests:
+			body = gzip.compress(body)
+			request_headers["Content-Encoding"] = "gzip"
+		if headers:
+			request_headers.update(headers)
+
+		return self.post(body, request_headers, operation or operation_name(payload.get("query")))
+
+	def execute_multipart(self, body, headers = None):
+		"""execute_multipart.
+		Parameters
+		----------
+		body : dict
+			multipart payload, see saleor_gql_loader.utils.get_payload.
+		headers : dict
+			extra headers for this request (authorization).
+		Returns
+		-------
+		response : dict
+			the parsed JSON graphQL response.
+		"""
+
+		from requests_toolbelt import MultipartEncoder
+
+		# a retried request has to send the files from their start again
+		for value in body.values():
+			if isinstance(value, tuple) and hasattr(value[1], "seek"):
+				value[1].seek(0)
+
+		encoder = MultipartEncoder(body)
+		request_headers = {"Content-Type": encoder.content_type}
+		if headers:
+			request_headers.update(headers)
+
+		return self.post(encoder, request_headers, operation_name(body.get("operations")))
+
+	def post(self, body, headers, operation = "anonymous"):
+		import requests
+
+		sent = body.len if hasattr(body, "len") else len(body)
+		start = time.perf_counter()
+		try:
+			response = self.session.post(
+				self.endpoint_url, data = body, headers = headers, timeout = self.timeout)
+		except (requests.ConnectionError, requests.Timeout) as e:
+			self.metrics.record_request(operation, time.perf_counter() - start, sent, 0, failed = True)
+			raise TransientRequestError(str(e), maybe_applied = isinstance(e, requests.ReadTimeout))
+
+		# bytes on the wire, compressed when the server gzipped the response
+		received = int(response.headers.get("Content-Length") or len(response.content))
+		try:
+			parsed_response = self.parse_response(response)
+		except Exception:
+			self.metrics.record_request(operation, time.perf_counter() - start, sent, received, failed = True)
+			raise
+
+		self.metrics.record_request(operation, time.perf_counter() - start, sent, received)
+		return parsed_response
+
+	def parse_response(self, response):
+		return parse_graphql_response(response.status_code, response.headers, response.content, self.endpoint_url)
+
+	def close(self):
+		self.session.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		self.close()
+
+
+def iter_sheet_rows(path):
+	"""iter_sheet_rows.
+	Parameters
+	----------
+	path : str
+		.xls, .xlsx or .csv file, the first row is a header.
+	Returns
+	-------
+	rows : generator
+		(row number, list of cell values) for each data row of the first
+		sheet, read lazily. Empty cells are "".
+	"""
+
+	extension = os.path.splitext(path)[1].lower()
+
+	if extension == ".csv":
+		with open(path, newline = "", encoding = "utf-8-sig") as csv_file:
+			reader = csv.reader(csv_file)
+			next(reader, None)
+			for row_number, row in enumerate(reader, 1):
+				yield row_number, row
+
+	elif extension in (".xlsx", ".xlsm"):
+		# openpyxl is only needed for xlsx, read_only mode parses rows as they are iterated
+		import openpyxl
+		workbook = openpyxl.load_workbook(path, read_only = True, data_only = True)
+		try:
+			rows = workbook.worksheets[0].iter_rows(min_row = 2, values_only = True)
+			for row_number, row in enumerate(rows, 1):
+				yield row_number, ["" if value is None else value for value in row]
+		finally:
+			workbook.close()
+
+	else:
+		# xls is a binary format xlrd has to load whole, rows are still built one at a time
+		import xlrd
+		workbook = xlrd.open_workbook(path, on_demand = True)
+		try:
+			sheet = workbook.sheet_by_index(0)
+			for row_number in range(1, sheet.nrows):
+				yield row_number, sheet.row_values(row_number)
+		finally:
+			workbook.release_resources()
+
+
+def cell_text(value):
+	# Numeric cells come back as floats, keep whole numbers looking like the sheet (1234 not 1234.0)
+	if isinstance(value, float) and value.is_integer():
+		return str(int(value))
+	return str(value)
+
+
+def batch_results(response, count):
+	"""batch_results.
+	Parameters
+	----------
+	response : dict
+		graphQL response to a document built by batch_query.
+	count : int
+		number of aliased mutations in the document.
+	Returns
+	-------
+	results : list
+		per alias, either the mutation payload dict or the Exception raised
+		for that row.
+	"""
+
+	# top level errors carry the alias of the field that failed in their path,
+	# errors without one (validation, query cost...) concern every alias
+	alias_errors = {}
+	document_errors = []
+	for error in response.get("errors") or []:
+		path = error.get("path") or []
+		if path:
+			alias_errors.setdefault(path[0], error["message"])
+		else:
+			document_errors.append(error["message"])
+
+	data = response.get("data") or {}
+	results = []
+	for index in range(count):
+		alias = "m{0}".format(index)
+		payload = data.get(alias)
+		if alias in alias_errors or payload is None:
+			messages = [alias_errors[alias]] if alias in alias_errors else []
+			messages.extend(document_errors)
+			results.append(GraphQLError("; ".join(messages) or "no data returned for " + alias))
+		elif payload["productErrors"]:
+			results.append(ProductMutationError(payload["productErrors"]))
+		else:
+			results.append(payload)
+	return results
+
+
+def batch_rejected(response):
+	# The server refused the whole batch document: no data at all and only errors without a path
+	errors = response.get("errors") or []
+	return not response.get("data") and bool(errors) and not any(error.get("path") for error in errors)
+
+
+def iter_batches(iterable, batch_size):
+	# Split an iterable into lists of batch_size items without reading it all
+	iterator = iter(iterable)
+	while True:
+		batch = list(islice(iterator, batch_size))
+		if not batch:
+			return
+		yield batch
+
+
+def bounded_map(executor, fn, iterable, window):
+	"""bounded_map.
+	Like executor.map, but only pulls items from iterable as results are
+	consumed, so a lazy iterable is never read more than window items ahead.
+	Parameters
+	----------
+	executor : Executor
+		executor the calls are submitted to.
+	fn : callable
+		function called with each item.
+	iterable : iterable
+		items to map over.
+	window : int
+		maximum number of submitted calls whose result has not been yielded.
+	Returns
+	-------
+	results : generator
+		fn(item) for each item, in the same order as iterable.
+	"""
+
+	pending = deque()
+	for item in iterable:
+		pending.append(executor.submit(fn, item))
+		if len(pending) >= window:
+			yield pending.popleft().result()
+	while pending:
+		yield pending.popleft().result()
+
+
+async def async_bounded_map(fn, items, window):
+	"""async_bounded_map.
+	asyncio version of bounded_map: runs fn on each item as a task, with at
+	most window tasks whose result has not been yielded.
+	Parameters
+	----------
+	fn : coroutine function
+		called with each item.
+	items : async iterable
+		items to map over.
+	window : int
+		maximum number of tasks whose result has not been yielded.
+	Returns
+	-------
+	results : async generator
+		await fn(item) for each item, in the same order as items.
+	"""
+
+	import asyncio
+
+	pending = deque()
+	try:
+		async for item in items:
+			pending.append(asyncio.ensure_future(fn(item)))
+			if len(pending) >= window:
+				yield await pending.popleft()
+		while pending:
+			yield await pending.popleft()
+	finally:
+		# the consumer stopped early or a task failed, do not leave the others running
+		for task in pending:
+			task.cancel()
+
+
+async def iter_in_thread(iterable, chunk_size):
+	# Items of a blocking iterable (sheet rows, worker results), read chunk_size at a time in a worker thread
+	import asyncio
+
+	iterator = iter(iterable)
+	while True:
+		chunk = await asyncio.to_thread(list, islice(iterator, chunk_size))
+		if not chunk:
+			return
+		for item in chunk:
+			yield item
+
+
+class SingleFlight:
+	"""SingleFlight.
+	Runs a call once per key at a time: callers asking for a key whose call
+	is still in flight wait for it and share its result or exception
+	instead of running it again.
+	"""
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.calls = {}
+
+	def do(self, key, fn, *args):
+		with self.lock:
+			call = self.calls.get(key)
+			leader = call is None
+			if leader:
+				call = self.calls[key] = Future()
+
+		if not leader:
+			return call.result()
+
+		try:
+			call.set_result(fn(*args))
+		except BaseException as e:
+			call.set_exception(e)
+		finally:
+			with self.lock:
+				del self.calls[key]
+		return call.result()
+
+
+def write_json_atomic(path, data):
+	# Write to a temp file and swap it in so a crash never leaves a half written file
+	temp_path = path + ".tmp"
+	with open(temp_path, "w") as json_file:
+		json.dump(data, json_file)
+		json_file.flush()
+		os.fsync(json_file.fileno())
+	os.replace(temp_path, path)
+
+
+def product_input_hash(product_input):
+	"""product_input_hash.
+	Parameters
+	----------
+	product_input : dict
+		ProductCreateInput built for a row, see get_product_input.
+	Returns
+	-------
+	hash : str
+		sha256 of the normalized input, equal for rows that would send the
+		same product. Draft.js block keys are ignored.
+	"""
+
+	normalized = dict(product_input)
+	try:
+		description = json.loads(normalized["descriptionJson"])
+		for block in description["blocks"]:
+			block.pop("key", None)
+		normalized["descriptionJson"] = description
+	except (KeyError, TypeError, ValueError):
+		# descriptions that are not Draft.js JSON are hashed as they are
+		pass
+
+	encoded = json.dumps(normalized, sort_keys = True, separators = (",", ":"), ensure_ascii = False)
+	return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class RowHashStore:
+	"""RowHashStore.
+	SKU -> hash of the product input last uploaded for it, kept in a local
+	JSON file between runs.
+	Parameters
+	----------
+	path : str
+		location of the store file.
+	"""
+
+	def __init__(self, path):
+		self.path = path
+		self.hashes = {}
+
+	def load(self):
+		if os.path.exists(self.path):
+			with open(self.path) as store_file:
+				self.hashes = json.load(store_file)["hashes"]
+		return self
+
+	def save(self):
+		write_json_atomic(self.path, {"hashes": self.hashes})
+
+
+class CachedRowHashStore(RowHashStore):
+	# RowHashStore kept in the row_hashes table of a CatalogCache instead of a JSON file
+
+	def __init__(self, cache):
+		super().__init__(cache.path)
+		self.cache = cache
+
+	def load(self):
+		self.hashes = self.cache.load_row_hashes()
+		return self
+
+	def save(self):
+		self.cache.save_row_hashes(self.hashes)
+
+
+class CatalogCache:
+	"""CatalogCache.
+	Local SQLite copy of what an import starts from: the categories, the
+	SKU -> product id map, product types and the row hashes of delta
+	imports. On refresh only the products updated since the newest
+	updatedAt already cached are fetched, every product is fetched again
+	when the count shows products were deleted elsewhere. Categories, a
+	few pages, are always reloaded. An SKU whose cached product turns out
+	deleted is created again by the upload, see recreate_product.
+	Parameters
+	----------
+	path : str
+		SQLite file of the cache, created when missing.
+	endpoint_url : str
+		endpoint the cache belongs to, the cache of another endpoint is cleared.
+	"""
+
+	def __init__(self, path = CATALOG_CACHE_FILE, endpoint_url = GQL_DEFAULT_ENDPOINT):
+		import sqlite3
+
+		self.path = path
+		self.connection = sqlite3.connect(path)
+		self.connection.executescript(CATALOG_CACHE_SCHEMA)
+		if self.get_meta("endpoint") != endpoint_url:
+			self.clear()
+			self.set_meta("endpoint", endpoint_url)
+
+	def get_meta(self, key):
+		row = self.connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+		return row[0] if row else None
+
+	def set_meta(self, key, value):
+		with self.connection:
+			self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+	def count(self, table):
+		return self.connection.execute("SELECT COUNT(*) FROM " + table).fetchone()[0]
+
+	def clear(self):
+		with self.connection:
+			for table in ("meta", "categories", "products", "skus", "product_types", "row_hashes"):
+				self.connection.execute("DELETE FROM " + table)
+
+	def close(self):
+		self.connection.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		self.close()
+
+	def refresh(self, getter):
+		"""refresh.
+		Parameters
+		----------
+		getter : ETLDataGetter
+			client the changes are fetched with.
+		Returns
+		-------
+		categories_trie : CategoryTrie
+			every category.
+		sku_index : dict
+			SKU -> product id of every product.
+		"""
+
+		return self.refresh_categories(getter), self.refresh_products(getter)
+
+	def refresh_categories(self, getter):
+		# Categories have no updatedAt and a rename or move keeps their count, so they are always reloaded
+		categories_trie = getter.query_all_categories()
+		self.store_categories(categories_trie)
+		return categories_trie
+
+	def refresh_products(self, getter):
+		watermark = self.get_meta("products_updated_at")
+		if watermark is not None:
+			try:
+				changed, total = self.fetch_changed_products(getter, watermark)
+			except GraphQLError as e:
+				print("Incremental catalog refresh failed, reloading every product:", e)
+			else:
+				self.store_products(changed)
+				# updatedAt does not show deleted products, the count does
+				if total == self.count("products"):
+					print("Refreshed", len(changed), "products updated since", watermark)
+					return self.sku_index()
+
+		self.store_products(getter.paginate(CACHE_PRODUCTS_QUERY, "products"), replace = True)
+		print("Cached", self.count("products"), "products")
+		return self.sku_index()
+
+	def fetch_changed_products(self, getter, watermark):
+		# Products updated at or after watermark, newest first, and the server product count
+		variables = {"sortBy": {"field": CACHE_UPDATED_SORT_FIELD, "direction": "DESC"}}
+		changed = []
+		total = None
+		for page in getter.iter_pages(CACHE_PRODUCTS_QUERY, "products", variables):
+			total = page["totalCount"]
+			for edge in page["edges"]:
+				if (edge["node"]["updatedAt"] or "") < watermark:
+					return changed, total
+				changed.append(edge["node"])
+		return changed, total
+
+	def store_categories(self, categories_trie):
+		with self.connection:
+			self.connection.execute("DELETE FROM categories")
+			self.connection.executemany(
+				"INSERT INTO categories (id, name, parent_id) VALUES (?, ?, ?)",
+				((node.id, node.name, node.parent.id if node.parent is not None else None)
+				for node in categories_trie.nodes.values()))
+
+	def store_products(self, nodes, replace = False):
+		# Upsert product nodes (id, updatedAt, variants) and their SKUs, replace drops every other product
+		watermark = None if replace else self.get_meta("products_updated_at")
+		with self.connection:
+			if replace:
+				self.connection.execute("DELETE FROM products")
+				self.connection.execute("DELETE FROM skus")
+			for node in nodes:
+				self.connection.execute(
+					"INSERT OR REPLACE INTO products (id, updated_at) VALUES (?, ?)", (node["id"], node.get("updatedAt")))
+				if not replace:
+					self.connection.execute("DELETE FROM skus WHERE product_id = ?", (node["id"],))
+				self.connection.executemany(
+					"INSERT OR REPLACE INTO skus (sku, product_id) VALUES (?, ?)",
+					((variant["sku"], node["id"]) for variant in node.get("variants") or []))
+				if node.get("updatedAt") and (watermark is None or node["updatedAt"] > watermark):
+					watermark = node["updatedAt"]
+			if watermark is not None:
+				self.connection.execute(
+					"INSERT OR REPLACE INTO meta (key, value) VALUES ('products_updated_at', ?)", (watermark,))
+
+	def store_sku_index(self, sku_index):
+		# Write through the SKUs created by an import, their updatedAt comes with the next refresh
+		with self.connection:
+			self.connection.executemany(
+				"INSERT OR IGNORE INTO products (id, updated_at) VALUES (?, NULL)",
+				((product_id,) for product_id in set(sku_index.values())))
+			self.connection.executemany(
+				"INSERT OR REPLACE INTO skus (sku, product_id) VALUES (?, ?)", sku_index.items())
+
+	def sku_index(self):
+		return dict(self.connection.execute("SELECT sku, product_id FROM skus"))
+
+	def product_type_id(self, name):
+		row = self.connection.execute("SELECT id FROM product_types WHERE name = ?", (name,)).fetchone()
+		return row[0] if row else None
+
+	def store_product_type(self, name, product_type_id):
+		with self.connection:
+			self.connection.execute("INSERT OR REPLACE INTO product_types (name, id) VALUES (?, ?)", (name, product_type_id))
+
+	def load_row_hashes(self):
+		return dict(self.connection.execute("SELECT sku, hash FROM row_hashes"))
+
+	def save_row_hashes(self, hashes):
+		with self.connection:
+			self.connection.executemany("INSERT OR REPLACE INTO row_hashes (sku, hash) VALUES (?, ?)", hashes.items())
+
+
+def sheet_identity(path):
+	# The sheet a checkpoint or retry list belongs to, a new size or modification time means the rows may have moved
+	stat = os.stat(path)
+	return {"path": os.path.abspath(path), "size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+
+class ImportCheckpoint:
+	"""ImportCheckpoint.
+	Durable progress of an interrupted import: the last sheet row whose
+	upload finished, the rows before it that failed and the SKU -> product
+	id mappings seen so far. Written atomically so a crash never leaves a
+	half written file. A resumed import continues after the last row, the
+	failed rows go to the ImportRetryList once it completes.
+	Parameters
+	----------
+	path : str
+		location of the state file.
+	source : dict
+		identity of the sheet being imported, see sheet_identity. A
+		checkpoint of another sheet, or of an earlier version of it, is
+		ignored.
+	"""
+
+	def __init__(self, path, source):
+		self.path = path
+		self.source = source
+		self.last_row = 0
+		self.failed_rows = set()
+		self.sku_ids = {}
+
+	def load(self):
+		# Restore progress from the state file, returns True when resuming
+		if not os.path.exists(self.path):
+			return False
+
+		with open(self.path) as state_file:
+			state = json.load(state_file)
+
+		if state.get("source") != self.source:
+			print("Ignoring checkpoint of another sheet or of an earlier version of it:", state.get("source"))
+			return False
+
+		self.last_row = state["last_row"]
+		self.failed_rows = set(state.get("failed_rows", []))
+		self.sku_ids = state["sku_ids"]
+		return True
+
+	def pending(self, row_number):
+		# Whether a resumed import still has to upload the row
+		return row_number > self.last_row
+
+	def commit(self, last_row):
+		# Record that every row up to last_row was processed, the failed ones with them
+		self.last_row = max(self.last_row, last_row)
+		state = {
+			"source": self.source,
+			"last_row": self.last_row,
+			"failed_rows": sorted(self.failed_rows),
+			"sku_ids": self.sku_ids
+		}
+
+		write_json_atomic(self.path, state)
+
+	def clear(self):
+		if os.path.exists(self.path):
+			os.remove(self.path)
+
+
+class ImportRetryList:
+	"""ImportRetryList.
+	Sheet rows that failed on the last import, for a later run to import
+	them on their own once the cause is fixed on the server side.
+	Parameters
+	----------
+	path : str
+		location of the file.
+	source : dict
+		identity of the sheet, see sheet_identity. A list of another sheet,
+		or of an earlier version of it, is ignored since its row numbers
+		may no longer match.
+	"""
+
+	def __init__(self, path, source):
+		self.path = path
+		self.source = source
+		self.rows = set()
+
+	def load(self):
+		# Read the failed rows, returns True when there is a list for this sheet
+		if not os.path.exists(self.path):
+			return False
+
+		with open(self.path) as retry_file:
+			state = json.load(retry_file)
+
+		if state.get("source") != self.source:
+			print("Ignoring failed rows of another sheet or of an earlier version of it:", state.get("source"))
+			return False
+
+		self.rows = set(state["rows"])
+		return True
+
+	def save(self):
+		# Write the failed rows, or remove the file when none failed
+		if not self.rows:
+			self.clear()
+			return
+		write_json_atomic(self.path, {"source": self.source, "rows": sorted(self.rows)})
+
+	def clear(self):
+		if os.path.exists(self.path):
+			os.remove(self.path)
+
+
+class ImageStore:
+	"""ImageStore.
+	Downloaded images kept on disk under their sha256, with an index of the
+	url each came from (and its ETag/Last-Modified for conditional requests)
+	and of the images already uploaded to each product, saved between runs.
+	Parameters
+	----------
+	directory : str
+		location of the image files and of index.json.
+	"""
+
+	def __init__(self, directory = IMAGE_CACHE_DIR):
+		self.directory = directory
+		self.index_path = os.path.join(directory, "index.json")
+		# url -> {sha256, etag, last_modified, content_type}
+		self.urls = {}
+		# product id -> {sha256: image id}
+		self.uploads = {}
+		self.lock = threading.Lock()
+
+	def load(self):
+		os.makedirs(self.directory, exist_ok = True)
+		if os.path.exists(self.index_path):
+			with open(self.index_path) as index_file:
+				index = json.load(index_file)
+			self.urls = index["urls"]
+			self.uploads = index["uploads"]
+		return self
+
+	def save(self):
+		with self.lock:
+			write_json_atomic(self.index_path, {"urls": self.urls, "uploads": self.uploads})
+
+	def blob_path(self, sha256):
+		return os.path.join(self.directory, sha256)
+
+	def fetch(self, url, session):
+		"""fetch.
+		Parameters
+		----------
+		url : str
+			http(s) url of the image, or a local file path.
+		session : requests.Session
+			session downloads are made with.
+		Returns
+		-------
+		entry : dict
+			sha256 and content_type of the image, its file is blob_path(sha256).
+		status : str
+			"downloaded", "not_modified" when the stored copy was still
+			current (HTTP 304), or "read" for a local file.
+		"""
+
+		with self.lock:
+			entry = self.urls.get(url)
+		headers = {}
+		if entry is not None and os.path.exists(self.blob_path(entry["sha256"])):
+			if entry.get("etag"):
+				headers["If-None-Match"] = entry["etag"]
+			if entry.get("last_modified"):
+				headers["If-Modified-Since"] = entry["last_modified"]
+
+		if not url.lower().startswith(("http://", "https://")):
+			with open(url, "rb") as source:
+				entry = self.store(iter(lambda: source.read(IMAGE_CHUNK_SIZE), b""), {
+					"content_type": mimetypes.guess_type(url)[0]
+				})
+			status = "read"
+		else:
+			# the body is streamed to disk a chunk at a time, never held whole in memory
+			with session.get(url, headers = headers, stream = True, timeout = IMAGE_DOWNLOAD_TIMEOUT) as response:
+				if response.status_code == 304 and headers:
+					return entry, "not_modified"
+				response.raise_for_status()
+				entry = self.store(response.iter_content(IMAGE_CHUNK_SIZE), {
+					"etag": response.headers.get("ETag"),
+					"last_modified": response.headers.get("Last-Modified"),
+					"content_type": response.headers.get("Content-Type") or mimetypes.guess_type(urlsplit(url).path)[0]
+				})
+			status = "downloaded"
+
+		with self.lock:
+			self.urls[url] = entry
+		return entry, status
+
+	def store(self, chunks, entry):
+		# Write chunks to a temporary file while hashing them, then move it to its content address
+		digest = hashlib.sha256()
+		handle, temp_path = tempfile.mkstemp(dir = self.directory, suffix = ".part")
+		try:
+			with os.fdopen(handle, "wb") as blob:
+				for chunk in chunks:
+					digest.update(chunk)
+					blob.write(chunk)
+			entry["sha256"] = digest.hexdigest()
+			os.replace(temp_path, self.blob_path(entry["sha256"]))
+		except BaseException:
+			os.remove(temp_path)
+			raise
+		return entry
+
+	def uploaded(self, product_id, sha256):
+		with self.lock:
+			return self.uploads.get(product_id, {}).get(sha256)
+
+	def record_upload(self, product_id, sha256, image_id):
+		with self.lock:
+			self.uploads.setdefault(product_id, {})[sha256] = image_id
+
+
+class ImagePipeline:
+	"""ImagePipeline.
+	Downloads product images and uploads them with productImageCreate,
+	concurrency images at a time, while rows keep arriving. Each url is
+	fetched at most once per run (conditionally when it was fetched by an
+	earlier run) however many products share it, and an image whose content
+	a product already has is not uploaded again.
+	Parameters
+	----------
+	getter : ETLDataGetter
+		client the images are uploaded with.
+	store : ImageStore
+		downloaded images and uploads of earlier runs.
+	concurrency : int
+		images downloaded or uploaded at once.
+	"""
+
+	def __init__(self, getter, store, concurrency = IMAGE_CONCURRENCY):
+		import requests
+		from requests.adapters import HTTPAdapter
+
+		self.getter = getter
+		self.store = store
+		self.session = requests.Session()
+		adapter = HTTPAdapter(pool_maxsize = concurrency, pool_block = True)
+		self.session.mount("http://", adapter)
+		self.session.mount("https://", adapter)
+
+		self.executor = ThreadPoolExecutor(max_workers = concurrency)
+		# bounds the images queued behind the ones in flight
+		self.slots = threading.BoundedSemaphore(concurrency * IMAGE_QUEUE_DEPTH)
+		self.flights = SingleFlight()
+		self.fetched = {}
+		self.lock = threading.Lock()
+		self.stats = dict.fromkeys(("downloaded", "not_modified", "read", "uploaded", "skipped", "failed"), 0)
+
+	def count(self, name):
+		with self.lock:
+			self.stats[name] += 1
+
+	def submit(self, product_id, url):
+		# Queue the image of a product, blocks while the queue is full
+		if not product_id or not url or not str(url).strip():
+			return
+		self.slots.acquire()
+		future = self.executor.submit(self.ingest, product_id, str(url).strip())
+		future.add_done_callback(lambda future: self.slots.release())
+
+	def fetch(self, url):
+		# Fetch url once per run, later products sharing it reuse the first result
+		if url in self.fetched:
+			return self.fetched[url]
+		entry, status = self.store.fetch(url, self.session)
+		self.count(status)
+		self.fetched[url] = entry
+		return entry
+
+	def ingest(self, product_id, url):
+		try:
+			entry = self.flights.do(url, self.fetch, url)
+			if self.store.uploaded(product_id, entry["sha256"]):
+				self.count("skipped")
+				return
+			file_name = os.path.basename(urlsplit(url).path) or entry["sha256"]
+			image_id = self.getter.create_product_image(
+				product_id, self.store.blob_path(entry["sha256"]), entry.get("content_type"), file_name)
+			self.store.record_upload(product_id, entry["sha256"], image_id)
+			self.count("uploaded")
+		except Exception as e:
+			self.count("failed")
+			print("Image", url, "of product", product_id, "could not be uploaded:", e)
+
+	def close(self):
+		"""close.
+		Waits for the queued images and saves the store index.
+		Returns
+		-------
+		stats : dict
+			number of images downloaded, not modified since the last run,
+			read from local files, uploaded, skipped because the product
+			already had them, and failed.
+		"""
+
+		self.executor.shutdown(wait = True)
+		self.session.close()
+		self.store.save()
+		return dict(self.stats)
+
+
+class DescriptionConverter:
+	"""DescriptionConverter.
+	Turns product description HTML into Draft.js lines. The rules are
+	compiled once: one expression removes boilerplate, comments, script/style
+	elements and every inline tag with its attributes in a single pass, and
+	one turns the remaining block tags into line breaks.
+	Parameters
+	----------
+	boilerplate : list
+		regular expressions, starting at their opening "<", removed together
+		with the text they match.
+	block_tags : list
+		tag names replaced by a line break, any other tag is dropped.
+	"""
+
+	def __init__(self, boilerplate = DESCRIPTION_BOILERPLATE, block_tags = DESCRIPTION_BLOCK_TAGS):
+		block_names = "|".join(block_tags)
+
+		# every alternative starts with "<" so the scan can skip straight to tags
+		alternatives = ["(?:{0})".format(pattern[1:]) for pattern in boilerplate]
+		alternatives.append(r"!--.*?-->")
+		alternatives.append(r"(?:script|style)\b[^>]*>.*?</(?:script|style)\s*>")
+		alternatives.append(r"/?(?!(?:{0})\b)[a-zA-Z!][^>]*>".format(block_names))
+		self.strip_pattern = re.compile(
+			"<(?:{0})".format("|".join(alternatives)), re.IGNORECASE | re.DOTALL)
+		self.block_pattern = re.compile(r"</?(?:{0})\b[^>]*>".format(block_names), re.IGNORECASE)
+
+	def lines(self, input_html):
+		"""lines.
+		Parameters
+		----------
+		input_html : str
+			description HTML from the excel sheet.
+		Returns
+		-------
+		lines : list
+			stripped, non empty text lines with entities unescaped.
+		"""
+
+		text = self.block_pattern.sub("\n", self.strip_pattern.sub("", str(input_html)))
+		lines = []
+		for line in text.split("\n"):
+			line = line.strip()
+			if line:
+				lines.append(html.unescape(line) if "&" in line else line)
+		return lines
+
+
+DESCRIPTION_CONVERTER = DescriptionConverter()
+
+
+class BlockKeyGenerator:
+	"""BlockKeyGenerator.
+	Makes the keys of Draft.js description blocks.
+	Parameters
+	----------
+	mode : str
+		"deterministic", "fast" or "secure", see BLOCK_KEY_MODE. Deterministic
+		keys need a seed, without one they are made in fast mode.
+	"""
+
+	def __init__(self, mode = BLOCK_KEY_MODE):
+		if mode not in ("deterministic", "fast", "secure"):
+			raise ValueError("unknown block key mode: " + mode)
+		self.mode = mode
+		# one generator for every key, not one per character
+		self.random = random.SystemRandom() if mode == "secure" else random.Random()
+
+	def key(self, seed, index):
+		"""key.
+		Parameters
+		----------
+		seed : str
+			value identifying the description, the row SKU.
+		index : int
+			index of the block in the description.
+		Returns
+		-------
+		key : str
+			BLOCK_KEY_LENGTH characters of BLOCK_KEY_ALPHABET.
+		"""
+
+		if self.mode != "deterministic" or seed is None:
+			return "".join(self.random.choices(BLOCK_KEY_ALPHABET, k = BLOCK_KEY_LENGTH))
+
+		digest = hashlib.blake2b("{0}:{1}".format(seed, index).encode("utf-8"), digest_size = 8).digest()
+		number = int.from_bytes(digest, "big")
+		characters = []
+		for _ in range(BLOCK_KEY_LENGTH):
+			number, remainder = divmod(number, len(BLOCK_KEY_ALPHABET))
+			characters.append(BLOCK_KEY_ALPHABET[remainder])
+		return "".join(characters)
+
+
+BLOCK_KEYS = BlockKeyGenerator()
+
+
+def description_json(input_html, sku = None):
+	"""description_json.
+	Parameters
+	----------
+	input_html : str
+		description HTML from the excel sheet.
+	sku : str, optional
+		row SKU the Draft.js block keys are derived from.
+	Returns
+	-------
+	descriptionJson : str
+		compact Draft.js JSON of the description.
+	"""
+
+	start = time.perf_counter()
+	blocks = []
+	for index, line in enumerate(DESCRIPTION_CONVERTER.lines(input_html)):
+		blocks.append({
+			"key": BLOCK_KEYS.key(sku, index),
+			"data": {},
+			"text": line,
+			"type": "unstyled",
+			"depth": 0,
+			"entityRanges": [],
+			"inlineStyleRanges": []
+		})
+	description = json.dumps({"blocks": blocks, "entityMap": {}}, separators = (",", ":"))
+	METRICS.observe("description_conversion", time.perf_counter() - start)
+	return description
+
+
+def parse_product_row(row):
+	"""parse_product_row.
+	Pure transformation of one sheet row, safe to run in worker processes.
+	Parameters
+	----------
+	row : list
+		cell values of one sheet row.
+	Returns
+	-------
+	product : dict
+		product object without its category id, product_categories holds
+		the category path. None when the row is skipped.
+	Raises
+	------
+	ValueError
+		when the price or weight cell is not a number.
+	"""
+
+	def cell_value(col):
+		return row[col] if col < len(row) else ""
+
+	def cell_number(col, field):
+		try:
+			return float(cell_value(col))
+		except (ValueError, TypeError):
+			raise ValueError("{0} {1!r} is not a number".format(field, cell_value(col)))
+
+	if cell_value(NAME_COL):
+		product_name = cell_text(cell_value(NAME_COL))
+		if "DEL THIS ITEM" in product_name:
+			print("Product for deletion found. Skipping Product...", file = sys.stderr)
+			return None
+	else:
+		return None
+
+	if cell_value(SKU_COL):
+		product_sku = cell_text(cell_value(SKU_COL))
+	else:
+		return None
+
+	if cell_value(PRICE_COL):
+		product_price = cell_number(PRICE_COL, "price")
+	else:
+		return None
+
+	if cell_value(DESCRIPTION_COL):
+		product_description = description_json(cell_value(DESCRIPTION_COL), product_sku)
+	else:
+		product_description = "This product has no description."
+
+	if cell_value(WEIGHT_COL):
+		product_weight = {
+			'unit': WEIGHT_DEFAULT_UNIT,
+			'value': cell_number(WEIGHT_COL, "weight")
+		}
+	else:
+		product_weight = None
+
+	# get and split categories into parent and child
+	if cell_value(CATEGORY_COL):
+		product_categories = cell_text(cell_value(CATEGORY_COL)).split('/')
+	else:
+		return None
+
+	product_image_url = cell_value(IMAGE_COL)
+
+	# ! @ERIC Title must have at most 70 characters, this needs to be handled probably on the excel sheet side.
+	# ! @ERIC Temporary code:::
+	product_seo_title = cell_text(cell_value(SEO_TITLE_COL))[:70]
+	# product_seo_title = cell_value(SEO_TITLE_COL)
+	product_seo_description = cell_text(cell_value(SEO_DESC_COL))
+
+	#  declare and initalize a product object to pass to the upload stage
+	return {
+		"product_name" : product_name,
+		"product_sku" : product_sku,
+		"product_description" : product_description,
+		"product_price" : product_price,
+		"product_weight" : product_weight,
+		"product_categories" : product_categories,
+		"product_image_url" : product_image_url,
+		"product_seo_title" : product_seo_title,
+		"product_seo_description" : product_seo_description
+	}
+
+
+def row_category_path(row):
+	# Category path of a row parse_product_row would import, None when it skips the row, without converting the rest of it
+	def cell_value(col):
+		return row[col] if col < len(row) else ""
+
+	if not (cell_value(NAME_COL) and cell_value(SKU_COL) and cell_value(PRICE_COL) and cell_value(CATEGORY_COL)):
+		return None
+	if "DEL THIS ITEM" in cell_text(cell_value(NAME_COL)):
+		return None
+	return [name.strip() for name in cell_text(cell_value(CATEGORY_COL)).split('/') if name.strip()]
+
+
+def transform_rows(rows):
+	"""transform_rows.
+	Parameters
+	----------
+	rows : list
+		(row number, row values) pairs, see iter_sheet_rows.
+	Returns
+	-------
+	products : list
+		product objects of the rows that were not skipped, with product_row
+		set, see parse_product_row. A row whose cells do not convert only
+		has product_sku and product_error set, the upload stage reports it
+		as failed.
+	"""
+
+	products = []
+	for row_number, row in rows:
+		start = time.perf_counter()
+		try:
+			product = parse_product_row(row)
+		except (ValueError, TypeError) as e:
+			product = {
+				"product_sku": cell_text(row[SKU_COL]) if len(row) > SKU_COL else "",
+				"product_error": "row {0}: {1}".format(row_number, e)
+			}
+		METRICS.observe("row_transform", time.perf_counter() - start)
+		if product is not None:
+			product["product_row"] = row_number
+			products.append(product)
+	return products
+
+
+def transform_rows_in_worker(rows):
+	# transform_rows for worker processes, also returns the stage timings the worker recorded for the parent to merge
+	METRICS.reset()
+	products = transform_rows(rows)
+	return products, METRICS.stages
+
+
+def iter_transformed_rows(rows, workers = TRANSFORM_WORKERS, chunk_rows = TRANSFORM_CHUNK_ROWS):
+	"""iter_transformed_rows.
+	Parameters
+	----------
+	rows : iterable
+		(row number, row values) pairs, see iter_sheet_rows.
+	workers : int
+		number of worker processes, 1 or less transforms in this process.
+	chunk_rows : int
+		number of rows sent to a worker at once.
+	Returns
+	-------
+	products : generator
+		product objects in sheet order. Chunks are only read from rows as
+		results are consumed, so parsing keeps pace with the upload stage.
+	"""
+
+	if workers <= 1:
+		for chunk in iter_batches(rows, chunk_rows):
+			yield from transform_rows(chunk)
+		return
+
+	from concurrent.futures import ProcessPoolExecutor
+
+	with ProcessPoolExecutor(max_workers = workers) as executor:
+		for products, stages in bounded_map(executor, transform_rows_in_worker, iter_batches(rows, chunk_rows), workers * 2):
+			METRICS.merge_stages(stages)
+			yield from products
+
+
+@functools.lru_cache(maxsize = 64)
+def batch_query(mutation, size):
+	# Document with size aliased fields of a BATCH_MUTATIONS mutation, only depends on the size
+	spec = BATCH_MUTATIONS[mutation]
+	definitions = []
+	fields = []
+
+	for index in range(size):
+		arguments = []
+		for name, graphql_type in spec["arguments"]:
+			variable = "{0}_{1}".format(name, index)
+			definitions.append("${0}: {1}".format(variable, graphql_type))
+			arguments.append("{0}: ${1}".format(name, variable))
+		fields.append("m{0}: {1}({2}) {{ {3} productErrors {{ field message code }} }}".format(
+			index, mutation, ", ".join(arguments), spec["selection"]))
+
+	return "mutation batch{0}({1}) {{\n{2}\n}}".format(
+		mutation[0].upper() + mutation[1:], ", ".join(definitions), "\n".join(fields))
+
+
+class PreparedQuery:
+	"""PreparedQuery.
+	A query document built once, with the sha256 hash it is persisted under.
+	"""
+
+	__slots__ = ("query", "sha256")
+
+	def __init__(self, query):
+		self.query = query
+		self.sha256 = hashlib.sha256(query.encode("utf-8")).hexdigest()
+
+
+@functools.lru_cache(maxsize = None)
+def product_query(profile):
+	# The get_product document of a profile, built once per profile
+	fragments, selection = PRODUCT_PROFILES[profile]
+	return PreparedQuery("""{0}
+		query get_product_{1}($id: ID!) {{
+			product(id: $id) {{{2}}}
+		}}
+	""".format(fragments, profile, selection))
+
+
+def normalize_category_name(name):
+	# Category names match ignoring case and surrounding/repeated whitespace
+	return " ".join(str(name).split()).casefold()
+
+
+class CategoryNode:
+	__slots__ = ("id", "name", "parent", "children")
+
+	def __init__(self, id, name, parent = None):
+		self.id = id
+		self.name = name
+		self.parent = parent
+		# normalized child name -> CategoryNode
+		self.children = {}
+
+
+class CategoryTrie:
+	"""CategoryTrie.
+	In-memory category tree keyed by normalized category name, so an
+	"A/B/C" path resolves in O(depth) dict lookups. Whole paths already
+	resolved are memoized.
+	"""
+
+	def __init__(self):
+		# a virtual root whose children are the top level categories
+		self.root = CategoryNode(None, None)
+		self.nodes = {}
+		self.paths = {}
+
+	@classmethod
+	def from_nodes(cls, nodes):
+		"""from_nodes.
+		Parameters
+		----------
+		nodes : iterable
+			category nodes as returned by graphQL, dicts with id, name and
+			parent ({id} or None), in any order.
+		Returns
+		-------
+		trie : CategoryTrie
+			the linked category tree.
+		"""
+
+		trie = cls()
+		parent_ids = {}
+		for node in nodes:
+			trie.nodes[node["id"]] = CategoryNode(node["id"], node["name"])
+			parent_ids[node["id"]] = node["parent"]["id"] if node.get("parent") else None
+
+		for category_id, parent_id in parent_ids.items():
+			trie.link(trie.nodes[category_id], trie.nodes.get(parent_id, trie.root))
+
+		return trie
+
+	def __len__(self):
+		return len(self.nodes)
+
+	def __contains__(self, category_id):
+		return category_id in self.nodes
+
+	def link(self, node, parent):
+		node.parent = parent
+		# keep the first category when the server has duplicate names under one parent
+		parent.children.setdefault(normalize_category_name(node.name), node)
+
+	def add(self, category_id, name, parent_id = None):
+		"""add.
+		Parameters
+		----------
+		category_id : str
+			id of the category.
+		name : str
+			name of the category.
+		parent_id : str, optional
+			id of the parent category, None for a top level category.
+		Returns
+		-------
+		node : CategoryNode
+			the node added to the trie.
+		"""
+
+		node = CategoryNode(category_id, name)
+		self.nodes[category_id] = node
+		self.link(node, self.nodes[parent_id] if parent_id is not None else self.root)
+		return node
+
+	def resolve(self, path, parent_id = None):
+		"""resolve.
+		Parameters
+		----------
+		path : list
+			category names from the outermost to the innermost category.
+		parent_id : str, optional
+			id of the category the path starts under, None for the top level.
+		Returns
+		-------
+		category_id : str
+			id of the deepest category of the path that exists, or parent_id
+			when none of it exists.
+		depth : int
+			number of path names that were matched.
+		"""
+
+		key = (parent_id,) + tuple(normalize_category_name(name) for name in path)
+		if key in self.paths:
+			return self.paths[key], len(path)
+
+		node = self.nodes[parent_id] if parent_id is not None else self.root
+		depth = 0
+		for name in key[1:]:
+			child = node.children.get(name)
+			if child is None:
+				break
+			node = child
+			depth += 1
+
+		if depth == len(path):
+			self.paths[key] = node.id
+
+		return node.id, depth
+
+	def path_of(self, category_id):
+		# Names from the top level down to the category
+		names = []
+		node = self.nodes[category_id]
+		while node is not self.root and node is not None:
+			names.append(node.name)
+			node = node.parent
+		return names[::-1]
+
+
+def missing_category_levels(paths, categories_trie):
+	"""missing_category_levels.
+	Parameters
+	----------
+	paths : iterable
+		category paths, lists of names from the outermost category, None
+		entries are ignored.
+	categories_trie : CategoryTrie
+		existing categories.
+	Returns
+	-------
+	levels : dict
+		depth -> path of every category missing from categories_trie at that
+		depth, each category once however many paths share it.
+	"""
+
+	# normalized prefix -> names, for every prefix missing from the trie
+	missing = {}
+	for path in paths:
+		if not path:
+			continue
+		category_id, depth = categories_trie.resolve(path)
+		for end in range(depth + 1, len(path) + 1):
+			key = tuple(normalize_category_name(name) for name in path[:end])
+			if key in missing:
+				continue
+			missing[key] = path[:end]
+
+	levels = {}
+	for key, names in missing.items():
+		levels.setdefault(len(key), []).append(names)
+	return levels
+
+
+def level_categories(paths, categories_trie):
+	# (name, parent id) of the missing categories of one level whose parent exists by now
+	categories = []
+	for names in paths:
+		parent_id, depth = categories_trie.resolve(names[:-1])
+		# the parent could not be created, deepest_id retries the path when a row needs it
+		if depth == len(names) - 1:
+			categories.append((names[-1], parent_id))
+	return categories
+
+
+def product_state(node):
+	# Current value of the DIFF_FIELDS of a product node selected with the sync profile, and its id
+	category = node.get("category") or {}
+	base_price = node.get("basePrice") or {}
+	return {
+		"id": node["id"],
+		"name": node.get("name"),
+		"descriptionJson": node.get("descriptionJson"),
+		"chargeTaxes": node.get("chargeTaxes"),
+		"isPublished": node.get("isPublished"),
+		"category": category.get("id"),
+		"basePrice": base_price.get("amount"),
+		"weight": node.get("weight"),
+		"seo": {
+			"title": node.get("seoTitle"),
+			"description": node.get("seoDescription")
+		}
+	}
+
+
+def comparable_field(field, value):
+	# Normalize a DIFF_FIELDS value so the sheet and the server spellings of the same value compare equal
+	if field == "descriptionJson" and isinstance(value, str):
+		try:
+			return json.loads(value)
+		except ValueError:
+			return value
+	if field == "basePrice" and value is not None:
+		return float(value)
+	if field == "weight":
+		return weight_grams(value)
+	if field == "seo":
+		value = value or {}
+		return (value.get("title") or "", value.get("description") or "")
+	return value
+
+
+def weight_grams(weight):
+	# A weight, {"unit", "value"} or a number in WEIGHT_DEFAULT_UNIT, in grams. None when it has no value
+	if isinstance(weight, dict):
+		value, unit = weight.get("value"), weight.get("unit") or WEIGHT_DEFAULT_UNIT
+	else:
+		value, unit = weight, WEIGHT_DEFAULT_UNIT
+	if value is None:
+		return None
+	return float(value) * WEIGHT_UNIT_GRAMS[str(unit).casefold()]
+
+
+def same_field_value(field, left, right):
+	# Whether two values of a DIFF_FIELDS field are the same once normalized, see comparable_field
+	left = comparable_field(field, left)
+	right = comparable_field(field, right)
+	if field == "weight" and left is not None and right is not None:
+		return math.isclose(left, right, abs_tol = WEIGHT_TOLERANCE_GRAMS)
+	return left == right
+
+
+def diff_product_fields(product_input, state):
+	"""diff_product_fields.
+	Parameters
+	----------
+	product_input : dict
+		ProductCreateInput built from a sheet row, see get_product_input.
+	state : dict
+		current product fields, see product_state.
+	Returns
+	-------
+	changes : dict
+		field -> (current value, sheet value) for every DIFF_FIELDS field
+		that differs, empty when the product is up to date.
+	"""
+
+	changes = {}
+	for field in DIFF_FIELDS:
+		if not same_field_value(field, product_input.get(field), state.get(field)):
+			changes[field] = (state.get(field), product_input.get(field))
+	return changes
+
+
+class CatalogSnapshot:
+	"""CatalogSnapshot.
+	The live catalog loaded in bulk, so sheet rows are joined against it
+	with dict lookups instead of one query per row.
+	Parameters
+	----------
+	products : dict
+		variant SKU -> product state, see product_state.
+	categories_trie : CategoryTrie
+		every category, see query_all_categories.
+	"""
+
+	def __init__(self, products, categories_trie):
+		self.products = products
+		self.categories_trie = categories_trie
+
+	def __len__(self):
+		return len(self.products)
+
+	def sku_index(self):
+		# SKU -> product id, as used by get_product_by_sku
+		return {sku: state["id"] for sku, state in self.products.items()}
+
+
+class RequestScheduler:
+	"""RequestScheduler.
+	Runs requests under a token bucket rate limit and an AIMD window of
+	requests in flight, retrying transient errors with jittered exponential
+	backoff. The window grows additively while responses are fast and
+	halves (at most once per latency target) on throttling, server errors
+	or responses slower than the latency target.
+	Parameters
+	----------
+	rate : float, optional
+		requests per second, None for no rate limit.
+	burst : int
+		requests allowed at once when tokens have accumulated.
+	min_concurrency : int
+		smallest window of requests in flight.
+	max_concurrency : int
+		largest window of requests in flight, also the initial window.
+	latency_target : float
+		seconds above which a response counts as congestion.
+	max_retries : int
+		retries of a transient error before it is raised.
+	backoff_base : float
+		seconds of the first backoff, doubled on every retry.
+	backoff_max : float
+		upper bound of a backoff.
+	metrics : Metrics, optional
+		counts the retries, METRICS by default.
+	"""
+
+	def __init__(self, rate = SCHEDULER_RATE, burst = SCHEDULER_BURST,
+			min_concurrency = SCHEDULER_MIN_CONCURRENCY, max_concurrency = SCHEDULER_MAX_CONCURRENCY,
+			latency_target = SCHEDULER_LATENCY_TARGET, max_retries = SCHEDULER_MAX_RETRIES,
+			backoff_base = SCHEDULER_BACKOFF_BASE, backoff_max = SCHEDULER_BACKOFF_MAX, metrics = None):
+		self.rate = rate
+		self.burst = burst
+		self.min_concurrency = min_concurrency
+		self.max_concurrency = max_concurrency
+		self.latency_target = latency_target
+		self.max_retries = max_retries
+		self.backoff_base = backoff_base
+		self.backoff_max = backoff_max
+
+		self.window = float(max_concurrency)
+		self.in_flight = 0
+		self.last_decrease = 0.0
+		self.condition = threading.Condition()
+
+		self.tokens = float(burst)
+		self.last_refill = time.monotonic()
+		self.bucket_lock = threading.Lock()
+
+		self.retries = 0
+		self.random = random.Random()
+		self.metrics = metrics if metrics is not None else METRICS
+
+	def call(self, fn, *args, idempotent = True):
+		"""call.
+		Parameters
+		----------
+		fn : callable
+			sends the request, raising TransientRequestError when it may be retried.
+		*args
+			arguments of fn.
+		idempotent : bool
+			whether the request can be sent again when it may already have
+			been applied. Queries and updates can, create mutations can not.
+		Returns
+		-------
+		result
+			what fn returned.
+		Raises
+		------
+		TransientRequestError
+			when the request still fails after max_retries retries.
+		RequestOutcomeUnknown
+			when a request that is not idempotent may have been applied.
+		"""
+
+		attempt = 0
+		while True:
+			self.take_token()
+			self.acquire()
+			start = time.monotonic()
+			try:
+				result = fn(*args)
+			except TransientRequestError as e:
+				self.release(congested = True)
+				if e.maybe_applied and not idempotent:
+					raise RequestOutcomeUnknown(str(e)) from e
+				attempt += 1
+				if attempt > self.max_retries:
+					raise
+				with self.condition:
+					self.retries += 1
+				self.metrics.record_retry()
+				delay = self.backoff(attempt, e.retry_after)
+				print("Transient error ({0}), retry {1} in {2:.2f}s".format(e, attempt, delay), file = sys.stderr)
+				time.sleep(delay)
+				continue
+			except BaseException:
+				self.release(congested = False, latency = None)
+				raise
+
+			latency = time.monotonic() - start
+			self.release(congested = latency > self.latency_target, latency = latency)
+			return result
+
+	def reserve(self, concurrency):
+		# Raise max_concurrency, and the window, to at least concurrency requests in flight
+		with self.condition:
+			if concurrency > self.max_concurrency:
+				self.max_concurrency = concurrency
+				self.window = max(self.window, float(concurrency))
+				self.condition.notify_all()
+
+	def backoff(self, attempt, retry_after = None):
+		# Full jitter exponential backoff, never shorter than the server's Retry-After
+		delay = self.random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+		if retry_after is not None:
+			delay = max(delay, min(retry_after, self.backoff_max))
+		return delay
+
+	def take_token(self):
+		if self.rate is None:
+			return
+
+		while True:
+			with self.bucket_lock:
+				now = time.monotonic()
+				self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+				self.last_refill = now
+				if self.tokens >= 1:
+					self.tokens -= 1
+					return
+				wait = (1 - self.tokens) / self.rate
+			time.sleep(wait)
+
+	def acquire(self):
+		with self.condition:
+			while self.in_flight >= int(self.window):
+				self.condition.wait()
+			self.in_flight += 1
+
+	def release(self, congested, latency = None):
+		with self.condition:
+			self.in_flight -= 1
+			now = time.monotonic()
+			if congested:
+				# halve once per latency target so a burst of failures counts as one signal
+				if now - self.last_decrease >= self.latency_target:
+					self.window = max(self.min_concurrency, self.window / 2)
+					self.last_decrease = now
+			elif latency is not None:
+				self.window = min(self.max_concurrency, self.window + 1 / self.window)
+			self.condition.notify_all()
+
+
+class CatalogRequests:
+	"""CatalogRequests.
+	Requests shared by ETLDataGetter and AsyncETLDataGetter. Every operation
+	is written once, as a generator of steps (the *_steps methods): it
+	yields (query, variables) for each request it needs and is sent the
+	parsed response back, or has the error of the request thrown in. The
+	client's run method sends the requests over its transport, so the same
+	operation returns its result on ETLDataGetter and a coroutine of it on
+	AsyncETLDataGetter.
+	Subclasses set sku_index and catalog_snapshot and implement run.
+	"""
+
+	def run(self, steps):
+		"""run.
+		Parameters
+		----------
+		steps : generator
+			steps of an operation, see CatalogRequests.
+		Returns
+		-------
+		result : object
+			value returned by the steps.
+		"""
+
+		raise NotImplementedError
+
+	def paginate_steps(self, query, connection, variables = None, page_size = PAGE_SIZE):
+		# Every node of a connection in a list, see ETLDataGetter.paginate
+		variables = dict(variables or {}, first = page_size, after = None)
+
+		nodes = []
+		while True:
+			response = yield query, dict(variables)
+			page = response["data"][connection]
+			nodes.extend(edge["node"] for edge in page["edges"])
+			if not page["pageInfo"]["hasNextPage"]:
+				return nodes
+			variables["after"] = page["pageInfo"]["endCursor"]
+
+	def send_create_steps(self, query, variables, find_steps, find_first = False):
+		"""send_create_steps.
+		Parameters
+		----------
+		query : str
+			create mutation to send.
+		variables : dict
+			variables of the mutation.
+		find_steps : callable
+			returns the steps looking the object up, they return its id or
+			None when it does not exist.
+		find_first : bool
+			look the object up before sending the mutation at all.
+		Returns
+		-------
+		response : dict
+			response to the mutation, None when the object was found.
+		id : str
+			id of the object found, None when the mutation was sent.
+		"""
+
+		attempt = 0
+		while True:
+			if find_first:
+				object_id = yield from find_steps()
+				if object_id is not None:
+					return None, object_id
+			try:
+				return (yield query, variables), None
+			except RequestOutcomeUnknown as e:
+				# the server may have created the object, only send the mutation again when it did not
+				attempt += 1
+				if attempt > SCHEDULER_MAX_RETRIES:
+					raise
+				print("No response to {0} ({1}), looking it up before sending it again".format(
+					operation_name(query), e), file = sys.stderr)
+				find_first = True
+
+	def create_product_type(self, **kwargs):
+		"""create a product type.
+		Parameters
+		----------
+		**kwargs : dict, optional
+			overrides the default value set to create the type refer to
+			the ProductTypeInput graphQL type to know what can be
+			overriden.
+		Returns
+		-------
+		id : str
+			the id of the productType created.
+		Raises
+		------
+		ProductMutationError
+			when productErrors is not an empty list.
+		"""
+
+		return self.run(self.create_product_type_steps(**kwargs))
+
+	def create_product_type_steps(self, **kwargs):
+		default_kwargs = {
+			"name": "default",
+			"hasVariants": False,
+			"productAttributes": [],
+			"variantAttributes": [],
+			"isDigital": "false",
+		}
+
+		default_kwargs.update(kwargs)
+
+		variables = {
+			"input": default_kwargs
+		}
+
+		response, product_type_id = yield from self.send_create_steps(
+			PRODUCT_TYPE_CREATE_MUTATION, variables, lambda: self.find_product_type_steps(default_kwargs["name"]))
+		if response is None:
+			return product_type_id
+
+		errors = response["data"]["productTypeCreate"]["productErrors"]
+		handle_product_errors(errors)
+
+		return response["data"]["productTypeCreate"]["productType"]["id"]
+
+	def create_product(self, product_type_id, **kwargs):
+		"""create a product.
+		Parameters
+		----------
+		product_type_id : str
+			product type id required to create the product.
+		**kwargs : dict, optional
+			overrides the default value set to create the product refer to
+			the ProductCreateInput graphQL type to know what can be
+			overriden.
+		Returns
+		-------
+		id : str
+			the id of the product created.
+		Raises
+		------
+		ProductMutationError
+			when productErrors is not an empty list.
+		"""
+
+		return self.run(self.create_product_steps(product_type_id, **kwargs))
+
+	def find_product_type_steps(self, name):
+		# Id of the product type named name, None when there is none
+		response = yield PRODUCT_TYPE_SEARCH_QUERY, {"search": name}
+		for edge in response["data"]["productTypes"]["edges"]:
+			if edge["node"]["name"] == name:
+				return edge["node"]["id"]
+
+	def create_product_steps(self, product_type_id, find_first = False, **kwargs):
+		# find_first looks the SKU up before creating it, for rows of a batch that got no response
+		default_kwargs = {
+			"name": "default",
+			"description": "default",
+			"productType": product_type_id,
+			"basePrice": 0.0,
+			"sku": "default"
+		}
+
+		default_kwargs.update(kwargs)
+
+		variables = {
+			"input": default_kwargs
+		}
+
+		response, product_id = yield from self.send_create_steps(
+			PRODUCT_CREATE_MUTATION, variables, lambda: self.get_product_by_sku_steps(default_kwargs["sku"]), find_first)
+		if response is None:
+			return product_id
+
+		errors = response["data"]["productCreate"]["productErrors"]
+		handle_product_errors(errors)
+
+		return response["data"]["productCreate"]["product"]["id"]
+
+	def get_product(self, product_id, profile = "full"):
+		"""get_product.
+		Parameters
+		----------
+		product_id : str
+			product id required to query the product.
+		profile : str
+			fields to select, a key of PRODUCT_PROFILES: "minimal", "sync"
+			or "full".
+		Returns
+		-------
+		product : dict
+			the product object.
+		"""
+
+		return self.run(self.get_product_steps(product_id, profile))
+
+	def get_product_steps(self, product_id, profile = "full"):
+		variables = {
+			"id": product_id
+		}
+
+		# * Definition: product(id: ID, slug: String): Product
+		response = yield product_query(profile), variables
+
+		return response["data"]["product"]
+
+	def update_product(self, product_id, product, fields = None):
+		"""update_product.
+		Parameters
+		----------
+		product_id : str
+			product id required to query the product.
+		product : Product
+			product with fields to update to
+		fields : list, optional
+			only send these ProductInput fields, see changed_fields. All
+			of them by default.
+		Returns
+		-------
+		product : dict
+			updates the product object.
+		"""
+
+		return self.run(self.update_product_steps(product_id, product, fields))
+
+	def update_product_steps(self, product_id, product, fields = None):
+		updated_product = self.get_product_update_input(product, fields)
+
+		variables = {
+			"id": product_id,
+			"input": updated_product
+		}
+
+		# * Definition: product(id: ID, input: Product): Product
+		response = yield PRODUCT_UPDATE_MUTATION, variables
+
+		errors = response["data"]["productUpdate"]["productErrors"]
+		handle_product_errors(errors)
+
+		return response["data"]["productUpdate"]["product"]["name"] + " was updated."
+
+	def get_product_update_input(self, product, fields = None):
+		# define updated project obj from product to update from data
+		if fields is not None:
+			# a patch only carries the fields that changed
+			return {field: product[field] for field in fields}
+
+		return {
+			"category": product["category"],
+			"chargeTaxes": product["chargeTaxes"],
+			"descriptionJson": product["descriptionJson"],
+			"isPublished": product["isPublished"],
+			"name": product["name"],
+			"basePrice": product["basePrice"],
+			"taxCode": "",
+			"seo": {
+				"title": product["seo"]["title"],
+				"description": product["seo"]["description"]
+			}
+		}
+
+	def changed_fields(self, product_sku, product_id, product):
+		"""changed_fields.
+		Parameters
+		----------
+		product_sku : str
+			SKU of the product.
+		product_id : str
+			id of the product about to be updated.
+		product : dict
+			ProductCreateInput built from the sheet row.
+		Returns
+		-------
+		fields : list
+			DIFF_FIELDS that differ from the catalog snapshot, empty when the
+			update can be skipped. None when there is no snapshot of the
+			product, it must then be updated in full.
+		"""
+
+		if self.catalog_snapshot is None:
+			return None
+		state = self.catalog_snapshot.products.get(product_sku)
+		if state is None or state["id"] != product_id:
+			return None
+		return list(diff_product_fields(product, state))
+
+	def record_product_state(self, product_sku, product_id, product):
+		# Keep the snapshot in step with what was just sent, so later rows of the same SKU diff against it
+		if self.catalog_snapshot is not None:
+			state = dict(self.catalog_snapshot.products.get(product_sku) or {}, id = product_id)
+			state.update((field, product.get(field)) for field in DIFF_FIELDS)
+			self.catalog_snapshot.products[product_sku] = state
+
+	def build_batch_document(self, mutation, rows):
+		"""build_batch_document.
+		Parameters
+		----------
+		mutation : str
+			name of the mutation, a key of BATCH_MUTATIONS.
+		rows : list
+			one dict of mutation arguments per aliased field.
+		Returns
+		-------
+		query : str
+			graphQL document with one aliased mutation field per row (m0, m1, ...).
+		variables : dict
+			variables of the document, suffixed with the row index.
+		"""
+
+		variables = {}
+		for index, row in enumerate(rows):
+			for name, graphql_type in BATCH_MUTATIONS[mutation]["arguments"]:
+				variables["{0}_{1}".format(name, index)] = row.get(name)
+
+		return batch_query(mutation, len(rows)), variables
+
+	def execute_batch(self, mutation, rows, batch_size = MUTATION_BATCH_SIZE):
+		"""execute_batch.
+		Parameters
+		----------
+		mutation : str
+			name of the mutation, a key of BATCH_MUTATIONS.
+		rows : list
+			one dict of mutation arguments per row.
+		batch_size : int
+			maximum number of aliased mutations sent in one request.
+		Returns
+		-------
+		results : list
+			per row, either the mutation payload dict or the Exception raised
+			for that row, in the same order as rows. When the server refuses a
+			whole batch its rows are sent again one per request.
+		"""
+
+		return self.run(self.execute_batch_steps(mutation, rows, batch_size))
+
+	def execute_batch_steps(self, mutation, rows, batch_size = MUTATION_BATCH_SIZE):
+		results = []
+
+		for start in range(0, len(rows), batch_size):
+			batch = rows[start:start + batch_size]
+			query, variables = self.build_batch_document(mutation, batch)
+			try:
+				response = yield query, variables
+			except GraphQLError as e:
+				# a document refused with an HTTP error status
+				response = {"errors": [{"message": str(e)}]}
+			except RequestOutcomeUnknown as e:
+				# some of the objects may exist, the caller looks each row up
+				print("No response to a batch of", len(batch), mutation, "({0}), looking its rows up".format(e), file = sys.stderr)
+				results.extend([e] * len(batch))
+				continue
+
+			if len(batch) > 1 and batch_rejected(response):
+				# one row may be enough to get the document refused, the others are sent on their own
+				print("Batch of", len(batch), mutation, "rejected, sending its rows one at a time:",
+					"; ".join(error["message"] for error in response["errors"]), file = sys.stderr)
+				for row in batch:
+					results.extend((yield from self.execute_batch_steps(mutation, [row], 1)))
+				continue
+			results.extend(batch_results(response, len(batch)))
+
+		return results
+
+	def create_products_batch(self, product_type_id, products, batch_size = MUTATION_BATCH_SIZE):
+		"""create_products_batch.
+		Parameters
+		----------
+		product_type_id : str
+			product type id required to create the products.
+		products : list
+			ProductCreateInput dicts, see get_product_input.
+		batch_size : int
+			maximum number of products created per request.
+		Returns
+		-------
+		results : list
+			per product, the id of the product created or the Exception raised.
+		"""
+
+		return self.run(self.create_products_batch_steps(product_type_id, products, batch_size))
+
+	def create_products_batch_steps(self, product_type_id, products, batch_size = MUTATION_BATCH_SIZE):
+		rows = [{"input": dict(product, productType = product_type_id)} for product in products]
+		results = yield from self.execute_batch_steps("productCreate", rows, batch_size)
+
+		ids = []
+		for product, result in zip(products, results):
+			if isinstance(result, RequestOutcomeUnknown):
+				# the batch got no response, create the product on its own unless its SKU exists
+				try:
+					result = yield from self.create_product_steps(product_type_id, find_first = True, **product)
+				except Exception as e:
+					result = e
+				ids.append(result)
+			else:
+				ids.append(result if isinstance(result, Exception) else result["product"]["id"])
+		return ids
+
+	def update_products_batch(self, updates, batch_size = MUTATION_BATCH_SIZE):
+		"""update_products_batch.
+		Parameters
+		----------
+		updates : list
+			(product id, product) pairs, product as accepted by update_product,
+			or (product id, product, fields) to only send those fields.
+		batch_size : int
+			maximum number of products updated per request.
+		Returns
+		-------
+		results : list
+			per update, the id of the product updated or the Exception raised.
+		"""
+
+		return self.run(self.update_products_batch_steps(updates, batch_size))
+
+	def update_products_batch_steps(self, updates, batch_size = MUTATION_BATCH_SIZE):
+		rows = [
+			{"id": update[0], "input": self.get_product_update_input(update[1], update[2] if len(update) > 2 else None)}
+			for update in updates
+		]
+		return [
+			result if isinstance(result, Exception) else result["product"]["id"]
+			for result in (yield from self.execute_batch_steps("productUpdate", rows, batch_size))
+		]
+
+	def category_create_batch(self, categories, batch_size = MUTATION_BATCH_SIZE):
+		"""category_create_batch.
+		Parameters
+		----------
+		categories : list
+			(name, parent id or None) pairs.
+		batch_size : int
+			maximum number of categories created per request.
+		Returns
+		-------
+		results : list
+			per category, the id of the category created or the Exception raised.
+		"""
+
+		return self.run(self.category_create_batch_steps(categories, batch_size))
+
+	def category_create_batch_steps(self, categories, batch_size = MUTATION_BATCH_SIZE):
+		rows = [{"input": {"name": name}, "parent": parent_id} for name, parent_id in categories]
+		results = yield from self.execute_batch_steps("categoryCreate", rows, batch_size)
+
+		ids = []
+		for (name, parent_id), result in zip(categories, results):
+			if isinstance(result, RequestOutcomeUnknown):
+				# the batch got no response, create the category on its own unless it exists
+				try:
+					result = yield from self.category_create_steps(name, parent_id, find_first = True)
+				except Exception as e:
+					result = e
+				ids.append(result)
+			else:
+				ids.append(result if isinstance(result, Exception) else result["category"]["id"])
+		return ids
+
+	def upload_product_batch(self, product_type_id, products):
+		"""upload_product_batch.
+		Parameters
+		----------
+		product_type_id : str
+			product type id the products are created with.
+		products : list
+			product objects built from the excel sheet, sent as one batch.
+		Returns
+		-------
+		results : list
+			one result dict per product, see upload_product.
+		"""
+
+		return self.run(self.upload_product_batch_steps(product_type_id, products))
+
+	def upload_product_batch_steps(self, product_type_id, products):
+		results = [self.new_upload_result(product) for product in products]
+		product_objs = [None if "product_error" in product else self.get_product_input(product) for product in products]
+
+		# SKUs already in the index go straight to the update batch
+		creates = []
+		updates = []
+		for index, result in enumerate(results):
+			if "product_error" in products[index]:
+				# the sheet row could not be read, nothing is sent for it
+				self.fail_upload_result(result, products[index]["product_error"])
+				continue
+			update_id = self.sku_index.get(result["sku"]) if self.sku_index is not None else None
+			if products[index].get("product_unchanged"):
+				result["id"] = update_id
+				result["action"] = "unchanged"
+			elif update_id is None:
+				creates.append(index)
+			else:
+				updates.append((index, update_id))
+
+		try:
+			created = yield from self.create_products_batch_steps(
+				product_type_id, [product_objs[index] for index in creates], max(len(creates), 1))
+		except Exception as e:
+			# the whole request failed, after retries when it was transient
+			created = [e] * len(creates)
+
+		# rows rejected because their SKU exists are updated in a second batch
+		for index, product_id in zip(creates, created):
+			if isinstance(product_id, ProductMutationError) and product_id.is_duplicate_sku():
+				print("Product with SKU: " + results[index]["sku"] + " already exists. Updating Product...")
+				try:
+					updates.append((index, (yield from self.get_product_by_sku_steps(results[index]["sku"]))))
+				except Exception as e:
+					self.fail_upload_result(results[index], e)
+			elif isinstance(product_id, Exception):
+				self.fail_upload_result(results[index], product_id)
+			else:
+				results[index]["id"] = product_id
+				results[index]["action"] = "created"
+				self.index_sku(results[index]["sku"], product_id)
+				self.record_product_state(results[index]["sku"], product_id, product_objs[index])
+				print("Product", products[index]["product_name"], "with SKU", results[index]["sku"], "successfully added to database")
+
+		# in patch mode only the changed fields are sent, products without changes are left alone
+		patches = []
+		for index, update_id in updates:
+			fields = self.changed_fields(results[index]["sku"], update_id, product_objs[index])
+			if fields == []:
+				results[index]["id"] = update_id
+				results[index]["action"] = "unchanged"
+			else:
+				patches.append((index, update_id, fields))
+
+		try:
+			updated = yield from self.update_products_batch_steps(
+				[(update_id, product_objs[index], fields) for index, update_id, fields in patches], max(len(patches), 1))
+		except Exception as e:
+			updated = [e] * len(patches)
+
+		for (index, update_id, fields), product_id in zip(patches, updated):
+			if isinstance(product_id, ProductMutationError) and product_id.is_not_found():
+				yield from self.recreate_product_steps(product_type_id, product_objs[index], results[index])
+			elif isinstance(product_id, Exception):
+				self.fail_upload_result(results[index], product_id)
+			else:
+				results[index]["id"] = product_id
+				results[index]["action"] = "updated"
+				self.record_product_state(results[index]["sku"], product_id, product_objs[index])
+				print("Product with SKU", results[index]["sku"], "successfully updated in the database")
+
+		return results
+
+	def upload_product(self, product_type_id, product):
+		"""upload_product.
+		Parameters
+		----------
+		product_type_id : str
+			product type id the product is created with.
+		product : dict
+			product object built from the excel sheet.
+		Returns
+		-------
+		result : dict
+			sku, sheet row, action taken ("created", "updated", "unchanged" or
+			"failed"), product id, error and product input hash. Rows that
+			could not be parsed (product_error set) fail without a request.
+		"""
+
+		return self.run(self.upload_product_steps(product_type_id, product))
+
+	def upload_product_steps(self, product_type_id, product):
+		result = self.new_upload_result(product)
+		if "product_error" in product:
+			# the sheet row could not be read, nothing is sent for it
+			return self.fail_upload_result(result, product["product_error"])
+		product_obj = self.get_product_input(product)
+
+		sku = product["product_sku"]
+		update_id = self.sku_index.get(sku) if self.sku_index is not None else None
+
+		if product.get("product_unchanged"):
+			result["id"] = update_id
+			result["action"] = "unchanged"
+			return result
+
+		if update_id is None:
+			try:
+				result["id"] = yield from self.create_product_steps(product_type_id, **product_obj)
+				result["action"] = "created"
+				self.index_sku(sku, result["id"])
+				self.record_product_state(sku, result["id"], product_obj)
+				print("Product", product["product_name"], "with SKU", sku, "successfully added to database")
+				return result
+			except ProductMutationError as e:
+				# only an existing SKU means the product should be updated instead
+				if not e.is_duplicate_sku():
+					return self.fail_upload_result(result, e)
+				print("Product with SKU: " + sku + " already exists. Updating Product...")
+			except Exception as e:
+				return self.fail_upload_result(result, e)
+
+		try:
+			if update_id is None:
+				update_id = yield from self.get_product_by_sku_steps(sku)
+			result["id"] = update_id
+			# in patch mode only the changed fields are sent, nothing when none changed
+			fields = self.changed_fields(sku, update_id, product_obj)
+			if fields == []:
+				result["action"] = "unchanged"
+				return result
+			yield from self.update_product_steps(update_id, product_obj, fields)
+			result["action"] = "updated"
+			self.record_product_state(sku, update_id, product_obj)
+			print("Product with SKU", sku, "successfully updated in the database")
+		except ProductMutationError as e:
+			if e.is_not_found():
+				return (yield from self.recreate_product_steps(product_type_id, product_obj, result))
+			self.fail_upload_result(result, e)
+		except Exception as e:
+			self.fail_upload_result(result, e)
+
+		return result
+
+	def recreate_product_steps(self, product_type_id, product_obj, result):
+		# The indexed product was deleted elsewhere (stale SKU index or catalog cache), create the SKU again
+		sku = result["sku"]
+		print("Product with SKU", sku, "no longer exists. Creating Product...")
+		if self.sku_index is not None:
+			self.sku_index.pop(sku, None)
+		if self.catalog_snapshot is not None:
+			self.catalog_snapshot.products.pop(sku, None)
+
+		try:
+			result["id"] = yield from self.create_product_steps(product_type_id, **product_obj)
+			result["action"] = "created"
+			self.index_sku(sku, result["id"])
+			self.record_product_state(sku, result["id"], product_obj)
+		except Exception as e:
+			result["id"] = None
+			self.fail_upload_result(result, e)
+		return result
+
+	def new_upload_result(self, product):
+		return {
+			"sku": product["product_sku"],
+			"row": product.get("product_row"),
+			"action": None,
+			"id": None,
+			"error": None,
+			"hash": product.get("product_hash"),
+			"image_url": product.get("product_image_url")
+		}
+
+	def fail_upload_result(self, result, error):
+		result["action"] = "failed"
+		result["error"] = str(error)
+		print("Product with SKU", result["sku"], "could not be uploaded:", error)
+		return result
+
+	def get_product_input(self, product):
+		# Map a product object from the excel sheet to a ProductCreateInput
+		return {
+			'name': product["product_name"],
+			'sku': product["product_sku"],
+			'descriptionJson': product["product_description"],
+			'chargeTaxes': True,
+			'isPublished': True,
+			'trackInventory': False,
+			'category': product["product_category_id"],
+			'basePrice': product["product_price"],
+			'weight': product["product_weight"],
+			'seo': {
+				"title" : product["product_seo_title"],
+				"description" : product["product_seo_description"]
+			}
+			# product_image_url is uploaded by the image stage, see ImagePipeline
+		}
+
+	def category_create(self, name, parent_id = None):
+		"""category_create.
+		Parameters
+		----------
+		name : str
+			name of the category.
+		parent_id : str, optional
+			id of the parent category, None for a top level category.
+		Returns
+		-------
+		id : str
+			the id of the category created.
+		Raises
+		------
+		ProductMutationError
+			when productErrors is not an empty list.
+		"""
+
+		return self.run(self.category_create_steps(name, parent_id))
+
+	def category_create_steps(self, name, parent_id = None, find_first = False):
+		# find_first looks the category up before creating it, for rows of a batch that got no response
+		category = {
+			"name" : name
+		}
+
+		variables = {
+			"input": category,
+		}
+
+		if parent_id is not None:
+			variables["parent"] = parent_id
+
+		response, category_id = yield from self.send_create_steps(
+			CATEGORY_CREATE_MUTATION, variables, lambda: self.find_category_steps(name, parent_id), find_first)
+		if response is None:
+			return category_id
+
+		errors = response["data"]["categoryCreate"]["productErrors"]
+		handle_product_errors(errors)
+
+		return response["data"]["categoryCreate"]["category"]["id"]
+
+	def find_category_steps(self, name, parent_id = None):
+		# Id of the category named name under parent_id, None when there is none
+		response = yield CATEGORY_SEARCH_QUERY, {"search": name}
+		for edge in response["data"]["categories"]["edges"]:
+			node = edge["node"]
+			if node["name"] == name and (node["parent"] or {}).get("id") == parent_id:
+				return node["id"]
+
+	def query_all_categories(self):
+		"""query_all_categories.
+		Pages through every category once, selecting each node's parent id in
+		the same pass, and builds the category tree in memory.
+		Returns
+		-------
+		trie : CategoryTrie
+			every category in the database, as used by deepest_id.
+		"""
+
+		return self.run(self.query_all_categories_steps())
+
+	def query_all_categories_steps(self):
+		return CategoryTrie.from_nodes((yield from self.paginate_steps(CATEGORIES_QUERY, "categories")))
+
+	def get_product_by_sku(self, product_sku):
+		"""get_product_by_sku.
+		Parameters
+		----------
+		product_sku : str
+			product sku to search for.
+		Returns
+		-------
+		id : ID!
+			ID of the product with the matching sku.
+		"""
+
+		return self.run(self.get_product_by_sku_steps(product_sku))
+
+	def get_product_by_sku_steps(self, product_sku):
+		with METRICS.stage("sku_lookup"):
+			if self.sku_index is not None and product_sku in self.sku_index:
+				return self.sku_index[product_sku]
+
+			variables = {
+				"search": product_sku
+			}
+
+			response = yield SKU_SEARCH_QUERY, variables
+
+			product_id = self.get_matching_sku_helper(response["data"]["products"], product_sku)
+			if product_id is not None:
+				self.index_sku(product_sku, product_id)
+
+			return product_id
+
+	def get_matching_sku_helper(self, products, product_sku):
+		for product_edge in products["edges"]:
+			for product_variants in product_edge["node"]["variants"]:
+				if product_variants["sku"] == product_sku:
+					return product_edge["node"]["id"]
+
+	def build_sku_index(self):
+		"""build_sku_index.
+		Pages through every product once and maps each variant SKU to its
+		product id, so get_product_by_sku and upserts need no search query.
+		Returns
+		-------
+		sku_index : dict
+			SKU -> product id, also stored on self.sku_index.
+		"""
+
+		return self.run(self.build_sku_index_steps())
+
+	def build_sku_index_steps(self):
+		sku_index = {}
+		for node in (yield from self.paginate_steps(SKU_INDEX_QUERY, "products")):
+			for variant in node["variants"] or []:
+				sku_index[variant["sku"]] = node["id"]
+
+		self.sku_index = sku_index
+		print("Indexed", len(sku_index), "existing SKUs")
+		return sku_index
+
+	def index_sku(self, product_sku, product_id):
+		# Record a SKU -> product id mapping if the index is in use
+		if self.sku_index is not None:
+			self.sku_index[product_sku] = product_id
+
+	def product_bulk_delete(self, ids):
+		"""product_bulk_delete.
+		Parameters
+		----------
+		ids : list
+			ids of the products to delete.
+		Returns
+		-------
+		count : int
+			number of products deleted.
+		"""
+
+		return self.run(self.product_bulk_delete_steps(ids))
+
+	def product_bulk_delete_steps(self, ids):
+		variables = {
+			"ids": ids
+		}
+
+		response = yield PRODUCT_BULK_DELETE_MUTATION, variables
+
+		return response["data"]["productBulkDelete"]["count"]
+
+	def get_all_product_ids(self, categories = None, product_types = None, skus = None):
+		"""get_all_product_ids.
+		Parameters
+		----------
+		categories : list, optional
+			only return products in these category ids.
+		product_types : list, optional
+			only return products of these product type ids.
+		skus : list, optional
+			only return products with a variant having one of these SKUs.
 		Returns
 		-------
-		product : dict
-			the product object.
+		ids : list
+			ids of every matching product, paged through with cursors.
 		"""
 
+		return self.run(self.get_all_product_ids_steps(categories, product_types, skus))
+
+	def get_all_product_ids_steps(self, categories = None, product_types = None, skus = None):
+		product_filter = {}
+		if categories:
+			product_filter["categories"] = list(categories)
+		if product_types:
+			product_filter["productTypes"] = list(product_types)
+
 		variables = {
-			"id": product_id
+			"filter": product_filter
 		}
 
-		# * Definition: product(id: ID, slug: String): Product
-		query = """
-			fragment TaxedMoneyFields on TaxedMoney {
-				currency
-				gross {
-					amount
-					localized
-				}
-				net {
-					amount
-					localized
-				}
-				tax {
-					amount
-					localized
-				}
-			}
+		sku_set = set(skus) if skus is not None else None
+		ids = []
+		for node in (yield from self.paginate_steps(PRODUCT_IDS_QUERY, "products", variables)):
+			if sku_set is None or any(variant["sku"] in sku_set for variant in node["variants"] or []):
+				ids.append(node["id"])
 
-			fragment TaxedMoneyRangeFields on TaxedMoneyRange {
-				start {
-					...TaxedMoneyFields
-				}
-				stop {
-					...TaxedMoneyFields
-				}
-			}
+		return ids
 
-			fragment ProductPricingFields on ProductPricingInfo {
-				onSale
-				discount {
-					...TaxedMoneyFields
-				}
-				discountLocalCurrency {
-					...TaxedMoneyFields
-				}
-				priceRange {
-					...TaxedMoneyRangeFields
-				}
-				priceRangeUndiscounted {
-					...TaxedMoneyRangeFields
-				}
-				priceRangeLocalCurrency {
-					...TaxedMoneyRangeFields
-				}
-			}
+	def get_description(self, input_html, sku = None):
+		# Convert description HTML to a Draft.js descriptionJson string, keys are derived from sku
+		return description_json(input_html, sku)
 
-			fragment ProductVariantFields on ProductVariant {
-				id
-				sku
-				name
-				stockQuantity
-				isAvailable
-				pricing {
-					discountLocalCurrency {
-						...TaxedMoneyFields
-					}
-					price {
-						currency
-						gross {
-							amount
-							localized
-						}
-					}
-					priceUndiscounted {
-						currency
-						gross {
-							amount
-							localized
-						}
-					}
-					priceLocalCurrency {
-						currency
-						gross {
-							amount
-							localized
-						}
-					}
-				}
-				attributes {
-					attribute {
-						id
-						name
-					}
-					values {
-						id
-						name
-						value: name
-					}
-				}
-			}
 
-			query get_product($id: ID!) {
-				product(id: $id) {
-					id
-					seoTitle
-					seoDescription
-					name
-					description
-					descriptionJson
-					publicationDate
-					isPublished
-					productType {
-						id
-						name
-					}
-					slug
-					category {
-						id
-						name
-					}
-					updatedAt
-					chargeTaxes
-					weight {
-						unit
-						value
-					}
-					thumbnail {
-						url
-						alt
-					}
-					pricing {
-						...ProductPricingFields
-					}
-					isAvailable
-					basePrice {
-						currency
-						amount
-					}
-					taxType {
-						description
-						taxCode
-					}
-					variants {
-						...ProductVariantFields
-					}
-					images {
-						id
-						url
-					}
-				}
-			}
+class ETLDataGetter(CatalogRequests):
+	def __init__(self, auth_token, endpoint_url = GQL_DEFAULT_ENDPOINT, transport = None, scheduler = None,
+			persisted_queries = PERSISTED_QUERIES):
+		"""initialize the ETLDataGetter.
+		Parameters
+		----------
+		auth_token : str
+			token used to identify calls to the graphQL endpoint.
+		endpoint_url : str, optional
+			the graphQL endpoint to be used.
+		transport : GraphQLTransport, optional
+			transport every query and mutation is sent through, a pooled
+			GraphQLTransport for endpoint_url is created by default.
+		scheduler : RequestScheduler, optional
+			rate limits, bounds and retries every request, a RequestScheduler
+			with the default settings is created by default.
+		persisted_queries : bool
+			send prepared queries (get_product) by hash, see
+			GraphQLTransport.execute_persisted.
 		"""
+		self.headers = {"Authorization": "Bearer {}".format(auth_token)}
+		self.endpoint_url = endpoint_url
+		self.transport = transport if transport is not None else GraphQLTransport(endpoint_url)
+		self.scheduler = scheduler if scheduler is not None else RequestScheduler()
+		self.persisted_queries = persisted_queries
+		# SKU -> product id, filled by build_sku_index
+		self.sku_index = None
+		# categories being created, keyed by (parent id, normalized name)
+		self.category_flights = SingleFlight()
+		# live product states updates are diffed against in patch mode, see load_catalog_snapshot
+		self.catalog_snapshot = None
 
-		response = graphql_request(
-			query, variables, self.headers, self.endpoint_url)
+	def __getattr__(self, name):
+		# Methods of saleor_gql_loader's ETLDataLoader not reimplemented here
+		# (create_warehouse, create_attribute, create_product_variant,
+		# create_category...) are looked up on first use. They send their
+		# requests with saleor_gql_loader.utils.graphql_request, so they do
+		# not go through this getter's pooled transport nor its scheduler
+		# (no connection reuse, rate limit, concurrency window or retries)
+		if name.startswith("_"):
+			raise AttributeError(name)
+		from saleor_gql_loader import ETLDataLoader
+		attribute = getattr(ETLDataLoader, name, None)
+		if not callable(attribute):
+			raise AttributeError("{0!r} object has no attribute {1!r}".format(type(self).__name__, name))
+		return attribute.__get__(self)
 
-		return response["data"]["product"]
+	def reserve_concurrency(self, concurrency):
+		# Let concurrency requests be in flight at once, the HTTP pool and the
+		# scheduler window default to HTTP_POOL_SIZE and would cap them silently
+		for limiter in (self.transport, self.scheduler):
+			if hasattr(limiter, "reserve"):
+				limiter.reserve(concurrency)
 
-	def update_product(self, product_id, product):
-		"""update_product.
+	def execute(self, query, variables = None):
+		# Route a query or mutation through the scheduler and transport with our auth headers
+		return self.scheduler.call(self.transport.execute, query, variables, self.headers,
+			idempotent = not creates_objects(query))
+
+	def execute_prepared(self, prepared, variables = None):
+		# Send a PreparedQuery, by hash when persisted queries are enabled
+		if self.persisted_queries and hasattr(self.transport, "execute_persisted"):
+			return self.scheduler.call(self.transport.execute_persisted, prepared, variables, self.headers)
+		return self.execute(prepared.query, variables)
+
+	def run(self, steps):
+		# Send the requests of an operation's steps, see CatalogRequests
+		response = error = None
+		while True:
+			try:
+				request = steps.send(response) if error is None else steps.throw(error)
+			except StopIteration as stop:
+				return stop.value
+			try:
+				if isinstance(request[0], PreparedQuery):
+					response, error = self.execute_prepared(*request), None
+				else:
+					response, error = self.execute(*request), None
+			except Exception as e:
+				response, error = None, e
+
+	def paginate(self, query, connection, variables = None, page_size = PAGE_SIZE):
+		"""paginate.
 		Parameters
 		----------
-		product_id : str
-			product id required to query the product.
-		product : Product
-			product with fields to update to
+		query : str
+			graphQL query taking $first and $after, selecting pageInfo
+			{ hasNextPage endCursor } and edges { node } on the connection.
+		connection : str
+			name of the connection field in the response data.
+		variables : dict, optional
+			other variables of the query.
+		page_size : int
+			number of nodes requested per page.
 		Returns
 		-------
-		product : dict
-			updates the product object.
+		nodes : generator
+			every node of the connection, page after page.
 		"""
 
-		# define updated project obj from product to update from data
-		updated_product = {
-			"category": product["category"],
-			"chargeTaxes": product["chargeTaxes"],
-			"descriptionJson": product["descriptionJson"],
-			"isPublished": product["isPublished"],
-			"name": product["name"],
-			"basePrice": product["basePrice"],
-			"taxCode": "",
-			"seo": {
-				"title": product["seo"]["title"],
-				"description": product["seo"]["description"]
-			}
-		}
+		for page in self.iter_pages(query, connection, variables, page_size):
+			for edge in page["edges"]:
+				yield edge["node"]
 
-		variables = {
-			"id": product_id,
-			"input": updated_product
-		}
+	def iter_pages(self, query, connection, variables = None, page_size = PAGE_SIZE):
+		# Same as paginate but yields each page of the connection, a page is only requested once the previous one is consumed
+		variables = dict(variables or {}, first = page_size, after = None)
 
-		# * Definition: product(id: ID, input: Product): Product
-		query = """
-			mutation productUpdate($id: ID!, $input: ProductInput!) {
-				productUpdate(id: $id, input: $input) {
-					product {
+		while True:
+			response = self.execute(query, variables)
+			page = response["data"][connection]
+			yield page
+			if not page["pageInfo"]["hasNextPage"]:
+				return
+			variables["after"] = page["pageInfo"]["endCursor"]
+
+	def cached_product_type(self, cache, name):
+		"""cached_product_type.
+		Parameters
+		----------
+		cache : CatalogCache
+			cache the product type id is kept in.
+		name : str
+			name of the product type.
+		Returns
+		-------
+		id : str
+			id of the product type created by an earlier run when it still
+			exists, else of a product type created now.
+		"""
+
+		product_type_id = cache.product_type_id(name)
+		if product_type_id is not None:
+			response = self.execute("""
+				query productType($id: ID!) {
+					productType(id: $id) {
 						id
-						name
-					}
-					productErrors {
-						field
-						message
-						code
 					}
 				}
-			}
+			""", {"id": product_type_id})
+			if response["data"]["productType"] is not None:
+				return product_type_id
+
+		product_type_id = self.create_product_type(name = name)
+		cache.store_product_type(name, product_type_id)
+		return product_type_id
+
+	def create_product_image(self, product_id, file_path, content_type = None, file_name = None):
+		"""create a product image.
+		Parameters
+		----------
+		product_id : str
+			id for which the product image will be created.
+		file_path : str
+			path to the image to upload, streamed from disk.
+		content_type : str, optional
+			MIME type of the image, guessed from the file name by default.
+		file_name : str, optional
+			name the image is uploaded as, the base name of file_path by default.
+		Returns
+		-------
+		id : str
+			the id of the product image created.
+		Raises
+		------
+		ProductMutationError
+			when productErrors is not an empty list.
 		"""
 
-		response = graphql_request(
-			query, variables, self.headers, self.endpoint_url)
+		from saleor_gql_loader.utils import get_operations
 
-		errors = response["data"]["productUpdate"]["productErrors"]
-		handle_errors(errors)
+		file_name = file_name or os.path.basename(file_path)
+		body = {
+			"operations": json.dumps(get_operations(product_id)),
+			"map": json.dumps({"0": ["variables.image"]}),
+			"0": (file_name, open(file_path, "rb"), content_type or mimetypes.guess_type(file_name)[0] or "application/octet-stream")
+		}
 
-		return response["data"]["productUpdate"]["product"]["name"] + " was updated."
+		try:
+			try:
+				response = self.scheduler.call(self.transport.execute_multipart, body, self.headers, idempotent = False)
+			except RequestOutcomeUnknown as e:
+				# the image may have been stored, only upload it again when the product does not have it
+				image_id = self.find_product_image(product_id, file_name)
+				if image_id is not None:
+					return image_id
+				print("No response to productImageCreate ({0}), uploading it again".format(e), file = sys.stderr)
+				response = self.scheduler.call(self.transport.execute_multipart, body, self.headers, idempotent = False)
+		finally:
+			body["0"][1].close()
+
+		errors = response["data"]["productImageCreate"]["productErrors"]
+		handle_product_errors(errors)
+
+		return response["data"]["productImageCreate"]["image"]["id"]
+
+	def find_product_image(self, product_id, file_name):
+		# Id of an image of the product stored from file_name, Saleor keeps the name (with a suffix when taken) in the url
+		stem = os.path.splitext(file_name)[0]
+		response = self.execute(PRODUCT_IMAGES_QUERY, {"id": product_id})
+		for image in (response["data"]["product"] or {}).get("images") or []:
+			if stem and stem in os.path.basename(urlsplit(image["url"]).path):
+				return image["id"]
+
+	def upload_product_images(self, images, concurrency = IMAGE_CONCURRENCY, cache_dir = IMAGE_CACHE_DIR):
+		"""upload_product_images.
+		Parameters
+		----------
+		images : iterable
+			(product id, image url or file path) pairs.
+		concurrency : int
+			images downloaded or uploaded at once.
+		cache_dir : str
+			directory downloaded images are kept in between runs.
+		Returns
+		-------
+		stats : dict
+			see ImagePipeline.close.
+		"""
+
+		self.reserve_concurrency(concurrency)
+		image_pipeline = ImagePipeline(self, ImageStore(cache_dir).load(), concurrency)
+		try:
+			for product_id, url in images:
+				image_pipeline.submit(product_id, url)
+		finally:
+			stats = image_pipeline.close()
+		return stats
 
+	def product_excel_import_all(self, concurrency = UPLOAD_CONCURRENCY, batch_size = None, path = None,
+			chunk_size = IMPORT_CHUNK_SIZE, checkpoint_path = CHECKPOINT_FILE, limit = None,
+			delta = False, hash_store_path = HASH_STORE_FILE, transform_workers = TRANSFORM_WORKERS,
+			images = False, image_concurrency = IMAGE_CONCURRENCY, image_cache_dir = IMAGE_CACHE_DIR, patch = False,
+			cache_path = None, retry_path = RETRY_FILE, retry_failed = False):
+		"""product_excel_import_all.
+		Parameters
+		----------
+		concurrency : int
+			maximum number of create/update requests in flight at once.
+		batch_size : int, optional
+			send products as aliased batch mutations of this size.
+		path : str, optional
+			.xls, .xlsx or .csv file to import, defaults to the configured excel file.
+		chunk_size : int
+			number of uploaded rows between two checkpoints.
+		checkpoint_path : str, optional
+			state file an interrupted import resumes from, None disables
+			checkpoints. It is removed once the import completes, and
+			ignored when the sheet changed since it was written.
+		limit : int, optional
+			only import the first limit rows of the sheet.
+		delta : bool
+			skip rows whose product input hashes the same as on the last run,
+			see mark_unchanged_products.
+		hash_store_path : str
+			file the row hashes are kept in between delta runs.
+		transform_workers : int
+			worker processes parsing sheet rows while products upload.
+		images : bool
+			also upload the image of the image column of every row uploaded,
+			see ImagePipeline.
+		image_concurrency : int
+			images downloaded or uploaded at once.
+		image_cache_dir : str
+			directory downloaded images are kept in between runs.
+		patch : bool
+			load the catalog with load_catalog_snapshot and only send the
+			fields of a product that changed, skipping the update when none
+			did, see changed_fields.
+		cache_path : str, optional
+			SQLite catalog cache to start from and update, see CatalogCache.
+			Delta row hashes are kept in it instead of hash_store_path.
+		retry_path : str, optional
+			file the rows that failed are listed in once the import
+			completes, see ImportRetryList. None disables it.
+		retry_failed : bool
+			only import the rows listed in retry_path by the last run of the
+			same sheet, without checkpoints.
+		Returns
+		-------
+		summary : dict
+			number of products created, updated, unchanged and failed, the
+			result of every failed row, and the image stats when images is set.
+		"""
 
-	def product_excel_import_all(self):
 		# declare location of excel file to be imported
-		location = open_workbook(EXCEL_FILE_LOCATION + EXCEL_FILE_NAME, 'r')
-		sheet = location.sheet_by_index(0)
-		num_rows_to_execute = 50
+		if path is None:
+			config = load_config(keys = EXCEL_CONFIG_KEYS)
+			path = config["EXCEL_FILE_LOCATION"] + config["EXCEL_FILE_NAME"]
+
+		source = sheet_identity(path)
+		checkpoint = None
+		if checkpoint_path is not None and not retry_failed:
+			checkpoint = ImportCheckpoint(checkpoint_path, source)
+			if checkpoint.load():
+				print("Resuming import after row", checkpoint.last_row)
+
+		retry_list = ImportRetryList(retry_path, source) if retry_path is not None else None
+		retry_rows = None
+		if retry_failed:
+			if retry_list is None or not retry_list.load():
+				print("No failed rows of this sheet to retry")
+				return {"created": 0, "updated": 0, "unchanged": 0, "failed": 0, "failures": []}
+			retry_rows = set(retry_list.rows)
+			print("Retrying", len(retry_rows), "failed rows")
+
+		self.reserve_concurrency(concurrency + (image_concurrency if images else 0))
+		cache = CatalogCache(cache_path, self.endpoint_url) if cache_path is not None else None
 
 		# create a product type of car parts, save ID
-		product_type_id = self.create_product_type(
-			name = "Car Parts"
-		)
+		if cache is not None:
+			product_type_id = self.cached_product_type(cache, "Car Parts")
+		else:
+			product_type_id = self.create_product_type(
+				name = "Car Parts"
+			)
 
 		# ! @ERIC I removed the dictionary since it just made things really confusing in your method.
 		# ! @ERIC What we should probably do, is query for ALL the categories and store them in here
 		# ! so that new categories wont be created multiple times.
-		# create categories list with all existing categories
-		categories_list = self.query_all_categories()
-		print(categories_list)
-		# create dictionary to hold all the objects imported form excel sheet
-		products = []
-
-		# iterate over each row in the sheet, pass the variables gotten from each col
-		for row in range(1, sheet.nrows)[:num_rows_to_execute]:
-			if sheet.cell_value(row, NAME_COL):
-				product_name = sheet.cell_value(row, NAME_COL)
-				if "DEL THIS ITEM" in product_name:
-					print("Product for deletion found. Skipping Product...")
-					continue
+		# create category trie with all existing categories
+		# a snapshot is only diffed against by the patch run that loaded it
+		self.catalog_snapshot = None
+		with METRICS.stage("catalog_load"):
+			if patch:
+				# one bulk load gives the categories, the SKU index and the product states
+				self.catalog_snapshot = self.load_catalog_snapshot()
+				categories_trie = self.catalog_snapshot.categories_trie
+			elif cache is not None:
+				categories_trie, self.sku_index = cache.refresh(self)
+				print("Loaded", len(categories_trie), "categories and", len(self.sku_index), "SKUs from", cache_path)
 			else:
-				continue
+				categories_trie = self.query_all_categories()
+				print("Loaded", len(categories_trie), "existing categories")
+				# load every existing SKU once so upserts need no per-row lookups
+				self.build_sku_index()
+		if checkpoint is not None:
+			self.sku_index.update(checkpoint.sku_ids)
 
-			if sheet.cell_value(row, SKU_COL):
-				product_sku = sheet.cell_value(row, SKU_COL)
-			else:
-				continue
+		def sheet_rows():
+			rows = islice(iter_sheet_rows(path), limit)
+			if retry_rows is not None:
+				rows = (row for row in rows if row[0] in retry_rows)
+			elif checkpoint is not None and checkpoint.last_row:
+				rows = (row for row in rows if checkpoint.pending(row[0]))
+			return rows
 
-			if sheet.cell_value(row, PRICE_COL):
-				product_price = float(sheet.cell_value(row, PRICE_COL))
-			else:
-				continue
+		# create every missing category before the upload, so rows only look them up
+		with METRICS.stage("category_precreate"):
+			self.ensure_categories((row_category_path(row) for row_number, row in sheet_rows()), categories_trie)
 
-			if sheet.cell_value(row, DESCRIPTION_COL):
-				product_description = self.get_description(sheet.cell_value(row, DESCRIPTION_COL))
-			else:
-				product_description = "This product has no description."
+		# rows are parsed lazily while earlier rows upload, only the upload
+		# queue is held in memory
+		rows = METRICS.timed("sheet_read", sheet_rows())
+		products = self.iter_product_objects(rows, categories_trie, transform_workers)
+
+		hash_store = None
+		if delta:
+			hash_store = CachedRowHashStore(cache).load() if cache is not None else RowHashStore(hash_store_path).load()
+			products = self.mark_unchanged_products(products, hash_store.hashes)
+
+		image_pipeline = None
+		if images:
+			image_pipeline = ImagePipeline(self, ImageStore(image_cache_dir).load(), image_concurrency)
+
+		print("Adding product objects to database")
+		summary = {"created": 0, "updated": 0, "unchanged": 0, "failed": 0, "failures": []}
+		uploaded = 0
+		result = None
+		for result in self.iter_upload_products(product_type_id, products, concurrency, batch_size):
+			summary[result["action"]] += 1
+			if image_pipeline is not None and result["id"] is not None:
+				image_pipeline.submit(result["id"], result["image_url"])
+			if result["action"] == "failed":
+				summary["failures"].append(result)
+			elif hash_store is not None:
+				hash_store.hashes[result["sku"]] = result["hash"]
+
+			# results arrive in row order, so every row up to this one is done
+			uploaded += 1
+			if checkpoint is not None:
+				if result["action"] == "failed":
+					checkpoint.failed_rows.add(result["row"])
+				if result["id"] is not None:
+					checkpoint.sku_ids[result["sku"]] = result["id"]
+			if uploaded % chunk_size == 0:
+				if hash_store is not None:
+					hash_store.save()
+				if checkpoint is not None:
+					checkpoint.commit(result["row"])
+					print("Checkpoint saved at row", result["row"])
+
+		if image_pipeline is not None:
+			summary["images"] = image_pipeline.close()
+			print("Images:", summary["images"])
+		if hash_store is not None:
+			hash_store.save()
+		# the import completed, a checkpoint is only kept for interrupted runs
+		failed_rows = {failure["row"] for failure in summary["failures"]}
+		if checkpoint is not None:
+			# rows that failed before the interruption this run resumed from
+			failed_rows |= checkpoint.failed_rows
+			checkpoint.clear()
+		if retry_list is not None:
+			retry_list.rows = failed_rows
+			retry_list.save()
+			if failed_rows:
+				print(len(failed_rows), "failed rows listed in", retry_path + ", import them again with --retry-failed")
+		if cache is not None:
+			cache.store_categories(categories_trie)
+			cache.store_sku_index(self.sku_index)
+			cache.close()
+		self.catalog_snapshot = None
+
+		print("Created", summary["created"], "updated", summary["updated"],
+			"unchanged", summary["unchanged"], "failed", summary["failed"])
+		return summary
+
+	def product_excel_dry_run(self, path = None, limit = None, output = None,
+			transform_workers = TRANSFORM_WORKERS, concurrency = EXPORT_CONCURRENCY):
+		"""product_excel_dry_run.
+		Reports what product_excel_import_all would do without sending any
+		mutation: the catalog is loaded once in bulk and every row is joined
+		against it by SKU.
+		Parameters
+		----------
+		path : str, optional
+			.xls, .xlsx or .csv file to compare, defaults to the configured excel file.
+		limit : int, optional
+			only compare the first limit rows of the sheet.
+		output : str, optional
+			file the diff records are written to as JSON lines, "-" for stdout.
+		transform_workers : int
+			worker processes parsing sheet rows.
+		concurrency : int
+			cursor chains paged at once while loading the catalog.
+		Returns
+		-------
+		summary : dict
+			number of diff records per action, see iter_catalog_diff.
+		"""
+
+		if path is None:
+			config = load_config(keys = EXCEL_CONFIG_KEYS)
+			path = config["EXCEL_FILE_LOCATION"] + config["EXCEL_FILE_NAME"]
+
+		snapshot = self.load_catalog_snapshot(concurrency)
+		rows = islice(iter_sheet_rows(path), limit)
+
+		summary = dict.fromkeys(("create", "update", "unchanged", "failed", "category-create"), 0)
+		output_file = None
+		if output is not None:
+			output_file = sys.stdout if output == "-" else open(output, "w", encoding = "utf-8")
+		try:
+			for record in self.iter_catalog_diff(rows, snapshot, transform_workers):
+				summary[record["action"]] += 1
+				if output_file is not None:
+					output_file.write(json.dumps(record) + "\n")
+		finally:
+			if output_file is not None and output_file is not sys.stdout:
+				output_file.close()
+
+		print("Dry run: create", summary["create"], "update", summary["update"],
+			"unchanged", summary["unchanged"], "failed", summary["failed"], "new categories", summary["category-create"],
+			file = sys.stderr)
+		return summary
+
+	def load_catalog_snapshot(self, concurrency = EXPORT_CONCURRENCY):
+		"""load_catalog_snapshot.
+		Loads every category and every product once, the products paged
+		with CatalogExporter. The SKU index is rebuilt from the same pages.
+		Parameters
+		----------
+		concurrency : int
+			cursor chains paged at once.
+		Returns
+		-------
+		snapshot : CatalogSnapshot
+			product states keyed by SKU and the category tree.
+		"""
+
+		self.reserve_concurrency(concurrency)
+		categories_trie = self.query_all_categories()
+		exporter = CatalogExporter(self, concurrency, query = SNAPSHOT_QUERY, categories_trie = categories_trie)
+
+		products = {}
+		for page in exporter.iter_pages():
+			for edge in page["edges"]:
+				state = product_state(edge["node"])
+				for variant in edge["node"]["variants"] or []:
+					products[variant["sku"]] = state
+
+		snapshot = CatalogSnapshot(products, categories_trie)
+		self.sku_index = snapshot.sku_index()
+		print("Loaded", len(products), "existing SKUs and", len(categories_trie), "categories", file = sys.stderr)
+		return snapshot
 
-			if sheet.cell_value(row, WEIGHT_COL):
-				product_weight = {
-					'unit': 'LB',
-					'value': float(sheet.cell_value(row, WEIGHT_COL))
+	def iter_catalog_diff(self, rows, snapshot, transform_workers = TRANSFORM_WORKERS):
+		"""iter_catalog_diff.
+		Parameters
+		----------
+		rows : iterable
+			(row number, row values) pairs, see iter_sheet_rows.
+		snapshot : CatalogSnapshot
+			live catalog the rows are compared to, it is not modified.
+		transform_workers : int
+			worker processes parsing the rows.
+		Returns
+		-------
+		records : generator
+			one dict per change, in sheet order. action is "category-create"
+			(with the category path and parent_id, the id of its deepest
+			existing ancestor) the first time a row needs a missing category,
+			then "create", "update" or "unchanged" for the row itself (with
+			sku, row, product id and changes, field -> {"old", "new"}), or
+			"failed" with the error when its cells could not be read.
+			Categories are reported as paths, SKUs repeated in the sheet are
+			compared to their previous row.
+		"""
+
+		categories_trie = snapshot.categories_trie
+		planned_categories = set()
+		# SKU -> input of an earlier row, the state the product will be in when the row is reached
+		planned_products = {}
+
+		def category_path(category_id):
+			if category_id in categories_trie:
+				return "/".join(categories_trie.path_of(category_id))
+			return category_id
+
+		for product in iter_transformed_rows(rows, transform_workers):
+			if "product_error" in product:
+				yield {
+					"action": "failed",
+					"row": product.get("product_row"),
+					"sku": product["product_sku"],
+					"id": None,
+					"changes": {},
+					"error": product["product_error"]
 				}
-			else:
-				product_weight = None
+				continue
 
-			# get and split categories into parent and child
-			if sheet.cell_value(row, CATEGORY_COL):
-				product_categories = sheet.cell_value(row, CATEGORY_COL).split('/')
-			else:
+			path = [category.strip() for category in product["product_categories"] if category.strip()]
+			category_id, depth = categories_trie.resolve(path)
+
+			for end in range(depth + 1, len(path) + 1):
+				key = tuple(normalize_category_name(name) for name in path[:end])
+				if key not in planned_categories:
+					planned_categories.add(key)
+					yield {
+						"action": "category-create",
+						"row": product.get("product_row"),
+						"path": path[:end],
+						"parent_id": category_id
+					}
+
+			# a category that does not exist yet is stood in for by its path
+			product["product_category_id"] = category_id if depth == len(path) else "/".join(path)
+			product_input = self.get_product_input(product)
+			sku = product["product_sku"]
+			state = planned_products.get(sku) or snapshot.products.get(sku)
+
+			record = {
+				"action": "create",
+				"row": product.get("product_row"),
+				"sku": sku,
+				"id": state["id"] if state is not None else None,
+				"changes": {}
+			}
+			if state is not None:
+				changes = diff_product_fields(product_input, state)
+				if "category" in changes:
+					changes["category"] = tuple(map(category_path, changes["category"]))
+				record["action"] = "update" if changes else "unchanged"
+				record["changes"] = {field: {"old": old, "new": new} for field, (old, new) in changes.items()}
+
+			planned_products[sku] = dict(product_input, id = record["id"])
+			yield record
+
+	def iter_product_objects(self, rows, categories_trie, transform_workers = TRANSFORM_WORKERS):
+		"""iter_product_objects.
+		Parameters
+		----------
+		rows : iterable
+			(row number, row values) pairs, see iter_sheet_rows.
+		categories_trie : CategoryTrie
+			existing categories, see ensure_categories. Categories still
+			missing are created on the way.
+		transform_workers : int
+			worker processes parsing the rows, see iter_transformed_rows.
+		Returns
+		-------
+		products : generator
+			product objects with their category id, for every row not skipped.
+			Rows that could not be parsed are passed on as they are, see
+			transform_rows.
+		"""
+
+		# rows are parsed in worker processes, but this generator is only ever
+		# advanced by the thread submitting uploads, so categories are resolved
+		# and created one row at a time
+		for product_object in iter_transformed_rows(rows, transform_workers):
+			if "product_error" in product_object:
+				# reported as failed by the upload stage
+				yield product_object
 				continue
 
-			# start = time.perf_counter()
-			product_category_id = self.deepest_id(product_categories, categories_list)
-			# end = time.perf_counter()
-			# print("TIME: {0}".format(end-start))
-
-			product_image_url = sheet.cell_value(row, IMAGE_COL)
-
-			# ! @ERIC Title must have at most 70 characters, this needs to be handled probably on the excel sheet side.
-			# ! @ERIC Temporary code:::
-			product_seo_title = sheet.cell_value(row, SEO_TITLE_COL)[:70]
-			# product_seo_title = sheet.cell_value(row, SEO_TITLE_COL)
-			product_seo_description = sheet.cell_value(row, SEO_DESC_COL)
-
-			#  declare and initalize a product object to pass to the products dict
-			product_object = {
-				"product_name" : product_name,
-				"product_sku" : product_sku,
-				"product_description" : product_description,
-				"product_price" : product_price,
-				"product_weight" : product_weight,
-				"product_category" : product_category_id,
-				"product_image_url" : product_image_url,
-				"product_seo_title" : product_seo_title,
-				"product_seo_description" : product_seo_description,
-				"product_category_id" : product_category_id
-			}
-
-			print("Created product object", product_name, "with SKU", product_sku)
+			with METRICS.stage("category_resolve"):
+				product_category_id = self.deepest_id(product_object["product_categories"], categories_trie)
+
+			product_object["product_category"] = product_category_id
+			product_object["product_category_id"] = product_category_id
+
+			print("Created product object", product_object["product_name"], "with SKU", product_object["product_sku"])
 			print("Found matching category ID", product_category_id)
-			# add product obj to products dict
-			products.append(product_object)
+			yield product_object
 
-		print("Adding product objects to database")
-		for product in products[:num_rows_to_execute]:
-			product_obj = {
-				'name': product["product_name"],
-				'sku': product["product_sku"],
-				'descriptionJson': product["product_description"],
-				'chargeTaxes': True,
-				'isPublished': True,
-				'trackInventory': False,
-				'category': product["product_category_id"],
-				'basePrice': product["product_price"],
-				'weight': product["product_weight"],
-				'seo': {
-					"title" : product["product_seo_title"],
-					"description" : product["product_seo_description"]
-				}
-				# ? add to createProductImage Later
-				# ? imageURL = product["product_image_url"],
-			}
+	def mark_unchanged_products(self, products, hashes):
+		"""mark_unchanged_products.
+		Parameters
+		----------
+		products : iterable
+			product objects built from the excel sheet.
+		hashes : dict
+			SKU -> product input hash uploaded by the previous run.
+		Returns
+		-------
+		products : generator
+			the same product objects with product_hash set, and
+			product_unchanged set when the hash matches and the SKU still
+			exists on the server. The upload stage sends nothing for those.
+		"""
 
-			try:
-				product_id = self.create_product(product_type_id, **product_obj)
-				print("Product", product["product_name"], "with SKU", product["product_sku"], "successfully added to database")
-			except:
-				print("Product with SKU: " + product["product_sku"] + " already exists. Updating Product...")
-				update_id = self.get_product_by_sku(product["product_sku"])
-				self.update_product(update_id, product_obj)
-				print("Product with SKU", product["product_sku"], "successfully updated in the database")
+		for product in products:
+			if "product_error" in product:
+				yield product
+				continue
+			sku = product["product_sku"]
+			product["product_hash"] = product_input_hash(self.get_product_input(product))
+			product["product_unchanged"] = (
+				hashes.get(sku) == product["product_hash"]
+				and self.sku_index is not None
+				and sku in self.sku_index
+			)
+			yield product
+
+	def upload_products(self, product_type_id, products, concurrency = UPLOAD_CONCURRENCY, batch_size = None):
+		"""upload_products.
+		Parameters
+		----------
+		product_type_id : str
+			product type id the products are created with.
+		products : iterable
+			product objects built from the excel sheet.
+		concurrency : int
+			maximum number of create/update requests in flight at once.
+		batch_size : int, optional
+			when set, products are sent as aliased batch mutations of this size
+			instead of one request per product.
+		Returns
+		-------
+		results : list
+			one result dict per product, in the same order as products.
+		"""
+
+		return list(self.iter_upload_products(product_type_id, products, concurrency, batch_size))
+
+	def iter_upload_products(self, product_type_id, products, concurrency = UPLOAD_CONCURRENCY, batch_size = None):
+		# Generator version of upload_products, products is consumed lazily
+		if batch_size:
+			batches = iter_batches(products, batch_size)
+			upload_batch = lambda batch: self.upload_product_batch(product_type_id, batch)
+		else:
+			batches = products
+			upload_batch = lambda product: [self.upload_product(product_type_id, product)]
+
+		def upload(batch):
+			with METRICS.stage("create_update"):
+				return upload_batch(batch)
+
+		if concurrency <= 1:
+			for results in map(upload, batches):
+				yield from results
+			return
+
+		with ThreadPoolExecutor(max_workers = concurrency) as executor:
+			for results in bounded_map(executor, upload, batches, concurrency * UPLOAD_QUEUE_DEPTH):
+				yield from results
 
 	# ! @David This is the method you wrote, but with different variable names and comments
 	# def get_deepest_child_id(self, product_categories, categories_dictionary, parent_id = None):
@@ -399,85 +4335,94 @@ class ETLDataGetter(ETLDataLoader):
 	# 	# If no categories left to search, return the ID of the deepest category
 	# 	return parent_id
 
-	def deepest_id(self, categories, categories_list, parent_id = None):
-		# If no categories left to search, return the parent ID
-		if not categories:
-			return parent_id
-		else:
-			# For all categories in child category list
-			for category in categories_list:
-				# If one with matching name exists
-				if categories[0] in category.values():
-					return self.deepest_id(
-						categories[1:],
-						category['children'],
-						category['id']
-					)
-			# If no matching child categories, create one
-			print('No matching category found. Creating category \"' + categories[0] + '\"')
-			new_cat_id = self.category_create(categories[0], parent_id)
-			new_cat_dict = self.create_category_dictionary(new_cat_id, categories[0])
-			categories_list.append(new_cat_dict)
-			# Search on created category
-			return self.deepest_id(
-				categories[1:],
-				categories_list[-1]['children'],
-				new_cat_id
-			)
+	def deepest_id(self, categories, categories_trie, parent_id = None):
+		"""deepest_id.
+		Parameters
+		----------
+		categories : list
+			category names from the category column split on "/".
+		categories_trie : CategoryTrie
+			existing categories, see query_all_categories.
+		parent_id : str, optional
+			id of the category the path starts under.
+		Returns
+		-------
+		id : str
+			id of the deepest category of the path, missing categories along
+			the path are created and added to categories_trie.
+		"""
 
-	def create_category_dictionary(self, id, name, children_list = None):
-		new_dict = {
-			"id": id,
-			"name": name,
-			"children" : []
-		}
+		categories = [category.strip() for category in categories if category.strip()]
+		category_id, depth = categories_trie.resolve(categories, parent_id)
 
-		if children_list is not None:
-		    new_dict["children"] = children_list
+		# If no matching child categories, create the rest of the path, once
+		# even when several threads miss the same category at the same time
+		for category in categories[depth:]:
+			category_id = self.category_flights.do(
+				(category_id, normalize_category_name(category)),
+				self.create_missing_category, category, category_id, categories_trie)
 
-		return new_dict
+		return category_id
 
-	def get_product_by_sku(self, product_sku):
-		"""get_product_by_sku.
+	def create_missing_category(self, name, parent_id, categories_trie):
+		# Create a category under parent_id unless a call that finished meanwhile already did
+		category_id, depth = categories_trie.resolve([name], parent_id)
+		if depth == 1:
+			return category_id
+
+		print('No matching category found. Creating category \"' + name + '\"')
+		category_id = self.category_create(name, parent_id)
+		categories_trie.add(category_id, name, parent_id)
+		return category_id
+
+	def ensure_categories(self, paths, categories_trie, batch_size = MUTATION_BATCH_SIZE, concurrency = UPLOAD_CONCURRENCY):
+		"""ensure_categories.
+		Creates every category of paths missing from categories_trie, breadth
+		first: all the missing categories of one tree level are sent as
+		batched categoryCreate mutations before the next level, and each
+		category is created once however many paths share it.
 		Parameters
 		----------
-		product_sku : str
-			product sku to search for.
+		paths : iterable
+			category paths, lists of names from the outermost category, None
+			entries are ignored.
+		categories_trie : CategoryTrie
+			existing categories, the created ones are added to it.
+		batch_size : int
+			categories created per request.
+		concurrency : int
+			maximum number of requests in flight for one level.
 		Returns
 		-------
-		id : ID!
-			ID of the product with the matching sku.
+		count : int
+			number of categories created.
 		"""
 
-		variables = {
-			"search": product_sku
-		}
-
-		query = """
-			query products($search: String!) {
-				products(first: 100, filter: {search: $search}) {
-					edges {
-						node {
-							id
-							variants {
-								sku
-							}
-						}
-					}
-				}
-			}
-		"""
+		levels = missing_category_levels(paths, categories_trie)
 
-		response = graphql_request(
-			query, variables, self.headers, self.endpoint_url)
+		def create_batch(batch):
+			try:
+				return self.category_create_batch(batch, batch_size)
+			except Exception as e:
+				# the whole request failed, after retries when it was transient
+				return [e] * len(batch)
 
-		return self.get_matching_sku_helper(response["data"]["products"], product_sku)
+		created = 0
+		with ThreadPoolExecutor(max_workers = max(concurrency, 1)) as executor:
+			for level in sorted(levels):
+				categories = level_categories(levels[level], categories_trie)
+				print("Creating", len(categories), "missing level", level, "categories")
+				batches = [categories[start:start + batch_size] for start in range(0, len(categories), batch_size)]
+				results = executor.map(create_batch, batches)
+				for batch, batch_results in zip(batches, results):
+					for (name, parent_id), category_id in zip(batch, batch_results):
+						if isinstance(category_id, Exception):
+							print('Category \"' + name + '\" could not be created:', category_id)
+							continue
+						categories_trie.add(category_id, name, parent_id)
+						created += 1
 
-	def get_matching_sku_helper(self, products, product_sku):
-		for product_edge in products["edges"]:
-			for product_variants in product_edge["node"]["variants"]:
-				if product_variants["sku"] == product_sku:
-					return product_edge["node"]["id"]
+		return created
 
 	def get_category_by_name(self, category_name):
 		"""get_product_by_sku.
@@ -508,8 +4453,7 @@ class ETLDataGetter(ETLDataLoader):
 			}
 		"""
 
-		response = graphql_request(
-			query, variables, self.headers, self.endpoint_url)
+		response = self.execute(query, variables)
 
 		return self.get_category_by_name_helper(response["data"]["categories"], category_name)
 
@@ -519,110 +4463,6 @@ class ETLDataGetter(ETLDataLoader):
 				return category_edge["node"]["id"]
 
 
-	def category_create(self, name, parent_id = None):
-	    """create a category
-	    Parameters
-	    ----------
-	    **kwargs : dict, optional
-	    overrides the default value set to create the category refer to
-	    the productTypeCreateInput graphQL type to know what can be
-	    overriden.
-	    Returns
-	    -------
-	    id : str
-		the id of the productType created.
-	    Raises
-	    ------
-	    Exception
-		when productErrors is not an empty list.
-	    """
-
-	    category = {
-			"name" : name
-		}
-
-	    variables = {
-		    "input": category,
-	    }
-
-	    if parent_id is not None:
-		    variables["parent"] = parent_id
-
-	    query = """
-		    mutation createCategory($input: CategoryInput!, $parent: ID) {
-			    categoryCreate(input: $input, parent: $parent) {
-				    category {
-					    id
-				    }
-				    productErrors {
-					    field
-					    message
-					    code
-				    }
-			    }
-		    }
-	    """
-
-	    response = graphql_request(
-		    query, variables, self.headers, self.endpoint_url)
-
-	    errors = response["data"]["categoryCreate"]["productErrors"]
-	    handle_errors(errors)
-
-	    return response["data"]["categoryCreate"]["category"]["id"]
-
-	def query_all_categories(self):
-	    """create a category
-	    Parameters
-	    ----------
-		None
-	    Returns
-	    -------
-	    list : list
-		list of all the categories in the database.
-	    Raises
-	    ------
-	    Exception
-		when productErrors is not an empty list.
-	    """
-
-	    variables = {}
-
-	    query = """
-			query categories {
-				categories(first: 100) {
-					edges {
-						node {
-							name
-							id
-							children(first: 100){
-								edges {
-									node {
-										name
-										id
-									}
-								}
-							}
-							ancestors(first: 100){
-								edges {
-									node {
-										name
-										id
-									}
-								}
-							}
-						}
-					}
-				}
-			}
-		"""
-
-	    response = graphql_request(
-		    query, variables, self.headers, self.endpoint_url)
-
-		# Return edges of all categories
-	    return self.get_parent_categories(response["data"]["categories"]["edges"])
-
 	def get_category_children(self, name):
 		"""get_product_by_sku.
 		Parameters
@@ -668,8 +4508,7 @@ class ETLDataGetter(ETLDataLoader):
 			}
 		"""
 
-		response = graphql_request(
-			query, variables, self.headers, self.endpoint_url)
+		response = self.execute(query, variables)
 
 		return self.get_category_children_helper(response["data"]["categories"], name)
 
@@ -680,146 +4519,909 @@ class ETLDataGetter(ETLDataLoader):
 				return category_edge["node"]["children"]["edges"]
 
 
-	def get_parent_categories(self, categories):
-		# Create list for categories with no parents
-		parent_categories = []
-		final_list = []
-		# If category has no parents, add it to list
-		for category in categories:
-			if not category["node"]["ancestors"]["edges"]:
-				# Add category to list
-				parent_categories.append(category)
-				# Add category to list in proper format
-				new_list_entry = self.create_category_dictionary(category["node"]["id"], category["node"]["name"])
-				final_list.append(new_list_entry)
-		# Return the list of categories for the get_deepest_id method
-		return self.create_categories_list(final_list, parent_categories)
-
-	def create_categories_list(self, category_list, parent_categories):
-		# For all categories in parent categories
-		for category in parent_categories:
-			# if category has child categories
-			if category["node"]["children"]["edges"]:
-				# For all child categories
-				for child_category in category["node"]["children"]["edges"]:
-					# Find matching parent
-					for list_category in category_list:
-						if category["node"]["name"] in list_category.values():
-							# Create and add formatted entry to formatted parent
-							new_list_entry = self.create_category_dictionary(
-								child_category["node"]["id"],
-								child_category["node"]["name"],
-								self.get_category_children(child_category["node"]["name"])
-							)
-							list_category["children"].append(new_list_entry)
-							# Call again with chilren list and child edges
-							recursive_category_list = self.get_category_children(child_category["node"]["name"])
-							self.create_categories_list(list_category["children"], recursive_category_list)
-		return category_list
-
-	def purge_products(self):
-
-		edges = self.get_all_product_ids()
-		ids = []
+	def purge_products(self, batch_size = PURGE_BATCH_SIZE, concurrency = PURGE_CONCURRENCY,
+			categories = None, product_types = None, skus = None):
+		"""purge_products.
+		Deletes every product matching the filters, all products by default.
+		Parameters
+		----------
+		batch_size : int
+			product ids deleted per productBulkDelete request.
+		concurrency : int
+			maximum number of delete requests in flight at once.
+		categories : list, optional
+			only delete products in these category ids.
+		product_types : list, optional
+			only delete products of these product type ids.
+		skus : list, optional
+			only delete products with a variant having one of these SKUs.
+		Returns
+		-------
+		count : int
+			number of products deleted.
+		"""
 
-		for node in edges:
-			ids.append(node["node"]["id"])
-		
-		variables = {
-			"ids": ids
-		}
-	
-		query = """
-			mutation productBulkDelete($ids: [ID]!) {
-				productBulkDelete(ids: $ids) {
-					count
-				}
-			}
+		# collect every id before deleting, deleting while paging would shift the cursors
+		self.reserve_concurrency(concurrency)
+		ids = self.get_all_product_ids(categories, product_types, skus)
+		batches = [ids[start:start + batch_size] for start in range(0, len(ids), batch_size)]
+
+		if concurrency <= 1:
+			counts = list(map(self.product_bulk_delete, batches))
+		else:
+			with ThreadPoolExecutor(max_workers = concurrency) as executor:
+				counts = list(executor.map(self.product_bulk_delete, batches))
+
+		# forget the deleted products so later upserts create them again
+		if self.sku_index is not None:
+			deleted = set(ids)
+			self.sku_index = {sku: product_id for sku, product_id in self.sku_index.items() if product_id not in deleted}
+
+		print("Deleted", sum(counts), "of", len(ids), "products")
+		return sum(counts)
+
+	def iter_products(self, concurrency = EXPORT_CONCURRENCY):
+		"""iter_products.
+		Parameters
+		----------
+		concurrency : int
+			cursor chains paged at once, see CatalogExporter.
+		Returns
+		-------
+		products : generator
+			export record (see EXPORT_FIELDS) of every product.
 		"""
 
-		response = graphql_request(
-			query, variables, self.headers, self.endpoint_url)
+		self.reserve_concurrency(concurrency)
+		for page in CatalogExporter(self, concurrency).iter_pages():
+			for edge in page["edges"]:
+				yield product_record(edge["node"])
 
-		return None
+	def export_products(self, output, format = None, concurrency = EXPORT_CONCURRENCY):
+		"""export_products.
+		Streams the live catalog to a file, holding at most EXPORT_QUEUE_DEPTH
+		pages (and one Parquet row group) in memory.
+		Parameters
+		----------
+		output : str
+			file to write, "-" for stdout.
+		format : str, optional
+			"jsonl", "csv" or "parquet", guessed from the output extension by default.
+		concurrency : int
+			cursor chains paged at once, see CatalogExporter.
+		Returns
+		-------
+		count : int
+			number of products written.
+		"""
 
-	def get_all_product_ids(self):
-		variables = {}
+		self.reserve_concurrency(concurrency)
+		return CatalogExporter(self, concurrency).export(output, format)
 
-		query = """
-			query products {
-				products(first: 100) {
-					edges {
-						node {
-							id
-						}
-					}
-				}
-			}
+
+def product_record(node):
+	# Flatten a product node of EXPORT_QUERY into an export record
+	category = node.get("category") or {}
+	base_price = node.get("basePrice") or {}
+	weight = node.get("weight") or {}
+	return {
+		"id": node["id"],
+		"name": node.get("name"),
+		"slug": node.get("slug"),
+		"skus": [variant["sku"] for variant in node.get("variants") or []],
+		"category_id": category.get("id"),
+		"category": category.get("name"),
+		"price": base_price.get("amount"),
+		"currency": base_price.get("currency"),
+		"weight": weight.get("value"),
+		"weight_unit": weight.get("unit"),
+		"seo_title": node.get("seoTitle"),
+		"seo_description": node.get("seoDescription"),
+		"is_published": node.get("isPublished"),
+		"updated_at": node.get("updatedAt"),
+		"description_json": node.get("descriptionJson")
+	}
+
+
+class JSONLinesExportWriter:
+	# One JSON object per product and line
+
+	def __init__(self, output_file):
+		self.output_file = output_file
+
+	def write(self, records):
+		self.output_file.write("".join(json.dumps(record, separators = (",", ":")) + "\n" for record in records))
+
+	def close(self):
+		pass
+
+
+class CSVExportWriter:
+	# EXPORT_FIELDS columns, SKUs joined with "|"
+
+	def __init__(self, output_file):
+		self.writer = csv.DictWriter(output_file, EXPORT_FIELDS)
+		self.writer.writeheader()
+
+	def write(self, records):
+		self.writer.writerows(dict(record, skus = "|".join(record["skus"])) for record in records)
+
+	def close(self):
+		pass
+
+
+class ParquetExportWriter:
+	# EXPORT_FIELDS columns, written one row group of EXPORT_PARQUET_ROW_GROUP rows at a time
+
+	def __init__(self, path, row_group_size = EXPORT_PARQUET_ROW_GROUP):
+		import pyarrow
+		import pyarrow.parquet
+
+		types = dict.fromkeys(EXPORT_FIELDS, pyarrow.string())
+		types.update(
+			skus = pyarrow.list_(pyarrow.string()),
+			price = pyarrow.float64(),
+			weight = pyarrow.float64(),
+			is_published = pyarrow.bool_()
+		)
+		self.pyarrow = pyarrow
+		self.schema = pyarrow.schema([(field, types[field]) for field in EXPORT_FIELDS])
+		self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+		self.row_group_size = row_group_size
+		self.rows = []
+
+	def write(self, records):
+		self.rows.extend(records)
+		if len(self.rows) >= self.row_group_size:
+			self.flush()
+
+	def flush(self):
+		if self.rows:
+			self.writer.write_table(self.pyarrow.Table.from_pylist(self.rows, self.schema))
+			self.rows = []
+
+	def close(self):
+		self.flush()
+		self.writer.close()
+
+
+EXPORT_FORMATS = {
+	"jsonl": JSONLinesExportWriter,
+	"csv": CSVExportWriter,
+	"parquet": ParquetExportWriter
+}
+
+
+class CatalogExporter:
+	"""CatalogExporter.
+	Pages through every product and streams them to a writer. Pages of one
+	cursor chain can only be requested one after the other, so when the top
+	level categories partition the catalog each of their subtrees is paged as
+	its own chain, concurrency chains at once, the pages being handed to the
+	writer through a bounded queue.
+	Parameters
+	----------
+	getter : ETLDataGetter
+		client the pages are requested with.
+	concurrency : int
+		maximum number of cursor chains paged at once, 1 pages the whole
+		catalog as a single chain.
+	page_size : int
+		products requested per page.
+	queue_depth : int
+		pages fetched ahead of the writer.
+	query : str
+		products connection query taking $first, $after and $filter.
+	categories_trie : CategoryTrie, optional
+		categories already loaded, queried when the catalog is partitioned otherwise.
+	"""
+
+	def __init__(self, getter, concurrency = EXPORT_CONCURRENCY, page_size = PAGE_SIZE, queue_depth = EXPORT_QUEUE_DEPTH,
+			query = EXPORT_QUERY, categories_trie = None):
+		self.getter = getter
+		self.concurrency = concurrency
+		self.page_size = page_size
+		self.queue_depth = queue_depth
+		self.query = query
+		self.categories_trie = categories_trie
+
+	def count(self, product_filter):
+		response = self.getter.execute(EXPORT_COUNT_QUERY, {"filter": product_filter})
+		return response["data"]["products"]["totalCount"]
+
+	def partitions(self):
+		"""partitions.
+		Returns
+		-------
+		filters : list
+			product filters of disjoint cursor chains covering the whole
+			catalog, [{}] when it can not be split.
 		"""
 
-		response = graphql_request(
-			query, variables, self.headers, self.endpoint_url)
+		if self.concurrency <= 1:
+			return [{}]
 
-		return response["data"]["products"]["edges"]
+		categories_trie = self.categories_trie or self.getter.query_all_categories()
+		roots = [node.id for node in categories_trie.nodes.values() if node.parent is categories_trie.root]
+		if len(roots) < 2:
+			return [{}]
 
-	def get_description(self, input_html):
-		test_string = input_html
+		filters = [{"categories": [root]} for root in roots]
+		with ThreadPoolExecutor(max_workers = self.concurrency) as executor:
+			counts = list(executor.map(self.count, filters))
 
-		replace_dictionary = {
-			"<li>": "",
-			"</li>": "",
-			"<b>": "",
-			"</b>": "",
-			"<h2>": "",
-			"</h2>": "",
-			"<div>": "",
-			"</div>": "",
-			"<li>": "",
-			"</li>": "",
-			"<ul>": "",
-			"</ul>": "",
-			"<input type=\"button\" class=\"btn btn-primary\" onclick=\"location.href=\'http://sandiegoengineparts.com/p/submit-your-price\';\" value=\"Submit Your Bid\">": "",
-			"<h2 style=\"font-size: 32px;\">Don't Like the Price?": "",
-		}
-		new_set = self.replace_all_helper(test_string, replace_dictionary)
-		final_list = []
-		for line in new_set.split("\n"):
-			if not line.strip():
-				continue
-			line = line.strip()
-			final_list.append(line)
+		# products without a category are in no subtree, page everything as one chain then
+		if sum(counts) != self.count({}):
+			return [{}]
+
+		return [product_filter for product_filter, count in zip(filters, counts) if count]
+
+	def iter_pages(self):
+		"""iter_pages.
+		Returns
+		-------
+		pages : generator
+			products connections of the query, in no particular order
+			across partitions.
+		"""
 
-		return self.get_description_string(final_list)
+		partitions = self.partitions()
+		if len(partitions) <= 1:
+			for product_filter in partitions:
+				yield from self.getter.iter_pages(self.query, "products", {"filter": product_filter}, self.page_size)
+			return
 
-	def replace_all_helper(self, text, dic):
-		for i, j in dic.items():
-			text = text.replace(i, j)
-		return text
+		pages = queue.Queue(self.queue_depth)
+		stop = threading.Event()
 
-	def get_description_string(self, lines_list):
-		final_string = {
-			"blocks": [],
-			"entityMap": {}
-		}
-		for line in lines_list:
-			temp_dict = {
-				"key": ''.join(random.SystemRandom().choice(string.ascii_lowercase + string.digits) for _ in range(6)),
-				"data": {},
-				"text": f"{line}",
-				"type": "unstyled",
-				"depth": 0,
-				"entityRanges":[],
-				"inlineStyleRanges":[]
-			}
-			final_string["blocks"].append(temp_dict)
-		return json.dumps(final_string, indent=4)
+		def put(item):
+			# give up when the consumer is gone instead of blocking on a full queue
+			while not stop.is_set():
+				try:
+					pages.put(item, timeout = 0.1)
+					return True
+				except queue.Full:
+					pass
+			return False
+
+		def fetch(product_filter):
+			try:
+				for page in self.getter.iter_pages(self.query, "products", {"filter": product_filter}, self.page_size):
+					if not put(page):
+						return
+				put(None)
+			except Exception as error:
+				put(error)
+
+		executor = ThreadPoolExecutor(max_workers = self.concurrency)
+		try:
+			for product_filter in partitions:
+				executor.submit(fetch, product_filter)
+
+			pending = len(partitions)
+			while pending:
+				page = pages.get()
+				if page is None:
+					pending -= 1
+				elif isinstance(page, Exception):
+					raise page
+				else:
+					yield page
+		finally:
+			stop.set()
+			executor.shutdown(wait = True)
+
+	def export(self, output, format = None):
+		"""export.
+		Parameters
+		----------
+		output : str
+			file to write, "-" for stdout.
+		format : str, optional
+			"jsonl", "csv" or "parquet", guessed from the output extension by default.
+		Returns
+		-------
+		count : int
+			number of products written.
+		"""
+
+		if format is None:
+			extension = os.path.splitext(output)[1].lstrip(".").lower()
+			format = extension if extension in EXPORT_FORMATS else "jsonl"
+		if format not in EXPORT_FORMATS:
+			raise ValueError("unknown export format {0!r}, expected one of {1}".format(format, ", ".join(EXPORT_FORMATS)))
+
+		if format == "parquet":
+			if output == "-":
+				raise ValueError("parquet exports need an output file")
+			output_file = None
+			writer = ParquetExportWriter(output)
+		else:
+			output_file = sys.stdout if output == "-" else open(output, "w", newline = "", encoding = "utf-8")
+			writer = EXPORT_FORMATS[format](output_file)
+
+		count = 0
+		try:
+			for page in self.iter_pages():
+				records = [product_record(edge["node"]) for edge in page["edges"]]
+				writer.write(records)
+				count += len(records)
+			writer.close()
+		finally:
+			if output_file is not None and output_file is not sys.stdout:
+				output_file.close()
+
+		return count
+
+
+class AsyncGraphQLTransport:
+	"""AsyncGraphQLTransport.
+	asyncio counterpart of GraphQLTransport: one aiohttp session, opened on
+	first use in the running event loop, whose keep-alive connections are
+	shared by every coroutine sending requests.
+	Parameters
+	----------
+	endpoint_url : str
+		the graphQL endpoint url to query to.
+	pool_size : int
+		maximum number of connections kept open to the endpoint.
+	connect_timeout : float
+		seconds to wait for a connection to be established.
+	read_timeout : float
+		seconds to wait for the server to send a response.
+	compress_requests : bool
+		gzip request bodies and send them with Content-Encoding: gzip.
+	metrics : Metrics, optional
+		records every request, METRICS by default.
+	"""
+
+	def __init__(self, endpoint_url = GQL_DEFAULT_ENDPOINT, pool_size = ASYNC_POOL_SIZE,
+			connect_timeout = HTTP_CONNECT_TIMEOUT, read_timeout = HTTP_READ_TIMEOUT,
+			compress_requests = HTTP_COMPRESS_REQUESTS, metrics = None):
+		self.endpoint_url = endpoint_url
+		self.pool_size = pool_size
+		self.connect_timeout = connect_timeout
+		self.read_timeout = read_timeout
+		self.compress_requests = compress_requests
+		self.metrics = metrics if metrics is not None else METRICS
+		self.session = None
+
+	def get_session(self):
+		# aiohttp sessions belong to the event loop they are created in
+		if self.session is None:
+			import aiohttp
+
+			self.session = aiohttp.ClientSession(
+				connector = aiohttp.TCPConnector(limit = self.pool_size, limit_per_host = self.pool_size),
+				timeout = aiohttp.ClientTimeout(sock_connect = self.connect_timeout, sock_read = self.read_timeout),
+				headers = {"Accept-Encoding": "gzip, deflate"})
+		return self.session
+
+	async def execute(self, query, variables = None, headers = None):
+		"""execute.
+		Parameters
+		----------
+		query : str
+			graphQL document to send.
+		variables : dict
+			variables of the document.
+		headers : dict
+			extra headers for this request (authorization).
+		Returns
+		-------
+		response : dict
+			the parsed JSON graphQL response.
+		Raises
+		------
+		TransientRequestError
+			on timeouts, connection errors and retryable HTTP statuses.
+		GraphQLError
+			when the response status code is otherwise not 200.
+		"""
+
+		return await self.post_json({
+			"query": query,
+			"variables": variables or {}
+		}, headers)
+
+	async def post_json(self, payload, headers = None, operation = None):
+		body = json.dumps(payload).encode("utf-8")
+
+		request_headers = {"Content-Type": "application/json"}
+		if self.compress_requests:
+			body = gzip.compress(body)
+			request_headers["Content-Encoding"] = "gzip"
+		if headers:
+			request_headers.update(headers)
+
+		return await self.post(body, request_headers, operation or operation_name(payload.get("query")))
+
+	async def post(self, body, headers, operation = "anonymous"):
+		import asyncio
+		import aiohttp
+
+		start = time.perf_counter()
+		try:
+			async with self.get_session().post(self.endpoint_url, data = body, headers = headers) as response:
+				content = await response.read()
+		except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+			self.metrics.record_request(operation, time.perf_counter() - start, len(body), 0, failed = True)
+			# only a timeout while reading the response leaves a request that may have been applied
+			maybe_applied = isinstance(e, asyncio.TimeoutError) and not isinstance(e, getattr(aiohttp, "ConnectionTimeoutError", ()))
+			raise TransientRequestError(str(e) or type(e).__name__, maybe_applied = maybe_applied)
+
+		# bytes on the wire, compressed when the server gzipped the response
+		received = int(response.headers.get("Content-Length") or len(content))
+		try:
+			parsed_response = parse_graphql_response(response.status, response.headers, content, self.endpoint_url)
+		except Exception:
+			self.metrics.record_request(operation, time.perf_counter() - start, len(body), received, failed = True)
+			raise
+
+		self.metrics.record_request(operation, time.perf_counter() - start, len(body), received)
+		return parsed_response
+
+	async def close(self):
+		if self.session is not None:
+			await self.session.close()
+			self.session = None
+
+	async def __aenter__(self):
+		return self
+
+	async def __aexit__(self, *exc_info):
+		await self.close()
+
+
+class AsyncETLDataGetter(CatalogRequests):
+	"""AsyncETLDataGetter.
+	ETLDataGetter for asyncio applications. The requests of CatalogRequests
+	(get_product, update_product, category_create, get_product_by_sku,
+	query_all_categories...) return coroutines here, sent through one
+	shared AsyncGraphQLTransport session; ensure_categories,
+	purge_products and product_excel_import_all are coroutines too. A
+	semaphore bounds the requests in flight, so thousands of concurrent
+	calls can share one event loop. Transient errors are retried with the
+	same jittered exponential backoff as RequestScheduler.
+	Parameters
+	----------
+	auth_token : str
+		token used to identify calls to the graphQL endpoint.
+	endpoint_url : str, optional
+		the graphQL endpoint to be used.
+	transport : AsyncGraphQLTransport, optional
+		transport every query and mutation is sent through, one for
+		endpoint_url is created by default.
+	concurrency : int
+		maximum number of requests in flight at once.
+	max_retries : int
+		retries of a transient error before it is raised.
+	backoff_base : float
+		seconds of the first backoff, doubled on every retry.
+	backoff_max : float
+		upper bound of a backoff.
+	"""
+
+	backoff = RequestScheduler.backoff
+
+	def __init__(self, auth_token, endpoint_url = GQL_DEFAULT_ENDPOINT, transport = None,
+			concurrency = ASYNC_CONCURRENCY, max_retries = SCHEDULER_MAX_RETRIES,
+			backoff_base = SCHEDULER_BACKOFF_BASE, backoff_max = SCHEDULER_BACKOFF_MAX):
+		import asyncio
+
+		self.headers = {"Authorization": "Bearer {}".format(auth_token)}
+		self.endpoint_url = endpoint_url
+		self.transport = transport if transport is not None else AsyncGraphQLTransport(endpoint_url, pool_size = concurrency)
+		self.concurrency = concurrency
+		self.semaphore = asyncio.Semaphore(concurrency)
+		self.max_retries = max_retries
+		self.backoff_base = backoff_base
+		self.backoff_max = backoff_max
+		self.random = random.Random()
+		# SKU -> product id, filled by build_sku_index
+		self.sku_index = None
+		# categories being created, keyed by (parent id, normalized name)
+		self.category_tasks = {}
+		# patch mode is not supported, every update sends the whole product
+		self.catalog_snapshot = None
+
+	async def close(self):
+		await self.transport.close()
+
+	async def __aenter__(self):
+		return self
+
+	async def __aexit__(self, *exc_info):
+		await self.close()
+
+	async def execute(self, query, variables = None):
+		# Send a query or mutation once a request slot is free, retrying transient errors
+		import asyncio
+
+		if isinstance(query, PreparedQuery):
+			query = query.query
+
+		attempt = 0
+		while True:
+			async with self.semaphore:
+				try:
+					return await self.transport.execute(query, variables, self.headers)
+				except TransientRequestError as e:
+					error = e
+
+			if error.maybe_applied and creates_objects(query):
+				raise RequestOutcomeUnknown(str(error)) from error
+			# the slot is released while backing off
+			attempt += 1
+			if attempt > self.max_retries:
+				raise error
+			METRICS.record_retry()
+			delay = self.backoff(attempt, error.retry_after)
+			print("Transient error ({0}), retry {1} in {2:.2f}s".format(error, attempt, delay), file = sys.stderr)
+			await asyncio.sleep(delay)
+
+	async def run(self, steps):
+		# Send the requests of an operation's steps with execute, see CatalogRequests
+		response = error = None
+		while True:
+			try:
+				request = steps.send(response) if error is None else steps.throw(error)
+			except StopIteration as stop:
+				return stop.value
+			try:
+				response, error = await self.execute(*request), None
+			except Exception as e:
+				response, error = None, e
+
+	async def deepest_id(self, categories, categories_trie, parent_id = None):
+		# See ETLDataGetter.deepest_id, concurrent rows missing the same category share one create task
+		import asyncio
+
+		categories = [category.strip() for category in categories if category.strip()]
+		category_id, depth = categories_trie.resolve(categories, parent_id)
+
+		for category in categories[depth:]:
+			key = (category_id, normalize_category_name(category))
+			task = self.category_tasks.get(key)
+			if task is None:
+				task = self.category_tasks[key] = asyncio.ensure_future(
+					self.create_missing_category(category, category_id, categories_trie))
+				task.add_done_callback(lambda task, key = key: self.category_tasks.pop(key, None))
+			category_id = await asyncio.shield(task)
+
+		return category_id
+
+	async def create_missing_category(self, name, parent_id, categories_trie):
+		category_id, depth = categories_trie.resolve([name], parent_id)
+		if depth == 1:
+			return category_id
+
+		print('No matching category found. Creating category \"' + name + '\"')
+		category_id = await self.category_create(name, parent_id)
+		categories_trie.add(category_id, name, parent_id)
+		return category_id
+
+	async def ensure_categories(self, paths, categories_trie, batch_size = MUTATION_BATCH_SIZE):
+		"""ensure_categories.
+		Parameters
+		----------
+		paths : iterable
+			category paths, read in a worker thread, see
+			ETLDataGetter.ensure_categories.
+		categories_trie : CategoryTrie
+			existing categories, the created ones are added to it.
+		batch_size : int
+			categories created per request, the requests of one level are
+			sent concurrently.
+		Returns
+		-------
+		count : int
+			number of categories created.
+		"""
+
+		import asyncio
+
+		levels = await asyncio.to_thread(missing_category_levels, paths, categories_trie)
+
+		async def create_batch(batch):
+			try:
+				return await self.category_create_batch(batch, batch_size)
+			except Exception as e:
+				return [e] * len(batch)
+
+		created = 0
+		for level in sorted(levels):
+			categories = level_categories(levels[level], categories_trie)
+			print("Creating", len(categories), "missing level", level, "categories")
+			batches = [categories[start:start + batch_size] for start in range(0, len(categories), batch_size)]
+			results = await asyncio.gather(*map(create_batch, batches))
+			for batch, batch_results in zip(batches, results):
+				for (name, parent_id), category_id in zip(batch, batch_results):
+					if isinstance(category_id, Exception):
+						print('Category \"' + name + '\" could not be created:', category_id)
+						continue
+					categories_trie.add(category_id, name, parent_id)
+					created += 1
+
+		return created
+
+	async def purge_products(self, batch_size = PURGE_BATCH_SIZE, concurrency = PURGE_CONCURRENCY,
+			categories = None, product_types = None, skus = None):
+		"""purge_products.
+		Deletes every product matching the filters, all products by default.
+		Parameters
+		----------
+		batch_size : int
+			product ids deleted per productBulkDelete request.
+		concurrency : int
+			maximum number of delete requests in flight at once.
+		categories : list, optional
+			only delete products in these category ids.
+		product_types : list, optional
+			only delete products of these product type ids.
+		skus : list, optional
+			only delete products with a variant having one of these SKUs.
+		Returns
+		-------
+		count : int
+			number of products deleted.
+		"""
+
+		# collect every id before deleting, deleting while paging would shift the cursors
+		ids = await self.get_all_product_ids(categories, product_types, skus)
+
+		async def batches():
+			for start in range(0, len(ids), batch_size):
+				yield ids[start:start + batch_size]
+
+		counts = [count async for count in async_bounded_map(self.product_bulk_delete, batches(), concurrency)]
+
+		if self.sku_index is not None:
+			deleted = set(ids)
+			self.sku_index = {sku: product_id for sku, product_id in self.sku_index.items() if product_id not in deleted}
+
+		print("Deleted", sum(counts), "of", len(ids), "products")
+		return sum(counts)
+
+	async def product_excel_import_all(self, concurrency = None, batch_size = None, path = None, limit = None,
+			delta = False, hash_store_path = HASH_STORE_FILE, transform_workers = TRANSFORM_WORKERS):
+		"""product_excel_import_all.
+		Same import as ETLDataGetter.product_excel_import_all, without
+		checkpoints, images, patch mode or the catalog cache. Sheet rows are
+		read and parsed in worker threads and processes while the event
+		loop uploads earlier rows.
+		Parameters
+		----------
+		concurrency : int, optional
+			maximum number of products (or batches) uploading at once, the
+			client concurrency by default.
+		batch_size : int, optional
+			send products as aliased batch mutations of this size.
+		path : str, optional
+			.xls, .xlsx or .csv file to import, defaults to the configured excel file.
+		limit : int, optional
+			only import the first limit rows of the sheet.
+		delta : bool
+			skip rows whose product input hashes the same as on the last run.
+		hash_store_path : str
+			file the row hashes are kept in between delta runs.
+		transform_workers : int
+			worker processes parsing sheet rows, see iter_transformed_rows.
+		Returns
+		-------
+		summary : dict
+			number of products created, updated, unchanged and failed and the
+			result of every failed row.
+		"""
+
+		if path is None:
+			config = load_config(keys = EXCEL_CONFIG_KEYS)
+			path = config["EXCEL_FILE_LOCATION"] + config["EXCEL_FILE_NAME"]
+		if concurrency is None:
+			concurrency = self.concurrency
+
+		import asyncio
+
+		product_type_id = await self.create_product_type(name = "Car Parts")
+
+		with METRICS.stage("catalog_load"):
+			categories_trie, sku_index = await asyncio.gather(self.query_all_categories(), self.build_sku_index())
+		print("Loaded", len(categories_trie), "existing categories")
+
+		def sheet_rows():
+			return islice(iter_sheet_rows(path), limit)
 
+		with METRICS.stage("category_precreate"):
+			await self.ensure_categories((row_category_path(row) for row_number, row in sheet_rows()), categories_trie)
+
+		hash_store = RowHashStore(hash_store_path).load() if delta else None
+		rows = iter_transformed_rows(METRICS.timed("sheet_read", sheet_rows()), transform_workers)
+
+		async def products():
+			async for product in iter_in_thread(rows, TRANSFORM_CHUNK_ROWS):
+				if "product_error" in product:
+					yield product
+					continue
+				product["product_category"] = product["product_category_id"] = await self.deepest_id(
+					product["product_categories"], categories_trie)
+				if hash_store is not None:
+					product["product_hash"] = product_input_hash(self.get_product_input(product))
+					product["product_unchanged"] = (
+						hash_store.hashes.get(product["product_sku"]) == product["product_hash"]
+						and product["product_sku"] in self.sku_index
+					)
+				yield product
+
+		async def batches():
+			batch = []
+			async for product in products():
+				batch.append(product)
+				if len(batch) >= (batch_size or 1):
+					yield batch
+					batch = []
+			if batch:
+				yield batch
+
+		async def upload(batch):
+			with METRICS.stage("create_update"):
+				if batch_size:
+					return await self.upload_product_batch(product_type_id, batch)
+				return [await self.upload_product(product_type_id, batch[0])]
+
+		print("Adding product objects to database")
+		summary = {"created": 0, "updated": 0, "unchanged": 0, "failed": 0, "failures": []}
+		async for results in async_bounded_map(upload, batches(), concurrency):
+			for result in results:
+				summary[result["action"]] += 1
+				if result["action"] == "failed":
+					summary["failures"].append(result)
+				elif hash_store is not None:
+					hash_store.hashes[result["sku"]] = result["hash"]
+
+		if hash_store is not None:
+			hash_store.save()
+
+		print("Created", summary["created"], "updated", summary["updated"],
+			"unchanged", summary["unchanged"], "failed", summary["failed"])
+		return summary
+
+
+def build_parser():
+	parser = argparse.ArgumentParser(description = "Load products from a spreadsheet into Saleor through GraphQL")
+	parser.add_argument("--env-file", help = ".env file with ETL_SECRET_ID, defaults to " + DOTENV_FILE)
+	parser.add_argument("--endpoint", help = "graphQL endpoint, defaults to GRAPHQL_ENDPOINT from the .env file")
+	parser.add_argument("--token", help = "API token, defaults to ETL_SECRET_ID from the .env file")
+	parser.add_argument("--metrics", help = "write stage and request metrics to this file, Prometheus text if it ends with .prom else JSON")
+	subparsers = parser.add_subparsers(dest = "command", required = True)
+
+	import_parser = subparsers.add_parser("import", help = "create or update products from a sheet")
+	import_parser.add_argument("--file", help = ".xls, .xlsx or .csv file, defaults to the configured excel file")
+	import_parser.add_argument("--concurrency", type = int, default = UPLOAD_CONCURRENCY)
+	import_parser.add_argument("--batch-size", type = int, help = "send products as batched mutations of this size")
+	import_parser.add_argument("--chunk-size", type = int, default = IMPORT_CHUNK_SIZE)
+	import_parser.add_argument("--checkpoint", default = CHECKPOINT_FILE, help = "state file to resume from")
+	import_parser.add_argument("--no-checkpoint", action = "store_true")
+	import_parser.add_argument("--retry-file", default = RETRY_FILE, help = "file the rows that failed are listed in")
+	import_parser.add_argument("--retry-failed", action = "store_true", help = "only import the rows that failed on the last run")
+	import_parser.add_argument("--limit", type = int, help = "only import the first LIMIT rows")
+	import_parser.add_argument("--delta", action = "store_true", help = "skip rows unchanged since the last run")
+	import_parser.add_argument("--hash-store", default = HASH_STORE_FILE)
+	import_parser.add_argument("--workers", type = int, default = TRANSFORM_WORKERS, help = "row parsing processes")
+	import_parser.add_argument("--patch", action = "store_true", help = "only send the fields that changed since the live catalog")
+	import_parser.add_argument("--cache", nargs = "?", const = CATALOG_CACHE_FILE,
+		help = "start from and update a local SQLite catalog cache, " + CATALOG_CACHE_FILE + " by default")
+	import_parser.add_argument("--images", action = "store_true", help = "also upload the image column of every row")
+	import_parser.add_argument("--image-concurrency", type = int, default = IMAGE_CONCURRENCY)
+	import_parser.add_argument("--image-cache", default = IMAGE_CACHE_DIR, help = "directory downloaded images are kept in")
+	import_parser.add_argument("--dry-run", action = "store_true", help = "compare the sheet to the live catalog, change nothing")
+	import_parser.add_argument("--diff-output", help = "with --dry-run, write the diff as JSON lines to this file, - for stdout")
+
+	purge_parser = subparsers.add_parser("purge", help = "delete products")
+	purge_parser.add_argument("--batch-size", type = int, default = PURGE_BATCH_SIZE)
+	purge_parser.add_argument("--concurrency", type = int, default = PURGE_CONCURRENCY)
+	purge_parser.add_argument("--category", action = "append", help = "only products in this category id")
+	purge_parser.add_argument("--product-type", action = "append", help = "only products of this product type id")
+	purge_parser.add_argument("--sku", action = "append", help = "only the product with this SKU")
+	purge_parser.add_argument("--all", action = "store_true", help = "delete every product, required when no filter is given")
+
+	export_parser = subparsers.add_parser("export", help = "write the live catalog as JSON lines, CSV or Parquet")
+	export_parser.add_argument("--output", default = "-", help = "file to write, - for stdout")
+	export_parser.add_argument("--format", choices = sorted(EXPORT_FORMATS), help = "defaults to the output extension, else jsonl")
+	export_parser.add_argument("--concurrency", type = int, default = EXPORT_CONCURRENCY)
+
+	bench_parser = subparsers.add_parser("bench", help = "run GQL_Benchmark against a local stub server")
+	bench_parser.add_argument("bench_args", nargs = argparse.REMAINDER)
+
+	return parser
+
+
+def main(argv = None):
+	"""main.
+	Command line entry point, see python GQL_Data_Loader.py --help.
+	"""
+
+	parser = build_parser()
+	args = parser.parse_args(argv)
+
+	if args.command == "purge":
+		filtered = bool(args.category or args.product_type or args.sku)
+		if filtered == args.all:
+			parser.error("purge needs --sku, --category or --product-type, or --all to delete the whole catalog")
+
+	if args.command == "bench":
+		import GQL_Benchmark
+		return GQL_Benchmark.main(args.bench_args)
+
+	# the .env file is only read for the values not given on the command line
+	keys = []
+	if args.token is None:
+		keys.append("ETL_SECRET_ID")
+	if args.endpoint is None:
+		keys.append("GRAPHQL_ENDPOINT")
+	if args.command == "import" and args.file is None:
+		keys.extend(EXCEL_CONFIG_KEYS)
+	config = load_config(args.env_file, tuple(keys)) if keys else {}
+
+	if args.command == "import" and args.file is None:
+		args.file = config["EXCEL_FILE_LOCATION"] + config["EXCEL_FILE_NAME"]
+	etl_data_getter = ETLDataGetter(
+		args.token if args.token is not None else config["ETL_SECRET_ID"],
+		args.endpoint if args.endpoint is not None else config["GRAPHQL_ENDPOINT"])
+
+	try:
+		return run_command(etl_data_getter, args)
+	finally:
+		if args.metrics:
+			METRICS.write(args.metrics)
+
+
+def run_command(etl_data_getter, args):
+	# Run the import, purge or export subcommand, returns the exit status
+	if args.command == "import" and args.dry_run:
+		etl_data_getter.product_excel_dry_run(
+			path = args.file,
+			limit = args.limit,
+			output = args.diff_output,
+			transform_workers = args.workers
+		)
+		return 0
+
+	if args.command == "import":
+		summary = etl_data_getter.product_excel_import_all(
+			concurrency = args.concurrency,
+			batch_size = args.batch_size,
+			path = args.file,
+			chunk_size = args.chunk_size,
+			checkpoint_path = None if args.no_checkpoint else args.checkpoint,
+			limit = args.limit,
+			delta = args.delta,
+			hash_store_path = args.hash_store,
+			transform_workers = args.workers,
+			images = args.images,
+			image_concurrency = args.image_concurrency,
+			image_cache_dir = args.image_cache,
+			patch = args.patch,
+			cache_path = args.cache,
+			retry_path = args.retry_file,
+			retry_failed = args.retry_failed
+		)
+		return 1 if summary["failed"] else 0
+
+	if args.command == "purge":
+		etl_data_getter.purge_products(
+			batch_size = args.batch_size,
+			concurrency = args.concurrency,
+			categories = args.category,
+			product_types = args.product_type,
+			skus = args.sku
+		)
+		return 0
 
-etl_data_getter = ETLDataGetter(ETL_SECRET_ID)
-etl_data_getter.product_excel_import_all()
+	if args.command == "export":
+		count = etl_data_getter.export_products(args.output, args.format, args.concurrency)
+		print("Exported", count, "products", file = sys.stderr)
+		return 0
 
-# print(etl_data_getter.get_description(None))
 
-# ! To purge all products
-# for x in range(100):
-# 	etl_data_getter.purge_products()
+if __name__ == "__main__":
+	sys.exit(main())